@@ -0,0 +1,263 @@
+"""
+Streaming export and import of tables in a chunked, compressed columnar
+format.
+
+An archive file holds one table:
+
+    MAGIC
+    header:  uint32 length, JSON {"version", "table", "columns"}
+    chunks:  uint32 rows, then per column: 1 byte encoding, uint32 length,
+             zlib-compressed column data
+    end:     uint32 0
+
+Column encodings (all little-endian):
+    i  integers: a null mask (one byte per row) and int64 deltas
+    f  floats:   a null mask and float64 values
+    s  text:     uint32 dictionary size, uint32 lengths, UTF-8 strings,
+                 then one uint32 dictionary index per row (0xFFFFFFFF is NULL)
+    j  mixed or out-of-range values, as a JSON list
+    n  every value NULL, no data
+
+Export reads `chunk_size` rows at a time from one read transaction, so
+memory use does not grow with the table and the archive is a consistent
+snapshot. Import writes everything in a single transaction with the
+table's indexes and triggers dropped and recreated at the end.
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+
+import database
+import migrations
+import rollups
+import write_behind
+
+MAGIC = b"RPSCOL1\n"
+FORMAT_VERSION = 1
+CHUNK_SIZE = 65536
+COMPRESSION_LEVEL = 6
+TABLES = ("users", "games")
+SUFFIX = ".rpscol"
+
+NULL_INDEX = 0xFFFFFFFF
+_U32 = struct.Struct("<I")
+_COLUMN = struct.Struct("<cI")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _le(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+# Column encoding
+
+def encode_column(values):
+    """Return (encoding, uncompressed bytes) for one column of a chunk."""
+    kinds = {type(value) for value in values} - {type(None)}
+    if not kinds:
+        return b"n", b""
+    mask = bytes(value is None for value in values)
+    if kinds == {int}:
+        present = [0 if value is None else value for value in values]
+        try:
+            return b"i", mask + _le(array("q", (b - a for a, b in zip([0] + present, present))))
+        except OverflowError:
+            pass  # deltas beyond 64 bits; stored as JSON below
+    elif kinds == {float}:
+        return b"f", mask + _le(array("d", (0.0 if value is None else value for value in values)))
+    elif kinds == {str}:
+        dictionary, indexes = {}, array("I")
+        for value in values:
+            if value is None:
+                indexes.append(NULL_INDEX)
+            else:
+                index = dictionary.get(value)
+                if index is None:
+                    index = dictionary[value] = len(dictionary)
+                indexes.append(index)
+        encoded = [word.encode() for word in dictionary]
+        lengths = array("I", map(len, encoded))
+        return b"s", _U32.pack(len(encoded)) + _le(lengths) + b"".join(encoded) + _le(indexes)
+    return b"j", json.dumps(values).encode()
+
+
+def decode_column(encoding, data, rows):
+    if encoding == b"n":
+        return [None] * rows
+    if encoding in (b"i", b"f"):
+        mask, values = data[:rows], _from_le("q" if encoding == b"i" else "d", data[rows:])
+        if encoding == b"i":
+            values = accumulate(values)
+        if not any(mask):
+            return list(values)
+        return [None if null else value for null, value in zip(mask, values)]
+    if encoding == b"s":
+        count = _U32.unpack_from(data)[0]
+        lengths = _from_le("I", data[4:4 + 4 * count])
+        position = 4 + 4 * count
+        dictionary = []
+        for length in lengths:
+            dictionary.append(data[position:position + length].decode())
+            position += length
+        dictionary.append(None)
+        indexes = _from_le("I", data[position:])
+        null = len(dictionary) - 1
+        return [dictionary[null if index == NULL_INDEX else index] for index in indexes]
+    if encoding == b"j":
+        return json.loads(data)
+    raise ArchiveError(f"Unknown column encoding {encoding!r}")
+
+
+# Files
+
+def write_archive(path, table, columns, chunks, level=COMPRESSION_LEVEL):
+    """Write row chunks (lists of tuples) to `path` and return the row count."""
+    header = json.dumps({"version": FORMAT_VERSION, "table": table, "columns": columns}).encode()
+    total = 0
+    with open(path, "wb") as archive:
+        archive.write(MAGIC + _U32.pack(len(header)) + header)
+        for rows in chunks:
+            if not rows:
+                continue
+            archive.write(_U32.pack(len(rows)))
+            for values in zip(*rows):
+                encoding, data = encode_column(values)
+                data = zlib.compress(data, level)
+                archive.write(_COLUMN.pack(encoding, len(data)) + data)
+            total += len(rows)
+        archive.write(_U32.pack(0))
+    return total
+
+
+def read_header(archive):
+    if archive.read(len(MAGIC)) != MAGIC:
+        raise ArchiveError("Not an archive file")
+    header = json.loads(archive.read(_U32.unpack(archive.read(4))[0]))
+    if header["version"] != FORMAT_VERSION:
+        raise ArchiveError(f"Unsupported archive version {header['version']}")
+    return header
+
+
+def read_chunks(archive, columns):
+    """Yield lists of row tuples from an open archive positioned after its header."""
+    while True:
+        rows = _U32.unpack(archive.read(4))[0]
+        if not rows:
+            return
+        decoded = []
+        for _ in columns:
+            encoding, length = _COLUMN.unpack(archive.read(_COLUMN.size))
+            decoded.append(decode_column(encoding, zlib.decompress(archive.read(length)), rows))
+        yield list(zip(*decoded))
+
+
+# Export and import
+
+def _columns(conn, table):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if not columns:
+        raise ArchiveError(f"No such table: {table}")
+    return columns
+
+
+def export_table(table, path, chunk_size=CHUNK_SIZE, level=COMPRESSION_LEVEL):
+    """Stream `table` into an archive at `path` and return the number of rows."""
+    write_behind.flush()
+    with database.transaction(label="export_table") as conn:
+        columns = _columns(conn, table)
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid")
+        total = write_archive(path, table, columns, iter(lambda: cursor.fetchmany(chunk_size), []), level)
+    logging.info("Exported %d rows of %s to %s.", total, table, path)
+    return total
+
+
+def import_table(path, table=None, on_conflict="abort"):
+    """
+    Load an archive into `table` (by default the one it was exported from)
+    and return the number of rows. `on_conflict` is 'abort', 'ignore' or
+    'replace', as in SQLite's INSERT OR ... clause.
+
+    Processes that already cached players (the leaderboard, profiles,
+    predictor models) do not see imported rows until they restart.
+    """
+    write_behind.flush()
+    with open(path, "rb") as archive:
+        header = read_header(archive)
+        table = table or header["table"]
+        columns = header["columns"]
+        sql = (f"INSERT OR {on_conflict.upper()} INTO {table} ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        total = 0
+        with database.transaction(label="import_table") as conn:
+            # Rebuilding an index once is far cheaper than updating it per row,
+            # and the rollup triggers are replaced by one backfill afterwards
+            deferred = conn.execute(
+                "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') "
+                "AND sql IS NOT NULL", (table,)).fetchall()
+            for kind, name, _ in deferred:
+                conn.execute(f"DROP {kind.upper()} {name}")
+            for rows in read_chunks(archive, columns):
+                conn.executemany(sql, rows)
+                total += len(rows)
+            for _, _, create in deferred:
+                conn.execute(create)
+    logging.info("Imported %d rows into %s from %s.", total, table, path)
+    return total
+
+
+def export_database(directory, tables=TABLES, chunk_size=CHUNK_SIZE, level=COMPRESSION_LEVEL):
+    os.makedirs(directory, exist_ok=True)
+    return {table: export_table(table, os.path.join(directory, table + SUFFIX), chunk_size, level)
+            for table in tables}
+
+
+def import_database(directory, tables=TABLES, on_conflict="abort"):
+    counts = {}
+    for table in tables:
+        path = os.path.join(directory, table + SUFFIX)
+        if os.path.exists(path):
+            counts[table] = import_table(path, table, on_conflict)
+    if counts.get("games"):
+        rollups.backfill()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the game database as compressed columnar files.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory")
+    parser.add_argument("--tables", nargs="+", default=list(TABLES))
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--level", type=int, default=COMPRESSION_LEVEL, help="zlib compression level")
+    parser.add_argument("--on-conflict", choices=["abort", "ignore", "replace"], default="abort")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    migrations.migrate()
+    if args.command == "export":
+        export_database(args.directory, args.tables, args.chunk_size, args.level)
+    else:
+        import_database(args.directory, args.tables, args.on_conflict)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Export and import throughput of archive.py, in rows/sec, and the archive
+size. The nominal dataset is 50M games; the default is smaller so a run
+takes a minute or two.
+
+Run from the repository root:
+    python -m benchmarks.bench_archive [games] [users]
+"""
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import archive
+import database
+import migrations
+import rollups
+
+SEED_CHUNK = 100_000
+USER_SQL = "INSERT INTO users (username, password, games_played, wins, losses, ties, score) VALUES (?, ?, ?, ?, ?, ?, ?)"
+GAME_SQL = ("INSERT INTO games (player1, player2, winner, timestamp, player1_move, player2_move) "
+            "VALUES (?, ?, ?, ?, ?, ?)")
+CHECKSUM_SQL = {
+    "users": "SELECT COUNT(*), TOTAL(score), TOTAL(LENGTH(password)) FROM users",
+    "games": ("SELECT COUNT(*), TOTAL(id), COUNT(winner), TOTAL(LENGTH(player1)), TOTAL(player1_move), "
+              "MIN(timestamp), MAX(timestamp) FROM games"),
+}
+
+
+def game_chunks(games, names, start):
+    rng = random.Random(7)
+    for first in range(0, games, SEED_CHUNK):
+        rows = []
+        for i in range(first, min(first + SEED_CHUNK, games)):
+            a, b = rng.sample(names, 2)
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + i // 4))
+            rows.append((a, b, rng.choice((a, b, None)), stamp, rng.randrange(3), rng.randrange(3)))
+        yield rows
+
+
+def seed(games, users):
+    names = [f"user{i}" for i in range(users)]
+    with database.transaction() as conn:
+        conn.executemany(USER_SQL, ((name, "x" * 64, 0, 0, 0, 0, random.randrange(-50, 50)) for name in names))
+    for rows in game_chunks(games, names, time.time() - games // 4):
+        with database.transaction() as conn:
+            conn.executemany(GAME_SQL, rows)
+
+
+def checksums():
+    return {table: database.fetch_one(sql) for table, sql in CHECKSUM_SQL.items()}
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(games=2_000_000, users=10_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.db")
+        database.configure(source)
+        migrations.migrate()
+        start = time.perf_counter()
+        seed(games, users)
+        print(f"seeded {games:,} games and {users:,} users in {time.perf_counter() - start:.1f}s")
+        expected = checksums()
+        db_size = os.path.getsize(source)
+
+        directory = os.path.join(tmp, "archive")
+        rss = max_rss_mb()
+        start = time.perf_counter()
+        counts = archive.export_database(directory)
+        elapsed = time.perf_counter() - start
+        total = sum(counts.values())
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"export        {total / elapsed:12,.0f} rows/sec   {elapsed:7.1f}s")
+        print(f"archive size  {size / 2 ** 20:12,.1f} MB         {size / total:7.1f} bytes/row "
+              f"(database {db_size / 2 ** 20:,.1f} MB)")
+        print(f"peak RSS growth during export {max_rss_mb() - rss:8.1f} MB")
+
+        database.configure(os.path.join(tmp, "restored.db"))
+        migrations.migrate()
+        rss = max_rss_mb()
+        start = time.perf_counter()
+        for table in archive.TABLES:
+            archive.import_table(os.path.join(directory, table + archive.SUFFIX), table)
+        elapsed = time.perf_counter() - start
+        print(f"import        {total / elapsed:12,.0f} rows/sec   {elapsed:7.1f}s (indexes rebuilt once)")
+        print(f"peak RSS growth during import {max_rss_mb() - rss:8.1f} MB")
+
+        start = time.perf_counter()
+        rollups.backfill()
+        print(f"rollup backfill after import  {time.perf_counter() - start:8.1f}s")
+
+        actual = checksums()
+        if actual != expected:
+            print(f"FAIL restored database differs: {actual} != {expected}")
+            return 1
+        print("restored database matches the source")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,77 @@
+"""
+Throughput of the multi-process game server (cluster.py) as workers are added.
+
+For each worker count the front runs here, and as many client processes as
+workers drive simulated players (benchmarks.load_test_server) at it, every
+match a best-of session over one pair of connections. A single-process
+GameServer is measured the same way for reference. Scaling is the rounds/sec
+of N workers over N times that of one worker; it can only approach 1 when
+the machine has a core for every worker, every client process and the front.
+
+Run from the repository root:
+    python -m benchmarks.bench_cluster [max_workers] [clients_per_process] [best_of]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+import cluster
+from benchmarks.load_test_server import simulated_client
+from game_server import GameServer
+
+CONCURRENCY = 200  # simulated players per client process at a time
+
+
+def client_process(port, prefix, clients):
+    async def run():
+        latencies = []
+        for wave in range(0, clients, CONCURRENCY):
+            size = min(CONCURRENCY, clients - wave)
+            await asyncio.gather(*(simulated_client(port, f"{prefix}-{wave + i}", latencies) for i in range(size)))
+        return len(latencies)
+    return asyncio.run(run())
+
+
+async def measure(server, processes, clients):
+    await server.start()
+    loop = asyncio.get_running_loop()
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        # Start the pool before the clock so process start-up is not measured
+        pool.map(abs, range(processes))
+        start = time.perf_counter()
+        rounds = await loop.run_in_executor(None, pool.starmap, client_process,
+                                            [(server.port, f"c{i}", clients) for i in range(processes)])
+        elapsed = time.perf_counter() - start
+    # The clients count rounds as they read results; the server counts whole matches once they are reported
+    await asyncio.sleep(0.2)
+    await server.stop()
+    return sum(rounds), server.matches_completed, elapsed
+
+
+def main(max_workers=4, clients=2000, best_of=15):
+    print(f"{os.cpu_count()} cores; {clients} players per client process, best of {best_of}")
+    if (os.cpu_count() or 1) < 2 * max_workers + 1:
+        print("Fewer cores than workers, client processes and the front: the larger runs share cores")
+    print(f"{'server':<12} {'matches':>8} {'rounds/sec':>11} {'scaling':>8}")
+    rounds, matches, elapsed = asyncio.run(measure(GameServer(port=0, record_results=False, best_of=best_of), 1, clients))
+    print(f"{'1 process':<12} {matches:>8} {rounds / elapsed:>11,.0f}")
+    single = None
+    workers = 1
+    while workers <= max_workers:
+        front = cluster.ClusterFront(port=0, workers=workers, record_results=False, best_of=best_of)
+        rounds, matches, elapsed = asyncio.run(measure(front, workers, clients))
+        expected = workers * clients // 2
+        if matches != expected:
+            print(f"FAIL: {workers} workers completed {matches} of {expected} matches")
+            return 1
+        throughput = rounds / elapsed
+        single = single or throughput
+        print(f"{f'{workers} workers':<12} {matches:>8} {throughput:>11,.0f} {throughput / (workers * single):>8.2f}")
+        workers *= 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
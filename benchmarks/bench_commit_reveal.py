@@ -0,0 +1,162 @@
+"""
+Cost of commit-reveal rounds (commitments.py) against plain CHOICE rounds on
+the game server.
+
+  * verification: microseconds per reveal, one verify() call each against
+    verify_many() over a round's two reveals and over a thousand
+  * throughput: rounds/sec with many matches at once on localhost
+  * latency: round p50 through a relay adding `delay_ms` each way between
+    clients and server (benchmarks.bench_udp.TcpRelay without loss), with the
+    extra time as a fraction of the player-to-player round trip
+  * a client that reveals a different move than it committed to must be
+    disconnected, and with require_commit so must one that sends a plain
+    CHOICE
+
+Both players move at once here, the worst case: each may reveal only after
+the other's COMMIT has come back through the server, so a round costs one
+extra client-server round trip, half the player-to-player round trip, plus
+the time to process the extra frames.
+
+Run from the repository root:
+    python -m benchmarks.bench_commit_reveal [matches] [best_of] [delay_ms]
+"""
+import asyncio
+import statistics
+import sys
+import time
+import timeit
+
+import commitments
+import protocol
+from benchmarks.bench_udp import TcpRelay
+from game_server import GameServer
+
+CONCURRENCY = 200
+
+
+async def client(port, name, move, commit, latencies, cheat=False):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = protocol.FrameDecoder()
+    writer.write(protocol.encode_hello(name))
+    try:
+        await protocol.read_frame(reader, decoder)  # SERVER
+        await protocol.read_frame(reader, decoder)  # the opponent's HELLO
+        while True:
+            start = time.perf_counter()
+            if commit:
+                commitment, nonce = commitments.commit(move)
+                writer.write(protocol.encode_commit(commitment))
+                msg_type, _ = await protocol.read_frame(reader, decoder)
+                if msg_type != protocol.COMMIT:
+                    return msg_type
+                writer.write(protocol.encode_reveal("paper" if cheat else move, nonce))
+            else:
+                writer.write(protocol.encode_choice(move))
+            msg_type, payload = await protocol.read_frame(reader, decoder)
+            if msg_type != protocol.RESULT:
+                return msg_type
+            latencies.append(time.perf_counter() - start)
+            if protocol.decode_result(payload).final:
+                return msg_type
+    except ConnectionError:
+        return None
+    finally:
+        writer.close()
+
+
+async def play(port, matches, commit, latencies):
+    for wave in range(0, matches, CONCURRENCY):
+        size = min(CONCURRENCY, matches - wave)
+        await asyncio.gather(*(client(port, f"{wave + i}{side}", move, commit, latencies)
+                               for i in range(size) for side, move in (("a", "rock"), ("b", "scissors"))))
+
+
+async def throughput(matches, best_of, commit):
+    server = GameServer(port=0, record_results=False, best_of=best_of)
+    await server.start()
+    latencies = []
+    start = time.perf_counter()
+    await play(server.port, matches, commit, latencies)
+    elapsed = time.perf_counter() - start
+    await server.stop()
+    return server.rounds_completed, elapsed
+
+
+async def latency(best_of, delay, commit):
+    server = GameServer(port=0, record_results=False, best_of=best_of)
+    await server.start()
+    relay = TcpRelay(server.port, 0.0, delay)
+    port = await relay.start()
+    latencies = []
+    await play(port, 4, commit, latencies)
+    relay.close()
+    await server.stop()
+    return statistics.median(latencies)
+
+
+async def cheater_is_caught():
+    server = GameServer(port=0, record_results=False, best_of=3)
+    await server.start()
+    honest, cheat = await asyncio.gather(client(server.port, "honest", "rock", True, []),
+                                         client(server.port, "cheat", "rock", True, [], cheat=True))
+    await server.stop()
+    return honest == protocol.ABORT and server.rounds_completed == 0
+
+
+async def plain_choice_is_refused():
+    server = GameServer(port=0, record_results=False, best_of=3, require_commit=True)
+    await server.start()
+    committed, plain = await asyncio.gather(client(server.port, "committed", "rock", True, []),
+                                            client(server.port, "plain", "rock", False, []))
+    await server.stop()
+    return committed == protocol.ABORT and server.rounds_completed == 0
+
+
+def verification_cost():
+    reveals = []
+    for move in protocol.MOVES * 200:
+        commitment, nonce = commitments.commit(move)
+        reveals.append((commitment, move, nonce))
+    verify, verify_many = commitments.verify, commitments.verify_many
+    single = min(timeit.repeat(lambda: [verify(*reveal) for reveal in reveals], number=20, repeat=5)) / 20
+    pairs = [reveals[i:i + 2] for i in range(0, len(reveals), 2)]
+    paired = min(timeit.repeat(lambda: [verify_many(pair) for pair in pairs], number=20, repeat=5)) / 20
+    bulk = min(timeit.repeat(lambda: verify_many(reveals), number=20, repeat=5)) / 20
+    return [seconds / len(reveals) * 1e6 for seconds in (single, paired, bulk)]
+
+
+def main(matches=2000, best_of=21, delay_ms=5):
+    single, paired, bulk = verification_cost()
+    print(f"verify one reveal:            {single:.2f} us")
+    print(f"verify_many, two per call:    {paired:.2f} us per reveal")
+    print(f"verify_many, 1000 per call:   {bulk:.2f} us per reveal")
+
+    rates = {}
+    for label, commit in (("plain", False), ("commit-reveal", True)):
+        rounds, elapsed = asyncio.run(throughput(matches, best_of, commit))
+        rates[label] = rounds / elapsed
+        print(f"{label + ' rounds/sec:':<30}{rates[label]:,.0f}")
+    print(f"throughput cost:              {1 - rates['commit-reveal'] / rates['plain']:.0%}")
+
+    delay = delay_ms / 1000
+    plain = asyncio.run(latency(best_of, delay, False))
+    committed = asyncio.run(latency(best_of, delay, True))
+    # Player to player through the server is two relayed hops each way
+    round_trip = 4 * delay
+    print(f"round p50 at {delay_ms}ms each way:    plain {plain * 1e3:.1f} ms, commit-reveal {committed * 1e3:.1f} ms")
+    print(f"added latency:                {(committed - plain) * 1e3:.1f} ms = "
+          f"{(committed - plain) / round_trip:.2f} of a player-to-player round trip")
+
+    if not asyncio.run(cheater_is_caught()):
+        print("FAIL: a reveal that does not match its commitment was accepted")
+        return 1
+    print("mismatched reveal:            session aborted")
+    if not asyncio.run(plain_choice_is_refused()):
+        print("FAIL: require_commit accepted a plain CHOICE")
+        return 1
+    print("plain CHOICE, require_commit: session aborted")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
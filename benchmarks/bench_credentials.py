@@ -0,0 +1,77 @@
+"""
+Password hashing cost versus login throughput.
+
+For every cost level in credentials.COST_LEVELS, reports the time of one
+KDF, logins/sec through the bounded worker pool, and the worst event loop
+stall seen while a burst of logins is being verified. Also checks that a
+legacy SHA-256 record is upgraded on its first successful login.
+
+Run from the repository root:
+    python -m benchmarks.bench_credentials [logins] [workers]
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import credentials
+import database
+import migrations
+
+
+async def burst(service, logins):
+    lag = 0.0
+    stop = False
+
+    async def ticker():
+        nonlocal lag
+        while not stop:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+
+    tick = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    results = await asyncio.gather(*(service.authenticate_async(f"user{i % 8}", "secret") for i in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop = True
+    await tick
+    return all(results), elapsed, lag
+
+
+def main(logins=32, workers=os.cpu_count()):
+    with tempfile.TemporaryDirectory() as tmp:
+        database.configure(os.path.join(tmp, "bench.db"))
+        migrations.migrate()
+
+        legacy = hashlib.sha256(b"secret").hexdigest()
+        database.execute("INSERT INTO users (username, password) VALUES (?, ?)", ("legacy", legacy))
+        service = credentials.Credentials(workers=workers)
+        upgraded = service.authenticate("legacy", "secret").result()
+        stored = database.fetch_one(credentials.PASSWORD_SQL, ("legacy",))[0]
+        print(f"legacy SHA-256 login {'ok' if upgraded else 'FAILED'}, stored as {stored.split('$')[0]}")
+        service.close()
+
+        print(f"{'cost':<12} {'params':<28} {'one hash':>10} {'logins/sec':>12} {'max loop stall':>16}")
+        for cost, (algorithm, params) in credentials.COST_LEVELS.items():
+            for i in range(8):
+                database.execute("INSERT OR REPLACE INTO users (username, password) VALUES (?, ?)",
+                                 (f"user{i}", credentials.hash_password("secret", cost)))
+            start = time.perf_counter()
+            credentials.hash_password("secret", cost)
+            single = time.perf_counter() - start
+
+            service = credentials.Credentials(cost=cost, workers=workers, max_pending=logins)
+            ok, elapsed, lag = asyncio.run(burst(service, logins))
+            service.close()
+            described = ",".join(f"{key}={value}" for key, value in params.items())
+            print(f"{cost:<12} {algorithm + ' ' + described:<28} {single * 1e3:8.1f}ms {logins / elapsed:12.1f}"
+                  f" {lag * 1e3:14.2f}ms{'' if ok else '  FAILED'}")
+    print(f"({workers} KDF worker(s), {logins} concurrent logins per cost level)")
+    return 0 if upgraded and stored.startswith("scrypt$") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,97 @@
+"""
+Compare the old connect/execute/commit/close pattern against the pooled
+data-access layer.
+
+Run from the repository root:
+    python -m benchmarks.bench_database [operations]
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+
+import database
+
+CREATE_USERS = """
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password TEXT NOT NULL,
+        score INTEGER DEFAULT 0
+    )
+"""
+
+
+def seed(path, users=1000):
+    conn = sqlite3.connect(path)
+    conn.execute(CREATE_USERS)
+    conn.executemany("INSERT INTO users (username, password) VALUES (?, ?)",
+                     ((f"user{i}", "x") for i in range(users)))
+    conn.commit()
+    conn.close()
+
+
+# The pattern main.py used before the pool existed
+def per_call_update(path, username):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE users SET score = score + ? WHERE username = ?", (1, username))
+    conn.commit()
+    conn.close()
+
+
+def per_call_select(path, username):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT score FROM users WHERE username = ?", (username,))
+    cursor.fetchone()
+    conn.close()
+
+
+def pooled_update(username):
+    database.execute("UPDATE users SET score = score + ? WHERE username = ?", (1, username))
+
+
+def pooled_select(username):
+    database.fetch_one("SELECT score FROM users WHERE username = ?", (username,))
+
+
+def run(label, func, operations, threads=1):
+    per_thread = operations // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            func(f"user{(offset + i) % 1000}")
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {per_thread * threads / elapsed:>12,.0f} ops/sec")
+
+
+def main(operations=2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        seed(legacy_path)
+        seed(pooled_path)
+
+        run("per-call connect, UPDATE + commit", lambda u: per_call_update(legacy_path, u), operations)
+        run("per-call connect, SELECT", lambda u: per_call_select(legacy_path, u), operations)
+
+        for synchronous in ("FULL", "NORMAL", "OFF"):
+            database.configure(pooled_path, pragmas={"synchronous": synchronous})
+            run(f"pooled WAL sync={synchronous}, UPDATE", pooled_update, operations)
+        database.configure(pooled_path)
+        run("pooled WAL, SELECT", pooled_select, operations)
+        run("pooled WAL, SELECT x4 threads", pooled_select, operations, threads=4)
+        database.get_pool().close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,195 @@
+"""
+Spectator fan-out throughput: frames delivered per second to many viewers
+through one Broadcast, what publishing costs the match, and what happens to
+viewers that stop reading.
+
+The naive comparison encodes and writes every frame separately for each
+viewer from inside the publishing code, as a point-to-point server would.
+A final check runs a real GameServer match with spectators attached.
+
+Run from the repository root:
+    python -m benchmarks.bench_fanout [viewers] [rounds] [slow_viewers]
+
+Each viewer takes two file descriptors in this process; 10,000 viewers
+need a descriptor limit above 20,000.
+"""
+import asyncio
+import resource
+import socket
+import sys
+import time
+
+import broadcast
+import protocol
+from game_server import GameServer
+
+FRAME = protocol.encode_spectate_round(1, "rock", "paper", "loss", 0, 1, False)
+ROUND_BYTES = 2 * len(protocol.encode_spectate_chosen(0)) + len(FRAME)
+
+
+def raise_fd_limit(viewers):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = 2 * viewers + 256
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+    usable = (min(wanted, hard) - 256) // 2
+    if usable < viewers:
+        print(f"descriptor limit {hard} allows {usable} viewers, not {viewers}")
+    return min(viewers, usable)
+
+
+async def viewer(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    received = 0
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        received += len(data)
+    writer.close()
+    return received
+
+
+async def slow_viewer(port):
+    # A tiny receive buffer that is never read fills up almost at once
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", port))
+    return sock
+
+
+async def fan_out(viewers, rounds, slow, naive):
+    hub = broadcast.Broadcast(send_timeout=2.0, high_water=4096)
+    writers = []
+    results = []
+
+    async def handle(reader, writer):
+        # Small kernel buffers, so viewers that stop reading back up quickly
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+        if naive:
+            writers.append(writer)
+            await closed.wait()
+            writer.close()
+        else:
+            results.append(await hub.serve(writer, FRAME))
+            writer.close()
+
+    closed = asyncio.Event()
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=4096)
+    port = server.sockets[0].getsockname()[1]
+    slow_sockets = [await slow_viewer(port) for _ in range(slow)]
+    tasks = []
+    for first in range(0, viewers, 500):
+        batch = [asyncio.ensure_future(viewer(port)) for _ in range(min(500, viewers - first))]
+        tasks.extend(batch)
+        await asyncio.sleep(0.05)
+    while (len(writers) if naive else len(hub)) < viewers + slow:
+        await asyncio.sleep(0.01)
+
+    publishing = 0.0
+    start = time.perf_counter()
+    for round_number in range(rounds):
+        frames = (protocol.encode_spectate_chosen(0), protocol.encode_spectate_chosen(1),
+                  protocol.encode_spectate_round(round_number, "rock", "paper", "loss", 0, round_number, False))
+        began = time.perf_counter()
+        if naive:
+            for frame in frames:
+                for writer in writers:
+                    if not writer.is_closing():
+                        # Encoded again for every viewer, as each connection gets its own message
+                        writer.write(protocol.encode(protocol.SPECTATE, bytes(frame[protocol.HEADER_SIZE:])))
+        else:
+            for frame in frames:
+                hub.publish(frame)
+        publishing += time.perf_counter() - began
+        await asyncio.sleep(0)
+    if naive:
+        closed.set()
+    else:
+        hub.close()
+    received = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    for sock in slow_sockets:
+        sock.close()
+    server.close()
+    frames = sum(1 + 3 * (count - len(FRAME)) / ROUND_BYTES for count in received)
+    return frames / elapsed, publishing / rounds, hub.dropped, min(received) == len(FRAME) + rounds * ROUND_BYTES
+
+
+async def watch_match(spectators, rounds):
+    server = GameServer(port=0, record_results=False, best_of=2 * rounds - 1)
+    await server.start()
+    everyone_watching = asyncio.Event()
+
+    async def player(name, move):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        decoder = protocol.FrameDecoder()
+        writer.write(protocol.encode_hello(name))
+        await protocol.read_frame(reader, decoder)  # SERVER
+        await protocol.read_frame(reader, decoder)  # the opponent's HELLO
+        await everyone_watching.wait()
+        while True:
+            writer.write(protocol.encode_choice(move))
+            msg_type, payload = await protocol.read_frame(reader, decoder)
+            if msg_type != protocol.RESULT or protocol.decode_result(payload).final:
+                break
+        writer.close()
+
+    async def spectator():
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        decoder = protocol.FrameDecoder()
+        writer.write(protocol.encode_watch("alice"))
+        kinds = []
+        try:
+            await protocol.read_frame(reader, decoder)  # SERVER
+            while True:
+                msg_type, payload = await protocol.read_frame(reader, decoder)
+                if msg_type != protocol.SPECTATE:
+                    break
+                kinds.append(protocol.decode_spectate(payload)[0])
+        except ConnectionError:
+            pass
+        writer.close()
+        return kinds
+
+    alice = asyncio.ensure_future(player("alice", "rock"))
+    await asyncio.sleep(0.05)
+    bob = asyncio.ensure_future(player("bob", "scissors"))
+    while "alice" not in server.live:
+        await asyncio.sleep(0.001)
+    watchers = [asyncio.ensure_future(spectator()) for _ in range(spectators)]
+    session = server.live["alice"]
+    while session.spectators is None or len(session.spectators) < spectators:
+        await asyncio.sleep(0.001)
+    everyone_watching.set()
+    watched = await asyncio.gather(*watchers, alice, bob)
+    await server.stop()
+    return watched[:spectators]
+
+
+def main(viewers=4000, rounds=3000, slow=10):
+    viewers = raise_fd_limit(viewers + slow) - slow
+    print(f"{viewers:,} viewers, {slow} of them never read, {rounds:,} rounds of 3 events")
+    for label, naive in (("broadcast (encode once)", False), ("naive (encode and write per viewer)", True)):
+        rate, per_round, dropped, complete = asyncio.run(fan_out(viewers, rounds, slow, naive))
+        print(f"{label:<38} {rate:12,.0f} frames/sec delivered, publishing {per_round * 1e6:9.1f} us per round")
+        if not naive:
+            print(f"{'':<38} dropped {dropped} of {slow} slow viewers; other viewers complete: {complete}")
+            # Below about 1,500 rounds everything fits in the socket buffers of the slow viewers
+            if not complete or (rounds >= 1500 and dropped != slow):
+                print("FAIL slow viewers were not dropped or fast viewers missed frames")
+                return 1
+
+    kinds = asyncio.run(watch_match(50, 5))
+    expected = [protocol.SPECTATE_START] + [protocol.SPECTATE_CHOSEN, protocol.SPECTATE_CHOSEN,
+                                            protocol.SPECTATE_ROUND] * 5 + [protocol.SPECTATE_END]
+    if any(k != expected for k in kinds):
+        print(f"FAIL spectators of a live match saw {kinds[0]}")
+        return 1
+    print("ok   50 spectators of a live match received every event")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,65 @@
+"""
+Leaderboard at scale: in-memory rank lookups and updates versus SQL
+queries, with and without the score index.
+
+Run from the repository root:
+    python -m benchmarks.bench_leaderboard [users]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import database
+import leaderboard
+import migrations
+
+
+def timed(label, func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<44} {repeat / elapsed:>12,.1f} ops/sec  ({elapsed / repeat * 1e6:,.1f} us each)")
+
+
+def main(users=1_000_000):
+    random.seed(1)
+    rows = [(f"user{i}", int(random.gauss(0, 200))) for i in range(users)]
+    names = [name for name, _ in rows]
+
+    start = time.perf_counter()
+    board = leaderboard.Leaderboard(rows)
+    print(f"built in-memory board for {users:,} users in {time.perf_counter() - start:.2f}s")
+    timed("board.rank (my rank)", lambda: board.rank(random.choice(names)), 100_000)
+    timed("board.adjust (+/-1 after a game)", lambda: board.adjust(random.choice(names), random.choice((-1, 1))), 100_000)
+    timed("board.top(50)", lambda: board.top(50), 10_000)
+    timed("board.top(50, offset=users // 2)", lambda: board.top(50, users // 2), 100)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(path)
+        conn.execute("""CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT NOT NULL,
+                        score INTEGER DEFAULT 0, games_played INTEGER DEFAULT 0)""")
+        conn.executemany("INSERT INTO users (username, password, score) VALUES (?, 'x', ?)", rows)
+        conn.commit()
+        conn.close()
+        database.configure(path)
+
+        timed("SQL full leaderboard, no index", lambda: database.fetch_all(
+            "SELECT username, score, games_played FROM users ORDER BY score DESC"), 3)
+        timed("SQL rank via COUNT(*), no index", lambda: database.fetch_one(
+            "SELECT COUNT(*) FROM users WHERE score > (SELECT score FROM users WHERE username = ?)",
+            (random.choice(names),)), 20)
+        migrations.migrate()
+        timed("SQL top page (LIMIT 50), indexed", lambda: leaderboard.fetch_page(0), 10_000)
+        timed("SQL rank via COUNT(*), indexed", lambda: database.fetch_one(
+            "SELECT COUNT(*) FROM users WHERE score > (SELECT score FROM users WHERE username = ?)",
+            (random.choice(names),)), 200)
+        database.get_pool().close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,119 @@
+"""
+Matchmaking throughput and time-to-match.
+
+1. In-process: pairings/sec of the waiting queue with a large backlog and
+   players dropping out.
+2. In-process: match lookup latency of the rating-bucketed queue.
+3. Over sockets: clients arrive at a fixed synthetic rate and we record how
+   long each waits for its MATCHED frame.
+
+Run from the repository root:
+    python -m benchmarks.bench_matchmaking [waiting] [arrivals_per_sec] [seconds]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+import protocol
+import sessions
+from matchmaking import MatchmakingService, RatingQueue, WaitingPlayer
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def bench_queue(waiting, operations=200_000):
+    service = MatchmakingService()
+    players = [WaitingPlayer(f"p{i}", "127.0.0.1", i) for i in range(waiting)]
+    for player in players:
+        service.queue.add(player)
+    # A tenth of the backlog gives up before being matched
+    for player in random.sample(players, waiting // 10):
+        service.queue.discard(player)
+
+    start = time.perf_counter()
+    for i in range(operations):
+        service.pair(WaitingPlayer(f"n{i}", "127.0.0.1", waiting + i))
+    elapsed = time.perf_counter() - start
+    print(f"queue: {waiting:,} waiting, {service.pairings:,} pairings, {service.pairings / elapsed:,.0f} pairings/sec")
+
+
+async def bench_rating_queue(waiting, lookups=100_000):
+    queue = RatingQueue()
+    for i in range(waiting):
+        queue.add(WaitingPlayer(f"p{i}", "127.0.0.1", i, int(random.gauss(0, 300))))
+
+    # Wall time includes the process being descheduled, thread time does not
+    wall, cpu = [], []
+    matched = 0
+    start = time.perf_counter()
+    for i in range(lookups):
+        player = WaitingPlayer(f"n{i}", "127.0.0.1", waiting + i, int(random.gauss(0, 300)))
+        t0, c0 = time.perf_counter(), time.thread_time()
+        partner = queue.find_partner(player)
+        wall.append(time.perf_counter() - t0)
+        cpu.append(time.thread_time() - c0)
+        if partner is None:
+            queue.add(player)
+        else:
+            matched += 1
+    elapsed = time.perf_counter() - start
+    wall.sort()
+    print(f"rating queue: {waiting:,} waiting, {matched:,}/{lookups:,} matched, "
+          f"mean {elapsed / lookups * 1e6:.1f} us, p99 {percentile(wall, 0.99) * 1e6:.0f} us, "
+          f"p99.9 {percentile(wall, 0.999) * 1e6:.0f} us per lookup")
+    print(f"rating queue: worst lookup {max(cpu) * 1e6:.0f} us CPU time, {wall[-1] * 1e6:.0f} us wall time")
+
+
+async def client(port, name, waits):
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(protocol.encode_join(sessions.issue(name)))
+        await writer.drain()
+        msg_type, _ = await protocol.read_frame(reader, protocol.FrameDecoder())
+        if msg_type == protocol.MATCHED:
+            waits.append(time.perf_counter() - start)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def bench_arrivals(rate, seconds):
+    service = MatchmakingService(port=0)
+    await service.start()
+    waits, tasks = [], []
+    interval = 1 / rate
+    start = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        tasks.append(asyncio.ensure_future(client(service.port, f"c{i}", waits)))
+        delay = start + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.wait(tasks, timeout=10)
+    elapsed = time.perf_counter() - start
+    await service.stop()
+
+    waits.sort()
+    print(f"sockets: {rate:,}/sec arrivals for {seconds}s, {service.pairings:,} pairings "
+          f"({service.pairings / elapsed:,.0f}/sec)")
+    if waits:
+        print(f"time-to-match p50 {percentile(waits, 0.5) * 1e3:.2f} ms, p99 {percentile(waits, 0.99) * 1e3:.2f} ms")
+
+
+async def main(waiting, rate, seconds):
+    await bench_queue(waiting)
+    await bench_rating_queue(waiting)
+    await bench_arrivals(rate, seconds)
+
+
+if __name__ == "__main__":
+    sessions.configure(secret=os.urandom(sessions.SECRET_BYTES))
+    waiting = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    rate = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    asyncio.run(main(waiting, rate, seconds))
@@ -0,0 +1,103 @@
+"""
+Cost of the metrics layer: per-update microbenchmarks, its share of the
+game server's round loop (budget: 1%), and a scrape and profile over HTTP.
+
+Run from the repository root:
+    python -m benchmarks.bench_metrics [rounds]
+"""
+import asyncio
+import sys
+import time
+
+import metrics
+from benchmarks.load_test_server import simulated_client
+from game_server import GameServer, ROUND_SECONDS
+from metrics_server import MetricsServer
+
+OVERHEAD_BUDGET = 0.01
+PAIRS = 50
+
+
+def per_call(func, calls=500_000):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def instrumented_round():
+    # Exactly what MatchSession._play_round adds to every round
+    start = time.perf_counter()
+    ROUND_SECONDS.observe(time.perf_counter() - start)
+
+
+async def rounds_per_second(rounds):
+    best_of = 2 * (rounds // PAIRS) + 1
+    server = GameServer(port=0, record_results=False, best_of=best_of)
+    await server.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(simulated_client(server.port, f"bot{i}", []) for i in range(2 * PAIRS)))
+    elapsed = time.perf_counter() - start
+    await server.stop()
+    return server.rounds_completed / elapsed
+
+
+async def scrape_and_profile(rounds):
+    endpoint = MetricsServer(port=0)
+    await endpoint.start()
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", endpoint.port)
+        writer.write(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response.split(b"\r\n\r\n", 1)[1].decode()
+
+    profile, _ = await asyncio.gather(get("/profile?seconds=0.5&interval=2"), rounds_per_second(rounds))
+    start = time.perf_counter()
+    text = await get("/metrics")
+    elapsed = time.perf_counter() - start
+    await endpoint.stop()
+    return text, profile, elapsed
+
+
+def main(rounds=20_000):
+    counter = metrics.counter("bench_counter_total", "Benchmark counter.")
+    histogram = metrics.histogram("bench_seconds", "Benchmark histogram.")
+    labelled = metrics.histogram("bench_labelled_seconds", "Benchmark histogram.", labels=("helper",))
+    print(f"{'counter.inc()':<40} {per_call(counter.inc) * 1e9:8.0f} ns")
+    print(f"{'histogram.observe(0.003)':<40} {per_call(lambda: histogram.observe(0.003)) * 1e9:8.0f} ns")
+    print(f"{'labels(...).observe(0.003)':<40} {per_call(lambda: labelled.labels('x').observe(0.003)) * 1e9:8.0f} ns")
+    cost = per_call(instrumented_round)
+    print(f"{'instrumentation per round':<40} {cost * 1e9:8.0f} ns")
+
+    enabled, disabled = [], []
+    for _ in range(3):
+        metrics.set_enabled(False)
+        disabled.append(asyncio.run(rounds_per_second(rounds)))
+        metrics.set_enabled(True)
+        enabled.append(asyncio.run(rounds_per_second(rounds)))
+    best_on, best_off = max(enabled), max(disabled)
+    print(f"{'round loop, metrics off':<40} {best_off:8,.0f} rounds/sec")
+    print(f"{'round loop, metrics on':<40} {best_on:8,.0f} rounds/sec ({(best_off - best_on) / best_off:+.1%}, noisy)")
+    # The A/B difference is within run-to-run noise, so the gate is the
+    # measured instrumentation cost against the time a round takes
+    overhead = cost * best_off
+    print(f"{'overhead share of a round':<40} {overhead:8.3%}")
+
+    text, profile, elapsed = asyncio.run(scrape_and_profile(rounds // 5))
+    print(f"{'scrape /metrics over HTTP':<40} {elapsed * 1e3:8.2f} ms, {len(text.splitlines())} lines")
+    print(f"{'profile stacks (0.5s at 2ms)':<40} {len(profile.splitlines()):8d}")
+
+    if "rps_round_seconds_count " not in text or "rps_db_statement_seconds" not in text:
+        print("FAIL expected metrics missing from /metrics")
+        return 1
+    if overhead > OVERHEAD_BUDGET:
+        print(f"FAIL instrumentation takes {overhead:.2%} of a round, budget {OVERHEAD_BUDGET:.0%}")
+        return 1
+    print(f"ok   instrumentation within {OVERHEAD_BUDGET:.0%} of the round loop")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
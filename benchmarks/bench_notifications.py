@@ -0,0 +1,118 @@
+"""
+Invitation delivery latency and database reads: pushed invitations versus
+the old "View Invitations" polling model.
+
+Subscribes `users` clients to a NotificationService, sends `invites`
+invitations between random pairs and records how long each takes to reach
+its recipient.
+
+Run from the repository root:
+    python -m benchmarks.bench_notifications [users] [invites] [poll_interval_seconds]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import database
+import migrations
+import protocol
+import sessions
+import write_behind
+from notifications import NotificationService
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Client:
+    def __init__(self, name):
+        self.name = name
+        self.sent_at = {}
+        self.latencies = []
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self.writer.write(protocol.encode_subscribe(sessions.issue(self.name)))
+        self.task = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        decoder = protocol.FrameDecoder()
+        try:
+            while True:
+                msg_type, payload = await protocol.read_frame(self.reader, decoder)
+                if msg_type == protocol.INVITE:
+                    _, sender = protocol.decode_invite(payload)
+                    sent = SENT.pop((sender, self.name), None)
+                    if sent is not None:
+                        self.latencies.append(time.perf_counter() - sent)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+
+SENT = {}
+
+
+async def run(users, invites, poll_interval):
+    service = NotificationService(port=0)
+    await service.start()
+    clients = [Client(f"user{i}") for i in range(users)]
+    for client in clients:
+        await client.connect(service.port)
+    await asyncio.sleep(0.5)
+    reads_after_subscribe = service.db_reads
+
+    invited = set()
+    start = time.perf_counter()
+    for _ in range(invites):
+        sender, recipient = random.sample(clients, 2)
+        if (sender.name, recipient.name) in invited:
+            continue
+        invited.add((sender.name, recipient.name))
+        SENT[(sender.name, recipient.name)] = time.perf_counter()
+        sender.writer.write(protocol.encode_invite("pending", recipient.name))
+        await asyncio.sleep(0)
+    for _ in range(100):
+        if not SENT:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(l for client in clients for l in client.latencies)
+    for client in clients:
+        client.task.cancel()
+        client.writer.close()
+    # Let the service notice the disconnects before shutting it down
+    await asyncio.sleep(0.2)
+    await service.stop()
+
+    print(f"{users:,} subscribers, {len(latencies):,} invitations delivered in {elapsed:.2f}s")
+    print(f"push delivery latency: p50 {percentile(latencies, 0.5) * 1e3:.2f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1e3:.2f} ms")
+    print(f"push DB reads: {service.db_reads:,} total ({reads_after_subscribe:,} inbox loads at subscribe, "
+          f"{service.db_reads - reads_after_subscribe} while sending)")
+    print(f"polling every {poll_interval}s: ~{poll_interval / 2 * 1e3:.0f} ms mean discovery latency and "
+          f"{users / poll_interval:,.0f} inbox queries/sec, i.e. {users / poll_interval * elapsed:,.0f} over this run")
+
+
+def main(users=2000, invites=20000, poll_interval=5):
+    sessions.configure(secret=os.urandom(sessions.SECRET_BYTES))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "notify.db")
+        sqlite3.connect(path).close()
+        database.configure(path)
+        write_behind.configure(path=path)
+        migrations.migrate()
+        asyncio.run(run(users, invites, poll_interval))
+        write_behind.shutdown()
+        pending = database.fetch_one("SELECT COUNT(*) FROM invitations")[0]
+        print(f"invitations persisted: {pending:,}")
+        database.get_pool().close()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:4]))
@@ -0,0 +1,81 @@
+"""
+Move predictor latency and memory.
+
+Seeds a temporary database with recorded rounds, then measures model
+seeding from the games table, per-round predict + record latency for warm
+players, and memory per cached player. Exits with status 1 if the p99 of
+a round's prediction reaches one millisecond.
+
+Run from the repository root:
+    python -m benchmarks.bench_predictor [players] [rounds_per_player]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import database
+import migrations
+import predictor
+import rules
+
+BUDGET = 0.001  # seconds per prediction, p99
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main(players=2000, rounds=500):
+    random.seed(5)
+    names = [f"user{i}" for i in range(players)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        database.configure(path)
+        migrations.migrate()
+        rows = []
+        for name in names:
+            # Each player has a favourite move and a habit of repeating it
+            favourite = random.randrange(3)
+            rows.extend((name, "bot", None, favourite if random.random() < 0.6 else random.randrange(3), 0)
+                        for _ in range(rounds))
+        random.shuffle(rows)
+        database.executemany("INSERT INTO games (player1, player2, winner, player1_move, player2_move) "
+                             "VALUES (?, ?, ?, ?, ?)", rows)
+        print(f"seeded {len(rows):,} rounds for {players:,} players")
+
+        model = predictor.MovePredictor(max_players=players // 2)
+        start = time.perf_counter()
+        for name in names[:200]:
+            model.warm(name)
+        elapsed = time.perf_counter() - start
+        print(f"seed a model from the games table  {elapsed / 200 * 1e3:8.2f} ms per player (once per session)")
+
+        for name in names:
+            model.warm(name)
+        print(f"cached players {len(model):,} of {players:,}, evictions {model.evictions:,}")
+
+        warm = names[-len(model):]
+        latencies = []
+        for _ in range(200_000):
+            name = random.choice(warm)
+            start = time.perf_counter()
+            model.choose(name)
+            model.record(name, random.choice(rules.CLASSIC.moves))
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50, p99 = percentile(latencies, 0.50), percentile(latencies, 0.99)
+        print(f"choose + record per round          p50 {p50 * 1e6:6.1f} us  p99 {p99 * 1e6:6.1f} us")
+
+        ngram = predictor.NGramModel(len(rules.CLASSIC))
+        print(f"model table size                   {ngram.nbytes()} bytes per player (order {ngram.order})")
+
+    if p99 >= BUDGET:
+        print(f"FAIL p99 {p99 * 1e3:.3f} ms is over the {BUDGET * 1e3:.0f} ms budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,55 @@
+"""
+Codec throughput for the framed wire protocol.
+
+Run from the repository root:
+    python -m benchmarks.bench_protocol [messages]
+"""
+import sys
+import time
+
+import protocol
+
+
+def bench_encode(messages):
+    start = time.perf_counter()
+    for i in range(messages):
+        protocol.encode_choice(protocol.MOVES[i % 3])
+    return messages / (time.perf_counter() - start)
+
+
+def bench_encode_into(messages):
+    frame_size = protocol.HEADER_SIZE + 1
+    buffer = bytearray(frame_size * 1024)
+    payloads = [bytes((code,)) for code in range(3)]
+    start = time.perf_counter()
+    for batch in range(0, messages, 1024):
+        offset = 0
+        for i in range(1024):
+            offset = protocol.encode_into(buffer, offset, protocol.CHOICE, payloads[i % 3])
+    return messages / (time.perf_counter() - start)
+
+
+def bench_decode(messages, frames_per_packet):
+    packet = b"".join(protocol.encode_choice(protocol.MOVES[i % 3]) for i in range(frames_per_packet))
+    decoder = protocol.FrameDecoder()
+    packets = messages // frames_per_packet
+    start = time.perf_counter()
+    for _ in range(packets):
+        decoder.feed(packet)
+        while True:
+            frame = decoder.next_frame()
+            if frame is None:
+                break
+            protocol.decode_choice(frame[1])
+    return packets * frames_per_packet / (time.perf_counter() - start)
+
+
+def main(messages=1_000_000):
+    print(f"{'encode (new bytes per frame)':<36} {bench_encode(messages):>14,.0f} msgs/sec")
+    print(f"{'encode_into (preallocated buffer)':<36} {bench_encode_into(messages):>14,.0f} msgs/sec")
+    for per_packet in (1, 16, 256):
+        print(f"{f'decode, {per_packet} frames per packet':<36} {bench_decode(messages, per_packet):>14,.0f} msgs/sec")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,94 @@
+"""
+Replay log (replay_log.py): append rate, size on disk, scan rates and match
+lookup, on a log of `rounds` synthetic rounds in a temporary directory.
+
+  * append: whole matches through ReplayWriter.append_match
+  * column scan: move_counts over every round, reading only the moves byte
+  * decoded scan: scan(), one ReplayRound per round
+  * lookup: replay() of random matches, found by binary search
+  * compaction: merging the small segments left by many short writer runs
+
+Run from the repository root:
+    python -m benchmarks.bench_replay [rounds] [rounds_per_match]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import protocol
+import replay_log
+
+PLAYERS = 10000
+SEGMENT_BYTES = 16 * 1024 * 1024
+
+
+def build(directory, rounds, per_match, rng):
+    writer = replay_log.ReplayWriter(directory, segment_bytes=SEGMENT_BYTES)
+    moves = protocol.MOVES[:3]
+    matches = []
+    for _ in range(rounds // per_match):
+        matches.append((f"player{rng.randrange(PLAYERS)}", f"player{rng.randrange(PLAYERS)}",
+                        [(rng.choice(moves), rng.choice(moves)) for _ in range(per_match)]))
+    start = time.perf_counter()
+    for player_a, player_b, played in matches:
+        writer.append_match(player_a, player_b, played)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return len(matches), elapsed
+
+
+def main(rounds=2_000_000, per_match=10):
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as directory:
+        log = os.path.join(directory, "log")
+        matches, elapsed = build(log, rounds, per_match, rng)
+        rounds = matches * per_match
+        size = sum(os.path.getsize(path) for path in replay_log.segments(log))
+        print(f"rounds:          {rounds:,} in {matches:,} matches, {len(replay_log.segments(log))} segments")
+        print(f"append:          {rounds / elapsed:,.0f} rounds/s")
+        print(f"size:            {size / rounds:.1f} bytes/round")
+
+        start = time.perf_counter()
+        counts = replay_log.move_counts(log)
+        elapsed = time.perf_counter() - start
+        if sum(counts.values()) != rounds:
+            print(f"FAIL: move_counts saw {sum(counts.values())} rounds")
+            return 1
+        print(f"column scan:     {rounds / elapsed:,.0f} rounds/s")
+
+        start = time.perf_counter()
+        decoded = sum(1 for _ in replay_log.scan(log))
+        elapsed = time.perf_counter() - start
+        print(f"decoded scan:    {decoded / elapsed:,.0f} rounds/s")
+
+        lookups = [rng.randrange(1, matches + 1) for _ in range(1000)]
+        start = time.perf_counter()
+        for match_id in lookups:
+            if len(replay_log.replay(log, match_id)) != per_match:
+                print(f"FAIL: match {match_id} did not replay {per_match} rounds")
+                return 1
+        print(f"lookup:          {(time.perf_counter() - start) / len(lookups) * 1e3:.2f} ms per match replayed")
+
+        # Segments that hold one match each, as many short writer runs would leave
+        small = os.path.join(directory, "small")
+        writer = replay_log.ReplayWriter(small, segment_bytes=replay_log.HEADER.size + per_match * replay_log.RECORD.size)
+        for _ in range(200):
+            writer.append_match("a", "b", [("rock", "paper")] * per_match)
+        writer.close()
+        before = len(replay_log.segments(small))
+        start = time.perf_counter()
+        replay_log.compact(small)
+        elapsed = time.perf_counter() - start
+        after = replay_log.segments(small)
+        replayed = sum(1 for _ in replay_log.scan(small))
+        if replayed != 200 * per_match:
+            print(f"FAIL: {replayed} rounds left after compaction")
+            return 1
+        print(f"compaction:      {before} segments -> {len(after)} in {elapsed * 1e3:.1f} ms, every round kept")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
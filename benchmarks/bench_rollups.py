@@ -0,0 +1,84 @@
+"""
+Windowed stats from the rollups versus scanning the games table, plus the
+cost of keeping the rollups current and of rebuilding them.
+
+Run from the repository root:
+    python -m benchmarks.bench_rollups [rounds] [users]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import database
+import migrations
+import rollups
+
+INSERT_SQL = "INSERT INTO games (player1, player2, winner, timestamp) VALUES (?, ?, ?, ?)"
+
+SCAN_SQL = """
+    SELECT COUNT(*), SUM(winner = ?), SUM(winner IS NOT NULL AND winner != ?), SUM(winner IS NULL)
+    FROM games WHERE (player1 = ? OR player2 = ?) AND timestamp >= ? AND timestamp < ?
+"""
+
+
+def timed(label, func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<44} {elapsed / repeat * 1e3:10.3f} ms each")
+    return result
+
+
+def iso(seconds):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+
+
+def main(rounds=1_000_000, users=1000):
+    random.seed(7)
+    # Whole hours, so the scan and the hour-resolution rollups cover the same span
+    now = int(time.time()) // rollups.HOUR * rollups.HOUR
+    names = [f"user{i}" for i in range(users)]
+    rows = []
+    for _ in range(rounds):
+        a, b = random.sample(names, 2)
+        rows.append((a, b, random.choice((a, b, None)), iso(now - 1 - random.randrange(365 * rollups.DAY))))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.configure(os.path.join(tmp, "bench.db"))
+        migrations.migrate()
+
+        start = time.perf_counter()
+        with database.transaction() as conn:
+            conn.executemany(INSERT_SQL, rows[:rounds // 2])
+        with_trigger = time.perf_counter() - start
+        database.execute("DROP TRIGGER games_rollup")
+        start = time.perf_counter()
+        with database.transaction() as conn:
+            conn.executemany(INSERT_SQL, rows[rounds // 2:])
+        without_trigger = time.perf_counter() - start
+        print(f"insert rounds with rollup trigger            {rounds // 2 / with_trigger:12,.0f} rounds/sec")
+        print(f"insert rounds without rollup trigger         {(rounds - rounds // 2) / without_trigger:12,.0f} rounds/sec")
+
+        start = time.perf_counter()
+        rolled_up = rollups.backfill()
+        elapsed = time.perf_counter() - start
+        print(f"backfill {rolled_up:,} rounds                    {rolled_up / elapsed:12,.0f} rounds/sec")
+
+        user = names[0]
+        for days in (7, 30, 365):
+            window = (now - days * rollups.DAY, now)
+            fast = timed(f"last {days} days from rollups", lambda: rollups.window(user, *window), 200)
+            slow = timed(f"last {days} days by scanning games",
+                         lambda: database.fetch_one(SCAN_SQL, (user, user, user, user, iso(window[0]), iso(window[1]))), 3)
+            if tuple(fast) != tuple(slow):
+                print(f"FAIL rollups {tuple(fast)} != scan {tuple(slow)}")
+                return 1
+        timed("win rate by hour of day, whole year", lambda: rollups.by_hour_of_day(user, now - 365 * rollups.DAY), 50)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,74 @@
+"""
+Outcome engine microbenchmark against the original evaluate_winner logic.
+
+Run from the repository root:
+    python -m benchmarks.bench_rules [rounds]
+"""
+import random
+import sys
+import time
+
+import rules
+
+# The check main.py used to do for every round
+WINNING_CASES = [
+    ["scissors", "paper"],
+    ["rock", "scissors"],
+    ["paper", "rock"]
+]
+
+
+def legacy_evaluate(user, opponent):
+    if user == opponent:
+        return "tie"
+    elif [user, opponent] in WINNING_CASES:
+        return "win"
+    return "loss"
+
+
+def report(label, rounds, elapsed):
+    print(f"{label:<44} {rounds / elapsed:>16,.0f} rounds/sec")
+
+
+def main(rounds=1_000_000):
+    random.seed(3)
+    names = rules.CLASSIC.moves
+    moves_a = [random.randrange(3) for _ in range(rounds)]
+    moves_b = [random.randrange(3) for _ in range(rounds)]
+    names_a = [names[m] for m in moves_a]
+    names_b = [names[m] for m in moves_b]
+
+    start = time.perf_counter()
+    legacy = [legacy_evaluate(a, b) for a, b in zip(names_a, names_b)]
+    report("legacy evaluate_winner (strings, list scan)", rounds, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    evaluated = [rules.CLASSIC.evaluate(a, b) for a, b in zip(names_a, names_b)]
+    report("RuleSet.evaluate (names)", rounds, time.perf_counter() - start)
+    assert evaluated == legacy
+
+    outcome = rules.CLASSIC.outcome
+    start = time.perf_counter()
+    for a, b in zip(moves_a, moves_b):
+        outcome(a, b)
+    report("RuleSet.outcome (integer codes)", rounds, time.perf_counter() - start)
+
+    engine = "NumPy" if rules.numpy is not None else "pure Python fallback"
+    if rules.numpy is not None:
+        moves_a = rules.numpy.array(moves_a, dtype=rules.numpy.int8)
+        moves_b = rules.numpy.array(moves_b, dtype=rules.numpy.int8)
+    start = time.perf_counter()
+    wins, losses, ties = rules.CLASSIC.tally(moves_a, moves_b)
+    report(f"RuleSet.tally batch ({engine})", rounds, time.perf_counter() - start)
+    assert wins == legacy.count("win") and losses == legacy.count("loss") and ties == legacy.count("tie")
+
+    size = len(rules.LIZARD_SPOCK)
+    spock_a = [random.randrange(size) for _ in range(rounds)]
+    spock_b = [random.randrange(size) for _ in range(rounds)]
+    start = time.perf_counter()
+    rules.LIZARD_SPOCK.tally(spock_a, spock_b)
+    report(f"Lizard-Spock tally batch ({engine})", rounds, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
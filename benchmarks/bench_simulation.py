@@ -0,0 +1,57 @@
+"""
+Bot simulation throughput and how it scales with worker processes.
+
+Plays the same bot-vs-bot workload with 1, 2, 4, ... workers up to the
+number of cores and reports rounds/sec, speedup and parallel efficiency.
+
+Run from the repository root:
+    python -m benchmarks.bench_simulation [rounds_per_matchup]
+"""
+import itertools
+import os
+import sys
+import time
+
+import bots
+import simulation
+
+
+def worker_counts(cores):
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def main(rounds=200_000):
+    cores = os.cpu_count()
+    matchups = list(itertools.combinations(sorted(bots.STRATEGIES), 2))
+    total = len(matchups) * rounds
+    print(f"{len(matchups)} matchups x {rounds:,} rounds = {total:,} rounds, {cores} core(s)")
+
+    baseline = None
+    results = None
+    for workers in worker_counts(cores):
+        start = time.perf_counter()
+        outcome = simulation.simulate(matchups, rounds, workers, chunk_rounds=rounds // 10 or rounds)
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>3} worker(s) {rate:>14,.0f} rounds/sec  {rate / baseline:5.2f}x"
+              f"  {rate / baseline / workers:6.1%} efficiency")
+        # Same seeds, same chunks: the totals must not depend on the worker count
+        if results is not None and outcome != results:
+            print("FAIL results differ between worker counts")
+            return 1
+        results = outcome
+
+    print()
+    for (strategy_a, strategy_b), (wins, losses, ties) in results.items():
+        print(f"{strategy_a:>10} vs {strategy_b:<10} {wins / rounds:6.1%} won  {losses / rounds:6.1%} lost")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,99 @@
+"""
+Import cost and startup time of the headless core.
+
+Every measurement runs in a fresh interpreter. Also checks that importing
+the GUI modules neither imports guizero nor starts any thread, and exits
+with status 1 if that regresses.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HEADLESS_MODULES = ["protocol", "rules", "database", "write_behind", "game_server", "matchmaking",
+                    "notifications", "leaderboard", "server"]
+
+IMPORT_CHECK = """
+import sys, threading
+import main, recover
+assert "guizero" not in sys.modules, "guizero was imported"
+assert threading.active_count() == 1, "a thread was started on import"
+"""
+
+
+def import_time_us(module):
+    """Cumulative import time of `module` as reported by -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    for line in reversed(result.stderr.splitlines()):
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)$", line.strip())
+        if match and match.group(2) == module:
+            return int(match.group(1))
+    return 0
+
+
+def wall_time(code, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        samples.append(time.perf_counter() - start)
+    return min(samples)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_ready_time(db_path):
+    ports = [free_port() for _ in range(4)]
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "server.py", "all", "--db", db_path,
+                                "--game-port", str(ports[0]), "--matchmaking-port", str(ports[1]),
+                                "--notify-port", str(ports[2]), "--login-port", str(ports[3])],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for port in ports:
+            while True:
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.perf_counter() - start > 30:
+                        raise RuntimeError("server did not start")
+                    time.sleep(0.005)
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    baseline = wall_time("pass")
+    print(f"{'interpreter baseline':<32} {baseline * 1e3:8.1f} ms")
+    for module in HEADLESS_MODULES:
+        print(f"{'import ' + module:<32} {import_time_us(module) / 1e3:8.1f} ms cumulative import time")
+    print(f"{'import server (wall, fresh)':<32} {(wall_time('import server') - baseline) * 1e3:8.1f} ms over baseline")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ready = server_ready_time(os.path.join(tmp, "startup.db"))
+    print(f"{'server.py all: ports accepting':<32} {ready * 1e3:8.1f} ms from launch")
+
+    check = subprocess.run([sys.executable, "-c", IMPORT_CHECK], capture_output=True, text=True)
+    if check.returncode:
+        print("FAIL importing main/recover is not headless:\n" + check.stderr)
+        return 1
+    print("ok   importing main and recover builds no GUI and starts no threads")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
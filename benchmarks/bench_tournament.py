@@ -0,0 +1,60 @@
+"""
+Tournament engine at scale: a 10,000 player Swiss event played on a worker
+pool, with every game written to a temporary database.
+
+Exits with status 1 if the event does not finish within the time budget.
+
+Run from the repository root:
+    python -m benchmarks.bench_tournament [players] [workers]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import database
+import migrations
+import tournament
+import write_behind
+
+TIME_BUDGET = 60.0  # seconds for the whole event, including the database writes
+
+
+def run(players, workers, record_results):
+    names = [f"player{i}" for i in range(players)]
+    event = tournament.Tournament(names, "swiss", best_of=3, workers=workers, seed=1, record_results=record_results)
+    start = time.perf_counter()
+    winner = event.run()
+    write_behind.flush()
+    elapsed = time.perf_counter() - start
+    print(f"swiss, {players:,} players, {workers} worker(s){'' if record_results else ', no recording':<16}"
+          f" {elapsed:6.2f}s  {event.rounds_played} rounds  {event.matches_played / elapsed:>10,.0f} matches/sec"
+          f"  {event.games_played / elapsed:>10,.0f} games/sec  winner {winner}")
+    return event, elapsed
+
+
+def main(players=10_000, workers=os.cpu_count()):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        database.configure(path)
+        write_behind.configure(path=path)
+        migrations.migrate()
+
+        run(players, 1, record_results=False)
+        event, elapsed = run(players, workers, record_results=True)
+        stored = database.fetch_one("SELECT COUNT(*) FROM games WHERE tournament_id = ?", (event.tournament_id,))[0]
+        print(f"games rows stored: {stored:,} (expected {event.games_played:,})")
+
+        start = time.perf_counter()
+        event.standings.table(10)
+        print(f"final standings with tie-breaks: {(time.perf_counter() - start) * 1e3:.1f} ms")
+        write_behind.shutdown()
+
+    if stored != event.games_played or elapsed > TIME_BUDGET:
+        print(f"FAIL expected {event.games_played} rows within {TIME_BUDGET}s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
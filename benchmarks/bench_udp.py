@@ -0,0 +1,185 @@
+"""
+Round latency of the TCP game server against the reliable UDP transport on
+localhost, with packet loss and delay injected.
+
+UDP datagrams are really dropped and delayed, at both ends, by
+reliable_udp.Impairment. User space cannot drop TCP segments (that needs
+netem), so TCP runs through a relay that adds the same one-way delay and
+models a lost segment the way TCP recovers from one in a conversation of
+tiny messages: without enough following data for fast retransmit, the
+segment arrives a retransmission timeout late (200ms minimum on Linux), and
+everything behind it in the stream waits for it. A lost SYN costs the
+1 second initial timeout.
+
+Setup is the time from opening the connection to the first RESULT, with the
+HELLO and first CHOICE sent together; a round is CHOICE sent to RESULT read.
+
+Run from the repository root:
+    python -m benchmarks.bench_udp [rounds] [delay_ms]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import protocol
+import reliable_udp
+from game_server import GameServer
+
+TCP_MIN_RTO = 0.2
+TCP_SYN_RTO = 1.0
+MATCHES = 3
+LOSS_RATES = (0.0, 0.01, 0.05, 0.10)
+
+
+class TcpRelay:
+    """Forwards TCP connections to `port`, delaying data and holding back 'lost' segments."""
+
+    def __init__(self, port, loss, delay, seed=1):
+        self.port = port
+        self.loss = loss
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self.server.close()
+
+    async def _handle(self, client_reader, client_writer):
+        # The three-way handshake: one round trip, or the SYN timeout if SYN or SYN-ACK is lost
+        setup = 2 * self.delay
+        if self.rng.random() < 1 - (1 - self.loss) ** 2:
+            setup += TCP_SYN_RTO
+        await asyncio.sleep(setup)
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", self.port)
+        try:
+            await asyncio.gather(self._pipe(client_reader, server_writer), self._pipe(server_reader, client_writer),
+                                 return_exceptions=True)
+        except asyncio.CancelledError:
+            pass  # asyncio.run() tearing down relays still open when the benchmark ends
+
+    async def _pipe(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        released = 0.0
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                due = loop.time() + self.delay
+                if self.rng.random() < self.loss:
+                    due += max(TCP_MIN_RTO, 4 * self.delay) + 2 * self.delay
+                # In-order delivery: nothing overtakes a segment still being recovered
+                released = max(released, due)
+                loop.call_at(released, writer.write, data)
+            await asyncio.sleep(max(0.0, released - loop.time()))
+        finally:
+            writer.close()
+
+
+async def tcp_connect(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = protocol.FrameDecoder()
+
+    async def send(*frames):
+        writer.write(b"".join(frames))
+
+    async def read():
+        return await protocol.read_frame(reader, decoder)
+    return send, read, writer.close
+
+
+async def udp_connect(port, impairment):
+    connection = await reliable_udp.open_connection("127.0.0.1", port, impairment)
+    return connection.send, connection.read_frame, connection.close
+
+
+async def player(connect, name, move, latencies=None):
+    started = time.perf_counter()
+    send, read, close = await connect()
+    await send(protocol.encode_hello(name), protocol.encode_choice(move))
+    setup = None
+    try:
+        msg_type, _ = await read()
+        if msg_type == protocol.SERVER:  # only over TCP
+            await read()  # the opponent's HELLO
+        while True:
+            msg_type, payload = await read()
+            now = time.perf_counter()
+            if msg_type != protocol.RESULT:
+                break
+            if setup is None:
+                setup = now - started
+            elif latencies is not None:
+                latencies.append(now - started)
+            if protocol.decode_result(payload).final:
+                break
+            started = time.perf_counter()
+            await send(protocol.encode_choice(move))
+    except ConnectionError:
+        pass
+    finally:
+        close()
+    return setup
+
+
+async def run_matches(server, connect, rounds):
+    setups, latencies = [], []
+    for match in range(MATCHES):
+        loser = asyncio.ensure_future(player(connect, f"b{match}", "scissors"))
+        while server._waiting is None:
+            await asyncio.sleep(0.001)
+        setups.append(await player(connect, f"a{match}", "rock", latencies))
+        await loser
+    return setups, latencies
+
+
+async def bench_tcp(rounds, loss, delay):
+    server = GameServer(port=0, record_results=False, best_of=2 * rounds - 1)
+    await server.start()
+    relay = TcpRelay(server.port, loss, delay)
+    port = await relay.start()
+    try:
+        return await run_matches(server, lambda: tcp_connect(port), rounds)
+    finally:
+        relay.close()
+        await server.stop()
+
+
+async def bench_udp(rounds, loss, delay):
+    server = reliable_udp.UdpGameServer(port=0, record_results=False, best_of=2 * rounds - 1,
+                                        impairment=reliable_udp.Impairment(loss, delay, seed=2))
+    await server.start()
+    impairment = reliable_udp.Impairment(loss, delay, seed=3)
+    try:
+        return await run_matches(server, lambda: udp_connect(server.port, impairment), rounds)
+    finally:
+        await server.stop()
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main(rounds=100, delay_ms=5):
+    delay = delay_ms / 1000
+    print(f"{MATCHES} matches of {rounds} rounds per row, {delay_ms}ms one-way delay")
+    print(f"{'transport':<10} {'loss':>5} {'setup ms':>9} {'round p50':>10} {'p99':>8} {'max':>8}")
+    for loss in LOSS_RATES:
+        for label, bench in (("tcp", bench_tcp), ("udp", bench_udp)):
+            setups, latencies = asyncio.run(bench(rounds, loss, delay))
+            if len(latencies) != MATCHES * (rounds - 1):
+                print(f"FAIL {label} at {loss:.0%} loss completed {len(latencies)} rounds")
+                return 1
+            print(f"{label:<10} {loss:>5.0%} {max(setups) * 1e3:9.1f} {percentile(latencies, 0.5) * 1e3:10.2f} "
+                  f"{percentile(latencies, 0.99) * 1e3:8.2f} {max(latencies) * 1e3:8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,89 @@
+"""
+Measure round-completion latency when game results are written inline
+(one commit per statement) versus handed to the write-behind queue.
+
+Run from the repository root:
+    python -m benchmarks.bench_write_behind [rounds]
+"""
+import os
+import sys
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import database
+import write_behind
+
+SCHEMA = [
+    """CREATE TABLE users (
+        username TEXT PRIMARY KEY, password TEXT NOT NULL, score INTEGER DEFAULT 0,
+        games_played INTEGER DEFAULT 0, wins INTEGER DEFAULT 0, losses INTEGER DEFAULT 0, ties INTEGER DEFAULT 0
+    )""",
+    """CREATE TABLE games (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, player1 TEXT NOT NULL, player2 TEXT NOT NULL,
+        winner TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )""",
+]
+
+STATS_SQL = "UPDATE users SET games_played = games_played + 1, wins = wins + 1, score = score + 1 WHERE username = ?"
+GAME_SQL = "INSERT INTO games (player1, player2, winner) VALUES (?, ?, ?)"
+SCORE_SQL = "UPDATE users SET score = score + ? WHERE username = ?"
+
+
+def seed(path):
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO users (username, password) VALUES (?, ?)", [("alice", "x"), ("bob", "x")])
+    conn.commit()
+    conn.close()
+
+
+def report(label, samples, total):
+    samples.sort()
+    p50 = statistics.median(samples) * 1e6
+    p99 = samples[int(len(samples) * 0.99) - 1] * 1e6
+    print(f"{label:<32} p50 {p50:>9.1f} us   p99 {p99:>9.1f} us   {len(samples) / total:>10,.0f} rounds/sec")
+
+
+def inline_round():
+    database.execute(STATS_SQL, ("alice",))
+    database.execute(GAME_SQL, ("alice", "bob", "alice"))
+    database.execute(SCORE_SQL, (1, "alice"))
+
+
+def queued_round():
+    write_behind.submit(STATS_SQL, ("alice",))
+    write_behind.submit(GAME_SQL, ("alice", "bob", "alice"))
+    write_behind.submit(SCORE_SQL, (1, "alice"))
+
+
+def measure(label, round_func, rounds):
+    samples = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        round_func()
+        samples.append(time.perf_counter() - t0)
+    write_behind.flush()
+    report(label, samples, time.perf_counter() - start)
+
+
+def main(rounds=2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path)
+        database.configure(path, pragmas={"synchronous": "FULL"})
+        measure("inline, sync=FULL", inline_round, rounds)
+        for durability in ("full", "normal", "off"):
+            write_behind.configure(path=path, durability=durability)
+            measure(f"write-behind, {durability}", queued_round, rounds)
+        write_behind.shutdown()
+        games = database.fetch_one("SELECT COUNT(*) FROM games")[0]
+        print(f"games recorded: {games} (expected {rounds * 4})")
+        database.get_pool().close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,121 @@
+"""
+Query-plan regression check for every production query.
+
+Seeds a large throwaway database, applies the migrations and then, for
+each query below:
+  * runs EXPLAIN QUERY PLAN and fails if any step scans a whole table,
+    even through an index, or needs a temporary B-tree to sort, and
+  * times it and fails if the mean latency exceeds its budget.
+
+Exits with status 1 if anything regressed. Run from the repository root:
+    python -m benchmarks.check_query_plans [users]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import credentials
+import database
+import game_results
+import leaderboard
+import matchmaking
+import migrations
+import notifications
+import predictor
+import rollups
+import sessions
+
+# (name, SQL, parameters, latency budget in ms). Each statement is imported
+# from the module that runs it, so the check cannot drift from the app.
+PRODUCTION_QUERIES = [
+    ("login_user", credentials.PASSWORD_SQL, ("user42",), 1),
+    ("show_game_stats", sessions.PROFILE_SQL, ("user42",), 1),
+    ("player_rating", matchmaking.RATING_SQL, ("user42",), 1),
+    ("update_score", game_results.SCORE_SQL, (0, "user42"), 1),
+    ("record_session", game_results.SESSION_STATS_SQL, (0, 0, 0, 0, 0, "user42"), 1),
+    ("leaderboard page", leaderboard.TOP_PAGE_SQL, (50, 0), 2),
+    ("leaderboard deep page", leaderboard.TOP_PAGE_SQL, (50, 5000), 5),
+    ("invite_player", notifications.INVITE_SEARCH_SQL,
+     (*notifications.search_range(""), "user42", notifications.INVITE_PAGE_SIZE), 2),
+    ("invite_player search", notifications.INVITE_SEARCH_SQL,
+     (*notifications.search_range("user4"), "user42", notifications.INVITE_PAGE_SIZE), 2),
+    ("invite_player next page", notifications.INVITE_SEARCH_SQL,
+     (*notifications.search_range("", "user5"), "user42", notifications.INVITE_PAGE_SIZE), 2),
+    ("send_invite", notifications.INSERT_INVITE_SQL, ("user7", "user42"), 1),
+    ("show_received_invitations", notifications.INBOX_SQL, ("user42",), 1),
+    ("accept_invite", notifications.ACCEPT_INVITE_SQL, ("user7", "user42"), 1),
+    ("move predictor history", predictor.HISTORY_SQL, ("user42", "user42", predictor.HISTORY_LIMIT), 5),
+    ("stats window", rollups.WINDOW_SQL, ("user42", 20000, 20030, "user42", 479990, 480000, "user42", 480720, 480730), 2),
+    ("stats by hour of day", rollups.HOURLY_SQL, ("user42", 0, 500000), 5),
+]
+
+REPEAT = 200
+
+
+def seed(path, users):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+    database.configure(path)
+    migrations.migrate()
+    random.seed(7)
+    names = [f"user{i}" for i in range(users)]
+    database.executemany("INSERT INTO users (username, password, score) VALUES (?, 'x', ?)",
+                         ((name, random.randint(-500, 500)) for name in names))
+    database.executemany("INSERT INTO games (player1, player2, winner) VALUES (?, ?, ?)",
+                         ((random.choice(names), random.choice(names), None) for _ in range(users * 5)))
+    database.executemany("INSERT INTO invitations (sender, recipient, status) VALUES (?, ?, ?)",
+                         ((random.choice(names), random.choice(names), random.choice(("pending", "accepted", "declined")))
+                          for _ in range(users * 2)))
+    database.execute("ANALYZE")
+
+
+def plan_problems(sql, plan):
+    problems = []
+    # Every seeded table is large, so a SCAN reads all of it, through an index
+    # or not, unless a LIMIT stops the walk after the first rows
+    bounded = "LIMIT" in sql.upper()
+    for _, _, _, detail in plan:
+        # Reading back a subquery's own rows is not a table scan
+        if detail.startswith("SCAN") and not bounded and not detail.startswith("SCAN (subquery"):
+            problems.append(detail)
+        if "TEMP B-TREE" in detail:
+            problems.append(detail)
+    return problems
+
+
+def main(users=100_000):
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(os.path.join(tmp, "plans.db"), users)
+        with database.get_pool().connection() as conn:
+            for name, sql, params, budget_ms in PRODUCTION_QUERIES:
+                plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                problems = plan_problems(sql, plan)
+
+                # Writes are rolled back so every repetition sees the same data
+                conn.execute("BEGIN")
+                start = time.perf_counter()
+                for _ in range(REPEAT):
+                    conn.execute(sql, params).fetchall()
+                mean_ms = (time.perf_counter() - start) / REPEAT * 1e3
+                conn.rollback()
+
+                if mean_ms > budget_ms:
+                    problems.append(f"mean {mean_ms:.3f} ms exceeds budget of {budget_ms} ms")
+                status = "FAIL" if problems else "ok"
+                print(f"{status:<5} {name:<28} {mean_ms:8.3f} ms   {' | '.join(row[3] for row in plan)}")
+                for problem in problems:
+                    print(f"      -> {problem}")
+                failures += bool(problems)
+        database.get_pool().close()
+
+    print(f"{len(PRODUCTION_QUERIES) - failures}/{len(PRODUCTION_QUERIES)} queries passed on {users:,} users")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
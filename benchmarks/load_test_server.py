@@ -0,0 +1,76 @@
+"""
+Load-test the asyncio game server with simulated clients on localhost.
+
+Starts a GameServer on an ephemeral port, connects `clients` simulated
+players in waves of `concurrency`, and reports matches/sec and p50/p99
+round latency (choice sent -> result received). With best_of > 1 every
+match is a multi-round session over the same connection.
+
+Run from the repository root:
+    python -m benchmarks.load_test_server [clients] [concurrency] [best_of]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import protocol
+from game_server import GameServer, VALID_CHOICES
+
+
+async def simulated_client(port, name, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = protocol.FrameDecoder()
+    try:
+        # The first choice is pipelined behind the HELLO in the same packet
+        start = time.perf_counter()
+        writer.write(protocol.encode_hello(name) + protocol.encode_choice(random.choice(VALID_CHOICES)))
+        await writer.drain()
+        await protocol.read_frame(reader, decoder)  # SERVER
+        await protocol.read_frame(reader, decoder)  # the opponent's HELLO
+        while True:
+            msg_type, payload = await protocol.read_frame(reader, decoder)
+            if msg_type != protocol.RESULT:
+                break
+            latencies.append(time.perf_counter() - start)
+            if protocol.decode_result(payload).final:
+                break
+            start = time.perf_counter()
+            writer.write(protocol.encode_choice(random.choice(VALID_CHOICES)))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def run(clients, concurrency, best_of):
+    server = GameServer(port=0, record_results=False, best_of=best_of)
+    await server.start()
+    latencies = []
+    start = time.perf_counter()
+    for wave in range(0, clients, concurrency):
+        size = min(concurrency, clients - wave)
+        await asyncio.gather(*(simulated_client(server.port, f"bot{wave + i}", latencies) for i in range(size)))
+    elapsed = time.perf_counter() - start
+    await server.stop()
+
+    latencies.sort()
+    print(f"clients:         {clients} ({concurrency} concurrent)")
+    print(f"matches:         {server.matches_completed}")
+    print(f"matches/sec:     {server.matches_completed / elapsed:,.0f}")
+    print(f"rounds/sec:      {server.rounds_completed / elapsed:,.0f}")
+    if latencies:
+        print(f"round p50:       {percentile(latencies, 0.50) * 1e3:.2f} ms")
+        print(f"round p99:       {percentile(latencies, 0.99) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    best_of = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    asyncio.run(run(clients, concurrency, best_of))
@@ -0,0 +1,250 @@
+"""
+Bot opponents.
+
+A strategy picks integer move codes for a rule set and is told what both
+sides played after every round, so it can stand in for a human pressing a
+choice button anywhere a move is needed: in the simulation harness
+(simulation.py), in tournaments (play_bot_match) or as a real client of the
+game server (play_online).
+"""
+import argparse
+import asyncio
+import logging
+import random
+from collections import deque
+
+import protocol
+import rules
+import tournament
+from game_server import HOST, PORT
+
+
+class Strategy:
+    name = None
+
+    def __init__(self, rule_set=rules.CLASSIC, rng=None):
+        self.rule_set = rule_set
+        self.size = len(rule_set)
+        self.rng = rng or random.Random()
+
+    def choose(self):
+        """Return the next move code."""
+        return self.rng.randrange(self.size)
+
+    def observe(self, own_move, opponent_move):
+        """Called after every round with both move codes."""
+
+    def counter(self, counts):
+        """Beat the most likely opponent move given `counts` per move, or play randomly without data."""
+        best = max(range(self.size), key=counts.__getitem__)
+        if not counts[best]:
+            return self.rng.randrange(self.size)
+        return self.rule_set.counter_to(best)
+
+
+class RandomBot(Strategy):
+    """Uniformly random moves; unexploitable, and the baseline to beat."""
+
+    name = "random"
+
+
+class CycleBot(Strategy):
+    """Plays every move in turn. Trivially exploitable, useful to check the learners."""
+
+    name = "cycle"
+
+    def __init__(self, rule_set=rules.CLASSIC, rng=None):
+        super().__init__(rule_set, rng)
+        self.next_move = self.rng.randrange(self.size)
+
+    def choose(self):
+        move = self.next_move
+        self.next_move = (move + 1) % self.size
+        return move
+
+
+class FrequencyBot(Strategy):
+    """Counters the opponent's most frequent move so far."""
+
+    name = "frequency"
+
+    def __init__(self, rule_set=rules.CLASSIC, rng=None):
+        super().__init__(rule_set, rng)
+        self.counts = [0] * self.size
+
+    def choose(self):
+        return self.counter(self.counts)
+
+    def observe(self, own_move, opponent_move):
+        self.counts[opponent_move] += 1
+
+
+class MarkovBot(Strategy):
+    """
+    Learns which move the opponent tends to play after their last `order`
+    moves and counters the most likely one. Updates are O(1).
+    """
+
+    name = "markov"
+
+    def __init__(self, rule_set=rules.CLASSIC, rng=None, order=1):
+        super().__init__(rule_set, rng)
+        self.order = order
+        self.history = ()
+        self.transitions = {}
+
+    def choose(self):
+        counts = self.transitions.get(self.history)
+        if counts is None:
+            return self.rng.randrange(self.size)
+        return self.counter(counts)
+
+    def observe(self, own_move, opponent_move):
+        if len(self.history) == self.order:
+            counts = self.transitions.get(self.history)
+            if counts is None:
+                counts = self.transitions[self.history] = [0] * self.size
+            counts[opponent_move] += 1
+        self.history = (self.history + (opponent_move,))[-self.order:]
+
+
+class PatternBot(Strategy):
+    """
+    Looks for the longest recent run of rounds, up to `max_length`, that has
+    been seen before and counters whatever the opponent played after it.
+    Contexts include both players' moves, so it also picks up opponents who
+    react to what the bot just did.
+    """
+
+    name = "pattern"
+
+    def __init__(self, rule_set=rules.CLASSIC, rng=None, max_length=5):
+        super().__init__(rule_set, rng)
+        self.max_length = max_length
+        self.history = deque(maxlen=max_length)
+        self.followers = {}
+
+    def choose(self):
+        history = tuple(self.history)
+        for length in range(len(history), 0, -1):
+            counts = self.followers.get(history[-length:])
+            if counts is not None:
+                return self.counter(counts)
+        return self.rng.randrange(self.size)
+
+    def observe(self, own_move, opponent_move):
+        history = tuple(self.history)
+        for length in range(1, len(history) + 1):
+            context = history[-length:]
+            counts = self.followers.get(context)
+            if counts is None:
+                counts = self.followers[context] = [0] * self.size
+            counts[opponent_move] += 1
+        self.history.append(own_move * self.size + opponent_move)
+
+
+STRATEGIES = {cls.name: cls for cls in (RandomBot, CycleBot, FrequencyBot, MarkovBot, PatternBot)}
+
+
+def play_rounds(bot_a, bot_b, rounds):
+    """Play `rounds` rounds between two bots and return (wins, losses, ties) for bot_a."""
+    payoff = bot_a.rule_set.payoff
+    choose_a, choose_b = bot_a.choose, bot_b.choose
+    observe_a, observe_b = bot_a.observe, bot_b.observe
+    wins = losses = 0
+    for _ in range(rounds):
+        move_a, move_b = choose_a(), choose_b()
+        outcome = payoff[move_a][move_b]
+        if outcome == rules.WIN:
+            wins += 1
+        elif outcome == rules.LOSS:
+            losses += 1
+        observe_a(move_a, move_b)
+        observe_b(move_b, move_a)
+    return wins, losses, rounds - wins - losses
+
+
+def strategy_for(player):
+    """Tournament players named '<strategy>' or '<strategy>#<anything>' are bots of that strategy."""
+    return STRATEGIES[player.partition("#")[0]]
+
+
+def play_bot_match(player_a, player_b, rule_set, best_of, rng):
+    """Match function for tournament.Tournament with bot players (see strategy_for)."""
+    bot_a = strategy_for(player_a)(rule_set, random.Random(rng.random()))
+    bot_b = strategy_for(player_b)(rule_set, random.Random(rng.random()))
+    needed = best_of // 2 + 1
+    outcomes = []
+    wins = losses = 0
+    while wins < needed and losses < needed and len(outcomes) < tournament.MAX_MATCH_ROUNDS:
+        move_a, move_b = bot_a.choose(), bot_b.choose()
+        outcome = rule_set.payoff[move_a][move_b]
+        if outcome == rules.WIN:
+            wins += 1
+        elif outcome == rules.LOSS:
+            losses += 1
+        outcomes.append(rules.OUTCOME_NAMES[outcome])
+        bot_a.observe(move_a, move_b)
+        bot_b.observe(move_b, move_a)
+    return outcomes
+
+
+async def play_online(strategy, name, host=HOST, port=PORT):
+    """
+    Play one session against the game server as `name`, letting `strategy`
+    choose every move. Returns the outcomes from the bot's point of view.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    decoder = protocol.FrameDecoder()
+    moves, codes = strategy.rule_set.moves, strategy.rule_set.codes
+    outcomes = []
+    try:
+        # The first choice is pipelined behind the HELLO, like a quick human
+        move = strategy.choose()
+        writer.write(protocol.encode_hello(name) + protocol.encode_choice(moves[move]))
+        await writer.drain()
+        msg_type, payload = await protocol.read_frame(reader, decoder)
+        if msg_type == protocol.SERVER:  # the greeting, answered already by our HELLO
+            msg_type, payload = await protocol.read_frame(reader, decoder)
+        if msg_type != protocol.HELLO:
+            raise protocol.ProtocolError(f"Expected HELLO, received message type {msg_type}")
+        logging.debug("%s matched with %s.", name, protocol.decode_hello(payload))
+        while True:
+            msg_type, payload = await protocol.read_frame(reader, decoder)
+            if msg_type != protocol.RESULT:
+                break
+            result = protocol.decode_result(payload)
+            outcomes.append(result.outcome)
+            strategy.observe(move, codes[result.opponent_move])
+            if result.final:
+                break
+            move = strategy.choose()
+            writer.write(protocol.encode_choice(moves[move]))
+            await writer.drain()
+    except ConnectionError:
+        logging.info("%s lost the connection to the game server.", name)
+    except protocol.ProtocolError as error:
+        logging.warning("%s got an invalid frame from the game server: %s", name, error)
+    finally:
+        writer.close()
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play Rock, Paper, Scissors against the game server with a bot.")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="markov")
+    parser.add_argument("--name", default="bot")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--rules", choices=sorted(rules.RULE_SETS), default=rules.CLASSIC.name)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    strategy = STRATEGIES[args.strategy](rules.RULE_SETS[args.rules])
+    outcomes = asyncio.run(play_online(strategy, args.name, args.host, args.port))
+    logging.info("%s finished: %d wins, %d losses, %d ties.", args.name,
+                 outcomes.count("win"), outcomes.count("loss"), outcomes.count("tie"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Fan-out of already encoded frames from one publisher to many subscribers.
+
+A Broadcast keeps the last `capacity` published frames in a ring and each
+subscriber is just a cursor into it. Publishing stores the frame and wakes a
+single pump task, so it costs the same for one viewer as for ten thousand
+and never waits on any of them. The pump then gives every subscriber
+everything it has not had yet in one write; subscribers at the same cursor,
+which is nearly all of them, share the same joined bytes, so a frame is
+encoded once and batched once however many connections it goes to. The pump
+yields to the event loop every YIELD_EVERY subscribers, so the players'
+own sockets are served between batches.
+
+Backpressure is per subscriber. One whose transport holds more than
+`high_water` unsent bytes is skipped until it drains, while the others carry
+on, and it is dropped when it falls more than `capacity` frames behind or
+stays full for longer than `send_timeout`.
+"""
+import asyncio
+import logging
+import time
+
+import metrics
+
+CAPACITY = 256          # frames kept for subscribers that are behind
+SEND_TIMEOUT = 5.0      # seconds a subscriber's socket may stay full
+HIGH_WATER = 64 * 1024  # unsent bytes per subscriber before it is skipped
+YIELD_EVERY = 1000      # subscribers written between returns to the event loop
+BLOCKED_POLL = 0.05     # seconds between checks on subscribers waiting to drain
+
+SUBSCRIBERS = metrics.gauge("rps_broadcast_subscribers", "Connections subscribed to a broadcast.")
+DROPPED = metrics.counter("rps_broadcast_dropped_total", "Subscribers dropped for falling behind.")
+
+
+class Subscriber:
+    __slots__ = ("transport", "cursor", "blocked_since", "done")
+
+    def __init__(self, transport, cursor):
+        self.transport = transport
+        self.cursor = cursor
+        self.blocked_since = None
+        # Resolved with True once everything was sent, False if dropped or gone
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class Broadcast:
+    def __init__(self, capacity=CAPACITY, send_timeout=SEND_TIMEOUT, high_water=HIGH_WATER):
+        self.capacity = capacity
+        self.send_timeout = send_timeout
+        self.high_water = high_water
+        self.published = 0  # sequence number of the next frame
+        self.dropped = 0
+        self.closed = False
+        self._ring = [b""] * capacity
+        self._subscribers = []
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def publish(self, frame):
+        if self.closed:
+            raise RuntimeError("Broadcast is closed")
+        self._ring[self.published % self.capacity] = frame
+        self.published += 1
+        self._wakeup.set()
+
+    def close(self):
+        """Let subscribers receive what is left, then resolve their serve() calls."""
+        self.closed = True
+        self._wakeup.set()
+
+    def subscribe(self, writer, first=b""):
+        """Send `first` now and every frame published from now on; returns the Subscriber."""
+        subscriber = Subscriber(writer.transport, self.published)
+        if first:
+            subscriber.transport.write(first)
+        self._subscribers.append(subscriber)
+        SUBSCRIBERS.inc()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.ensure_future(self._pump())
+        self._wakeup.set()
+        return subscriber
+
+    async def serve(self, writer, first=b""):
+        """
+        Subscribe `writer` and wait until the broadcast closes and everything
+        was sent. Returns False if the subscriber was dropped or disconnected.
+        """
+        return await self.subscribe(writer, first).done
+
+    def _finish(self, subscriber, sent_everything):
+        if not subscriber.done.done():
+            subscriber.done.set_result(sent_everything)
+        SUBSCRIBERS.dec()
+
+    def _drop(self, subscriber, reason):
+        self.dropped += 1
+        DROPPED.inc()
+        logging.debug("Dropped a slow subscriber: %s.", reason)
+        subscriber.transport.abort()
+        self._finish(subscriber, False)
+
+    def _pending(self, cursor, end):
+        ring, capacity = self._ring, self.capacity
+        if end - cursor == 1:
+            return ring[cursor % capacity]
+        return b"".join([ring[seq % capacity] for seq in range(cursor, end)])
+
+    async def _pump(self):
+        while self._subscribers:
+            self._wakeup.clear()
+            now = time.monotonic()
+            end = self.published
+            batches = {}
+            remaining, blocked = [], False
+            current = list(self._subscribers)
+            for count, subscriber in enumerate(current, 1):
+                transport = subscriber.transport
+                if transport.is_closing():
+                    self._finish(subscriber, False)
+                    continue
+                if subscriber.cursor != end:
+                    if end - subscriber.cursor > self.capacity:
+                        self._drop(subscriber, f"{end - subscriber.cursor} frames behind")
+                        continue
+                    if transport.get_write_buffer_size() > self.high_water:
+                        if subscriber.blocked_since is None:
+                            subscriber.blocked_since = now
+                        elif now - subscriber.blocked_since > self.send_timeout:
+                            self._drop(subscriber, "send timed out")
+                            continue
+                        blocked = True
+                    else:
+                        subscriber.blocked_since = None
+                        data = batches.get(subscriber.cursor)
+                        if data is None:
+                            data = batches[subscriber.cursor] = self._pending(subscriber.cursor, end)
+                        transport.write(data)
+                        subscriber.cursor = end
+                elif self.closed:
+                    self._finish(subscriber, True)
+                    continue
+                remaining.append(subscriber)
+                if count % YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+            # Keep whoever subscribed while we were yielding
+            self._subscribers = remaining + self._subscribers[len(current):]
+            if blocked:
+                # Nothing tells us when a transport drains, so look again shortly
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), BLOCKED_POLL)
+                except asyncio.TimeoutError:
+                    pass
+            elif not self.closed:
+                await self._wakeup.wait()
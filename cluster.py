@@ -0,0 +1,442 @@
+"""
+Multi-process deployment of the game server: one front process and N
+worker processes, each with its own event loop and its own core.
+
+The front owns the listening socket. It greets each connection with SERVER,
+reads its first frame, checks the session token of a LOGIN, pairs players
+in arrival order exactly like GameServer, and hands both sockets of a pair,
+with the bytes it already read, to the least busy worker over a Unix socket
+(SCM_RIGHTS). A LOGIN is handed over as a HELLO with the verified name and
+a logged-in flag, so workers never need the token secret. The worker runs the unchanged MatchSession
+and the front never touches the connection again. SO_REUSEPORT would spread
+connections without the front, but it hashes each connection on its own, so
+the two players of a match would usually land in different processes.
+
+The front is also the coordination layer. Pairing happens only there, it
+keeps the directory of live matches so WATCH connections reach the right
+worker, and workers report each finished session back with its score change
+so the front process applies the leaderboard and profile cache hooks for
+the other services running next to it. Workers write results to the shared
+SQLite database through their own write-behind queue; WAL mode and the pool's
+busy timeout let them commit side by side.
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+from collections import deque
+
+import database
+import leaderboard
+import protocol
+import replay_log
+import rules
+import sessions
+import write_behind
+from game_server import (ACTIVE_SESSIONS, HANDSHAKE_SECONDS, HANDSHAKE_TIMEOUT, HOST, MATCHES, PORT, MatchSession,
+                         Player, identify)
+
+WORKERS = os.cpu_count() or 1
+MAX_HANDSHAKE = 4096  # bytes the front reads from a connection before giving up on its first frame
+CONTROL_SIZE = 2 * MAX_HANDSHAKE + 64
+
+# Front -> worker: kind, session id, which players logged in (bit 0 for A, bit 1 for B),
+# then the bytes already read from each socket
+PAIR, WATCH = 1, 2
+_HANDOFF = struct.Struct("!BIBII")
+# Worker -> front: session id, rounds played, score change of player A, whether results were recorded
+_ENDED = struct.Struct("!IIiB")
+
+
+class _Channel:
+    """
+    One end of the SOCK_SEQPACKET pair between the front and a worker.
+
+    Messages keep their boundaries and may carry file descriptors. Sends
+    never block the event loop: what the socket cannot take yet waits in an
+    outbox until it is writable.
+    """
+
+    def __init__(self, sock, on_message, on_closed):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.on_message = on_message
+        self.on_closed = on_closed
+        self.closed = False
+        self._outbox = deque()
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._readable)
+
+    def send(self, data, socks=()):
+        """Send `data` and pass `socks` along; our copies of them are closed once sent."""
+        if self.closed:
+            for sock in socks:
+                sock.close()
+            return
+        self._outbox.append((data, socks))
+        if len(self._outbox) == 1:
+            self._writable()
+
+    def _writable(self):
+        while self._outbox:
+            data, socks = self._outbox[0]
+            try:
+                socket.send_fds(self.sock, [data], [sock.fileno() for sock in socks])
+            except BlockingIOError:
+                self._loop.add_writer(self.sock.fileno(), self._writable)
+                return
+            except OSError:
+                self.close()
+                return
+            self._outbox.popleft()
+            for sock in socks:
+                sock.close()
+        self._loop.remove_writer(self.sock.fileno())
+
+    def _readable(self):
+        while not self.closed:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.sock, CONTROL_SIZE, 2)
+            except BlockingIOError:
+                return
+            except OSError:
+                data, fds = b"", []
+            if not data and not fds:
+                self.close()
+                return
+            self.on_message(data, fds)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._loop.remove_reader(self.sock.fileno())
+        self._loop.remove_writer(self.sock.fileno())
+        for _, socks in self._outbox:
+            for sock in socks:
+                sock.close()
+        self._outbox.clear()
+        self.sock.close()
+        self.on_closed()
+
+
+class _WorkerHandle:
+    def __init__(self, index, process, channel=None):
+        self.index = index
+        self.process = process
+        self.channel = channel
+        self.sessions = 0
+
+
+class ClusterFront:
+    """
+    Accepts players, pairs them and hands each match to one of `workers`
+    processes; serve_forever()/stop() like GameServer. The database and
+    replay log options are passed to the workers, which configure their own
+    pool, writer and replay log.
+    """
+
+    def __init__(self, host=HOST, port=PORT, workers=WORKERS, record_results=True, best_of=1,
+                 rule_set=rules.CLASSIC, db_path=None, durability="normal", replay_dir=None, require_commit=False):
+        self.host = host
+        self.port = port
+        self.worker_count = workers or WORKERS
+        self.record_results = record_results
+        self.best_of = best_of
+        self.rule_set = rule_set
+        self.db_path = db_path
+        self.durability = durability
+        self.replay_dir = replay_dir
+        self.require_commit = require_commit
+        self.workers = []
+        self.sessions = {}  # session id -> (worker, player names)
+        self.live = {}      # player name -> session id, for spectators
+        self.matches_completed = 0
+        self.rounds_completed = 0
+        self._waiting = None
+        self._ids = itertools.count(1)
+        self._listener = None
+        self._accept_task = None
+        self._handshakes = set()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+        options = {
+            "record_results": self.record_results,
+            "best_of": self.best_of,
+            "rules": self.rule_set.name,
+            "require_commit": self.require_commit,
+            "db_path": self.db_path or database.get_pool().path,
+            "durability": self.durability,
+            "replay_dir": self.replay_dir,
+            "log_level": logging.getLogger().level,
+        }
+        for index in range(self.worker_count):
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            process = context.Process(target=_worker_main, args=(theirs, index, options),
+                                      name=f"game-worker-{index}", daemon=True)
+            process.start()
+            theirs.close()
+            worker = _WorkerHandle(index, process)
+            worker.channel = _Channel(ours, lambda data, fds, worker=worker: self._on_report(worker, data, fds),
+                                      lambda worker=worker: self._on_worker_lost(worker))
+            self.workers.append(worker)
+
+        self._listener = socket.create_server((self.host, self.port), backlog=4096)
+        self._listener.setblocking(False)
+        self.port = self._listener.getsockname()[1]
+        self._accept_task = loop.create_task(self._accept_loop())
+        ACTIVE_SESSIONS.set_function(lambda: len(self.sessions))
+        logging.info("Game server listening on %s:%d with %d worker processes.", self.host, self.port, len(self.workers))
+
+    async def serve_forever(self):
+        if self._listener is None:
+            await self.start()
+        try:
+            await self._accept_task
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        if self._accept_task is not None:
+            self._accept_task.cancel()
+            await asyncio.gather(self._accept_task, *self._handshakes, return_exceptions=True)
+        if self._listener is not None:
+            self._listener.close()
+        if self._waiting is not None:
+            self._waiting[1].close()
+            self._waiting = None
+        # Workers stop when their channel closes, after flushing their results
+        for worker in self.workers:
+            worker.channel.close()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, worker.process.join, 10) for worker in self.workers))
+        self.workers = []
+
+    async def _accept_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            sock, _ = await loop.sock_accept(self._listener)
+            task = loop.create_task(self._handshake(sock))
+            self._handshakes.add(task)
+            task.add_done_callback(self._handshakes.discard)
+
+    async def _handshake(self, sock):
+        start = asyncio.get_running_loop().time()
+        sock.setblocking(False)
+        try:
+            await asyncio.get_running_loop().sock_sendall(sock, protocol.encode_server())
+            msg_type, payload, received = await asyncio.wait_for(_read_first_frame(sock), HANDSHAKE_TIMEOUT)
+            if msg_type == protocol.WATCH:
+                name, logged_in = protocol.decode_hello(payload), False
+            else:
+                name, logged_in = identify(msg_type, payload) or ("", False)
+                # Workers get the verified name, not the token
+                received = protocol.encode_hello(name) + received[protocol.HEADER_SIZE + len(payload):]
+        except (asyncio.TimeoutError, ConnectionError, protocol.ProtocolError, UnicodeDecodeError):
+            sock.close()
+            return
+        except asyncio.CancelledError:
+            sock.close()
+            raise
+        if not name:
+            sock.close()
+            return
+        HANDSHAKE_SECONDS.observe(asyncio.get_running_loop().time() - start)
+        if msg_type == protocol.WATCH:
+            await self._watch(name, sock, received)
+            return
+
+        waiting, self._waiting = self._waiting, None
+        if waiting is None or _peer_closed(waiting[1]):
+            if waiting is not None:
+                waiting[1].close()
+            self._waiting = (name, sock, received, logged_in)
+            return
+        worker = min((worker for worker in self.workers if not worker.channel.closed),
+                     key=lambda worker: worker.sessions, default=None)
+        if worker is None:
+            logging.error("No game worker left to run a match.")
+            sock.close()
+            waiting[1].close()
+            return
+        session_id = next(self._ids)
+        names = (waiting[0], name)
+        self.sessions[session_id] = (worker, names)
+        for player in names:
+            self.live[player] = session_id
+        worker.sessions += 1
+        logins = waiting[3] | logged_in << 1
+        worker.channel.send(_HANDOFF.pack(PAIR, session_id, logins, len(waiting[2]), len(received))
+                            + waiting[2] + received, (waiting[1], sock))
+
+    async def _watch(self, name, sock, received):
+        entry = self.sessions.get(self.live.get(name))
+        if entry is None:
+            try:
+                await asyncio.get_running_loop().sock_sendall(sock, protocol.encode_abort(f"{name} is not playing"))
+            except OSError:
+                pass
+            sock.close()
+            return
+        worker = entry[0]
+        worker.channel.send(_HANDOFF.pack(WATCH, self.live[name], 0, len(received), 0) + received, (sock,))
+
+    def _on_report(self, worker, data, fds):
+        for fd in fds:
+            os.close(fd)
+        session_id, rounds, delta, recorded = _ENDED.unpack(data)
+        entry = self.sessions.pop(session_id, None)
+        if entry is None:
+            return
+        worker.sessions -= 1
+        names = entry[1]
+        for player in names:
+            if self.live.get(player) == session_id:
+                del self.live[player]
+        if rounds:
+            MATCHES.inc()
+            self.matches_completed += 1
+            self.rounds_completed += rounds
+        if recorded:
+            # The worker already wrote the rows; these are the in-process hooks for this side
+            for player, change in zip(names, (delta, -delta)):
+                leaderboard.record_delta(player, change)
+                sessions.invalidate_profile(player)
+
+    def _on_worker_lost(self, worker):
+        if self._listener is None or self._listener.fileno() == -1:
+            return  # stopping
+        logging.error("Game worker %d exited; its %d matches are lost.", worker.index, worker.sessions)
+        for session_id, (owner, names) in list(self.sessions.items()):
+            if owner is worker:
+                del self.sessions[session_id]
+                for player in names:
+                    if self.live.get(player) == session_id:
+                        del self.live[player]
+
+
+async def _read_first_frame(sock):
+    """Read until one whole frame has arrived; return it with every byte read so far."""
+    loop = asyncio.get_running_loop()
+    decoder = protocol.FrameDecoder()
+    received = b""
+    while not len(decoder):
+        data = await loop.sock_recv(sock, MAX_HANDSHAKE)
+        if not data:
+            raise ConnectionResetError("Connection closed by peer")
+        received += data
+        if len(received) > MAX_HANDSHAKE:
+            raise protocol.ProtocolError("First frame too large")
+        decoder.feed(data)
+    msg_type, payload = decoder.next_frame()
+    return msg_type, payload, received
+
+
+def _peer_closed(sock):
+    """True if the peer of a connection we are not reading from has gone away."""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+class ClusterWorker:
+    """Runs the matches and spectators the front hands over, on this process's event loop."""
+
+    def __init__(self, channel_sock, record_results=True, best_of=1, rule_set=rules.CLASSIC, require_commit=False):
+        self.channel_sock = channel_sock
+        self.record_results = record_results
+        self.best_of = best_of
+        self.rule_set = rule_set
+        self.require_commit = require_commit
+        self.sessions = {}  # session id -> MatchSession
+        self._tasks = set()
+        self._stopped = None
+        self._channel = None
+
+    async def run(self):
+        self._stopped = asyncio.Event()
+        self._channel = _Channel(self.channel_sock, self._on_handoff, self._stopped.set)
+        await self._stopped.wait()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _on_handoff(self, data, fds):
+        socks = [socket.socket(fileno=fd) for fd in fds]
+        kind, session_id, logins, length_a, length_b = _HANDOFF.unpack_from(data)
+        received = data[_HANDOFF.size:]
+        if kind == PAIR and len(socks) == 2:
+            coroutine = self._run_pair(session_id, socks, (received[:length_a], received[length_a:length_a + length_b]),
+                                       (bool(logins & 1), bool(logins & 2)))
+        elif kind == WATCH and len(socks) == 1:
+            coroutine = self._watch(session_id, socks[0])
+        else:
+            logging.error("Bad handoff from the front: kind %d with %d sockets.", kind, len(socks))
+            for sock in socks:
+                sock.close()
+            return
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_pair(self, session_id, socks, received, logins):
+        players, session, outcomes = [], None, []
+        try:
+            for sock, data, logged_in in zip(socks, received, logins):
+                decoder = protocol.FrameDecoder()
+                decoder.feed(data)
+                name = protocol.decode_hello(decoder.next_frame()[1])
+                reader, writer = await asyncio.open_connection(sock=sock)
+                players.append(Player(name, reader, writer, decoder, logged_in))
+            session = MatchSession(session_id, *players, self.record_results, self.best_of, self.rule_set,
+                                   self.require_commit)
+            self.sessions[session_id] = session
+            outcomes = await session.run()
+        finally:
+            self.sessions.pop(session_id, None)
+            if session is None:
+                for player in players:
+                    player.close()
+                for sock in socks[len(players):]:
+                    sock.close()
+            delta = outcomes.count("win") - outcomes.count("loss")
+            self._channel.send(_ENDED.pack(session_id, len(outcomes), delta, session is not None and session.recorded))
+
+    async def _watch(self, session_id, sock):
+        reader, writer = await asyncio.open_connection(sock=sock)
+        session = self.sessions.get(session_id)
+        try:
+            if session is None:
+                writer.write(protocol.encode_abort("The match has ended"))
+                await writer.drain()
+            else:
+                await session.watch(writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _worker_main(channel_sock, index, options):
+    logging.basicConfig(level=options["log_level"], format=f'%(asctime)s - worker {index} - %(levelname)s - %(message)s')
+    database.configure(options["db_path"])
+    write_behind.configure(path=options["db_path"], durability=options["durability"])
+    if options["replay_dir"]:
+        # A replay log has a single writer, so every worker keeps its own
+        replay_log.configure(os.path.join(options["replay_dir"], f"worker-{index}"))
+    worker = ClusterWorker(channel_sock, options["record_results"], options["best_of"],
+                           rules.RULE_SETS[options["rules"]], options["require_commit"])
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        write_behind.shutdown()
@@ -0,0 +1,98 @@
+"""
+Commit-reveal for moves, so that no player can choose after seeing the
+other's move.
+
+A player first sends COMMIT with
+
+    SHA-256(TAG | nonce | move code)
+
+where the nonce is NONCE_SIZE fresh random bytes, and sends REVEAL with the
+move and the nonce only once the opponent is locked in. The nonce keeps the
+handful of possible moves from being guessed from the digest, and SHA-256
+keeps the player from opening the commitment as a different move.
+
+Verifying is one hash per reveal. The game server checks both reveals of a
+round with a single verify_many() call; blocking clients play a round with
+exchange_moves().
+"""
+import hashlib
+import logging
+import os
+
+import protocol
+
+TAG = b"rps-commit-1"
+NONCE_SIZE = protocol.NONCE_SIZE
+DIGEST_SIZE = protocol.COMMITMENT_SIZE
+
+_MOVE_BYTES = {move: bytes((code,)) for move, code in protocol.MOVE_CODES.items()}
+
+
+def digest(move, nonce):
+    return hashlib.sha256(TAG + nonce + _MOVE_BYTES[move]).digest()
+
+
+def commit(move):
+    """Return (commitment, nonce) for `move`; the nonce stays secret until the reveal."""
+    nonce = os.urandom(NONCE_SIZE)
+    return digest(move, nonce), nonce
+
+
+def verify(commitment, move, nonce):
+    return digest(move, nonce) == commitment
+
+
+def verify_many(reveals):
+    """
+    Check (commitment, move, nonce) triples and return the positions of the
+    ones that do not match, so an empty list means every reveal is honest.
+    """
+    sha256, move_bytes = hashlib.sha256, _MOVE_BYTES
+    failed = []
+    for position, (commitment, move, nonce) in enumerate(reveals):
+        if sha256(TAG + nonce + move_bytes[move]).digest() != commitment:
+            failed.append(position)
+    return failed
+
+
+def exchange_moves(conn, decoder, move):
+    """
+    Play one round over the blocking socket `conn` and return
+    (opponent move, final), or None if the opponent left.
+
+    Our REVEAL goes out only once the opponent is locked in. If their COMMIT
+    is already waiting, COMMIT and REVEAL leave in the same packet. A peer
+    ends the round with its REVEAL, checked against its commitment; the game
+    server verifies both and ends it with a RESULT.
+    """
+    commitment, nonce = commit(move)
+    frame = protocol.poll_frame(conn, decoder)
+    while frame is not None and frame[0] == protocol.REMATCH:
+        frame = protocol.poll_frame(conn, decoder)
+    revealed = frame is not None and frame[0] == protocol.COMMIT
+    if revealed:
+        protocol.send_frames(conn, protocol.encode_commit(commitment), protocol.encode_reveal(move, nonce))
+    else:
+        protocol.send_frames(conn, protocol.encode_commit(commitment))
+    opponent_commitment = None
+    while True:
+        msg_type, payload = frame or protocol.recv_frame(conn, decoder)
+        frame = None
+        if msg_type == protocol.COMMIT:
+            opponent_commitment = protocol.decode_commit(payload)
+            if not revealed:
+                protocol.send_frames(conn, protocol.encode_reveal(move, nonce))
+                revealed = True
+        elif msg_type == protocol.REVEAL:
+            opponent_move, opponent_nonce = protocol.decode_reveal(payload)
+            if not opponent_commitment or not verify(opponent_commitment, opponent_move, opponent_nonce):
+                raise protocol.ProtocolError("Opponent's move does not match their commitment")
+            return opponent_move, False
+        elif msg_type == protocol.RESULT:
+            round_result = protocol.decode_result(payload)
+            return round_result.opponent_move, round_result.final
+        elif msg_type == protocol.CHOICE:
+            raise protocol.ProtocolError("Opponent does not commit to their moves")
+        elif msg_type != protocol.REMATCH:
+            logging.info("Received message type %s instead of a move.", msg_type)
+            return None
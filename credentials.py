@@ -0,0 +1,333 @@
+"""
+Password storage and checking.
+
+Passwords are stored as salted KDF hashes that carry their own parameters:
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+so the cost can be raised at any time without invalidating old records.
+A successful login whose record uses other parameters than the current
+ones, including the unsalted SHA-256 hex digests written by older versions,
+is transparently rehashed.
+
+All KDF work runs on a small bounded thread pool (hashlib releases the GIL
+while it hashes), so register() and authenticate() return futures and never
+block the GUI or an event loop. A burst beyond `max_pending` outstanding
+requests is refused with CredentialsBusy instead of queueing without bound.
+
+Clients do not check passwords themselves. LoginService runs next to the
+other services, checks the password sent in an AUTH frame and answers with a
+session token signed there, so the signing key never leaves the servers;
+request_login() and request_registration() are the client side.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import leaderboard
+import protocol
+import sessions
+
+HOST = "127.0.0.1"
+LOGIN_PORT = 5560
+
+# Seconds a client may take to send AUTH, and waits for the answer
+AUTH_TIMEOUT = 10
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# Cost settings, cheapest first. benchmarks/bench_credentials.py reports
+# logins/sec for each to size the worker pool.
+COST_LEVELS = {
+    "low": ("scrypt", {"n": 2 ** 12, "r": 8, "p": 1}),
+    "interactive": ("scrypt", {"n": 2 ** 14, "r": 8, "p": 1}),
+    "high": ("scrypt", {"n": 2 ** 16, "r": 8, "p": 1}),
+    "pbkdf2": ("pbkdf2_sha256", {"iterations": 600_000}),
+}
+DEFAULT_COST = "interactive"
+
+KDF_WORKERS = 2
+MAX_PENDING = 64
+
+PASSWORD_SQL = "SELECT password FROM users WHERE username = ?"
+REGISTER_SQL = "INSERT INTO users (username, password) VALUES (?, ?)"
+# Only replaces the hash that was just verified, so a concurrent change wins
+REHASH_SQL = "UPDATE users SET password = ? WHERE username = ? AND password = ?"
+
+
+class CredentialsBusy(Exception):
+    pass
+
+
+class LoginRefused(Exception):
+    """The login service turned the request down; the message says why."""
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _derive(algorithm, params, password, salt):
+    if algorithm == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * n + (1 << 20), dklen=HASH_BYTES)
+    if algorithm == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, params["iterations"], HASH_BYTES)
+    raise ValueError(f"Unknown password algorithm: {algorithm}")
+
+
+def hash_password(password, cost=DEFAULT_COST):
+    """Return the encoded, salted hash of `password` at the given cost level."""
+    algorithm, params = COST_LEVELS[cost]
+    salt = os.urandom(SALT_BYTES)
+    digest = _b64(_derive(algorithm, params, password, salt))
+    if algorithm == "scrypt":
+        return f"scrypt${params['n']}${params['r']}${params['p']}${_b64(salt)}${digest}"
+    return f"pbkdf2_sha256${params['iterations']}${_b64(salt)}${digest}"
+
+
+def parse(encoded):
+    """Return (algorithm, params) of a stored hash; legacy digests are ('sha256', {})."""
+    fields = encoded.split("$")
+    if fields[0] == "scrypt" and len(fields) == 6:
+        return "scrypt", {"n": int(fields[1]), "r": int(fields[2]), "p": int(fields[3])}
+    if fields[0] == "pbkdf2_sha256" and len(fields) == 4:
+        return "pbkdf2_sha256", {"iterations": int(fields[1])}
+    if len(encoded) == 64:
+        return "sha256", {}
+    raise ValueError("Unrecognised password hash")
+
+
+def verify_password(password, encoded, cost=DEFAULT_COST):
+    """Return (matches, needs_rehash) for `password` against a stored hash."""
+    algorithm, params = parse(encoded)
+    if algorithm == "sha256":
+        # Unsalted digests from before this module; always upgraded
+        matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+        return matches, True
+    salt, digest = encoded.split("$")[-2:]
+    matches = hmac.compare_digest(_derive(algorithm, params, password, _unb64(salt)), _unb64(digest))
+    return matches, (algorithm, params) != COST_LEVELS[cost]
+
+
+class Credentials:
+    def __init__(self, cost=DEFAULT_COST, workers=KDF_WORKERS, max_pending=MAX_PENDING):
+        if cost not in COST_LEVELS:
+            raise ValueError(f"Unknown cost level: {cost}")
+        self.cost = cost
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._dummy = None
+        self.rehashed = 0
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise CredentialsBusy("Too many logins in progress, try again shortly")
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def register(self, username, password):
+        """Future resolving to True once the user is created, False if the name is taken."""
+        return self._submit(self._register, username, password)
+
+    def authenticate(self, username, password):
+        """Future resolving to True if the password is right."""
+        return self._submit(self._authenticate, username, password)
+
+    async def authenticate_async(self, username, password):
+        return await asyncio.wrap_future(self.authenticate(username, password))
+
+    def _register(self, username, password):
+        try:
+            database.execute(REGISTER_SQL, (username, hash_password(password, self.cost)), label="register")
+        except sqlite3.IntegrityError:
+            return False
+        leaderboard.record_new_player(username)
+        return True
+
+    def _authenticate(self, username, password):
+        row = database.fetch_one(PASSWORD_SQL, (username,), label="authenticate")
+        if row is None:
+            # Verify against a throwaway hash anyway, so a wrong username takes
+            # as long as a wrong password
+            if self._dummy is None:
+                self._dummy = hash_password("", self.cost)
+            verify_password(password, self._dummy, self.cost)
+            return False
+        try:
+            matches, needs_rehash = verify_password(password, row[0], self.cost)
+        except ValueError:
+            logging.error("Stored password for %s is in an unknown format.", username)
+            return False
+        if matches and needs_rehash:
+            database.execute(REHASH_SQL, (hash_password(password, self.cost), username, row[0]),
+                             label="rehash_password")
+            self.rehashed += 1
+            logging.info("Upgraded the stored password hash for %s.", username)
+        return matches
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+
+def configure(**options):
+    """Replace the shared instance, e.g. configure(cost='high', workers=4)."""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is not None:
+            _credentials.close()
+        _credentials = Credentials(**options)
+    return _credentials
+
+
+def get_credentials():
+    global _credentials
+    if _credentials is None:
+        with _credentials_lock:
+            if _credentials is None:
+                _credentials = Credentials()
+    return _credentials
+
+
+def register(username, password):
+    return get_credentials().register(username, password)
+
+
+def authenticate(username, password):
+    return get_credentials().authenticate(username, password)
+
+
+class LoginService:
+    """
+    Checks passwords for clients and issues their session tokens.
+
+    A client sends one AUTH frame and gets back TOKEN, with a token after a
+    login and empty after a registration, or ABORT with the reason it was
+    refused. The KDF runs on the Credentials pool, so the event loop only
+    waits on futures.
+    """
+
+    def __init__(self, host=HOST, port=LOGIN_PORT, credentials=None):
+        self.host = host
+        self.port = port
+        self.credentials = credentials
+        self.logins = 0
+        self.refused = 0
+        self._server = None
+
+    async def start(self):
+        if self.credentials is None:
+            self.credentials = get_credentials()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Login service listening on %s:%d.", self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _answer(self, action, username, password):
+        if not username or not password:
+            return protocol.encode_abort("Please fill in both fields.")
+        try:
+            if action == protocol.AUTH_REGISTER:
+                if await asyncio.wrap_future(self.credentials.register(username, password)):
+                    return protocol.encode_token()
+                return protocol.encode_abort("Username already exists.")
+            if await self.credentials.authenticate_async(username, password):
+                self.logins += 1
+                return protocol.encode_token(sessions.issue(username))
+        except CredentialsBusy:
+            return protocol.encode_abort("Too many requests, please try again.")
+        self.refused += 1
+        return protocol.encode_abort("Invalid username or password.")
+
+    async def _handle_client(self, reader, writer):
+        decoder = protocol.FrameDecoder()
+        try:
+            msg_type, payload = await asyncio.wait_for(protocol.read_frame(reader, decoder), AUTH_TIMEOUT)
+            if msg_type != protocol.AUTH:
+                raise protocol.ProtocolError(f"Expected AUTH, received message type {msg_type}")
+            reply = await self._answer(*protocol.decode_auth(payload))
+            writer.write(reply)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, protocol.ProtocolError):
+            pass
+        finally:
+            writer.close()
+
+
+def _request(action, username, password, host, port):
+    with socket.create_connection((host, port), timeout=AUTH_TIMEOUT) as sock:
+        protocol.send_frames(sock, protocol.encode_auth(action, username, password))
+        msg_type, payload = protocol.recv_frame(sock, protocol.FrameDecoder())
+    if msg_type == protocol.ABORT:
+        raise LoginRefused(protocol.decode_hello(payload))
+    if msg_type != protocol.TOKEN:
+        raise protocol.ProtocolError(f"Expected TOKEN, received message type {msg_type}")
+    return protocol.decode_hello(payload)
+
+
+def request_login(username, password, host=HOST, port=LOGIN_PORT):
+    """
+    Log in through the login service and return the session token. Blocks;
+    raises LoginRefused for a wrong password and OSError if the service is
+    unreachable.
+    """
+    return _request(protocol.AUTH_LOGIN, username, password, host, port)
+
+
+def request_registration(username, password, host=HOST, port=LOGIN_PORT):
+    """Create the account through the login service; raises like request_login."""
+    _request(protocol.AUTH_REGISTER, username, password, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Rock, Paper, Scissors login service.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=LOGIN_PORT)
+    parser.add_argument("--cost", choices=sorted(COST_LEVELS), default=DEFAULT_COST)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    service = LoginService(args.host, args.port, Credentials(cost=args.cost))
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
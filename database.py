@@ -0,0 +1,182 @@
+import sqlite3
+import threading
+import queue
+import logging
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Default database location and connection tuning
+DB_PATH = "users.db"
+POOL_SIZE = 4
+STATEMENT_CACHE_SIZE = 256
+
+# PRAGMAs applied to every pooled connection.
+# synchronous=NORMAL is durable across application crashes in WAL mode;
+# use FULL if the machine itself may lose power mid-commit.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # negative values are KiB, so ~16 MB per connection
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+
+class ConnectionPool:
+    """
+    A small thread-safe pool of long-lived SQLite connections.
+
+    Connections are opened lazily up to `size`, handed out one per caller and
+    returned after use. Each connection keeps sqlite3's prepared statement
+    cache alive, so repeating the same SQL text skips re-parsing it.
+    """
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, pragmas=None, cached_statements=STATEMENT_CACHE_SIZE):
+        self.path = path
+        self.size = size
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            isolation_level=None,
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        logging.debug("Opened pooled connection to %s.", self.path)
+        return conn
+
+    def acquire(self, timeout=None):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        return self._idle.get(timeout=timeout)
+
+    def release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Run a block inside a single BEGIN/COMMIT, rolling back on error."""
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(path=DB_PATH, size=POOL_SIZE, pragmas=None):
+    """Replace the shared pool, e.g. to point at another file or tune PRAGMAs."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(path, size, pragmas)
+    return _pool
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+# Convenience helpers used by the game modules. Each call is timed under the
+# `label` of the helper that made it, such as "update_score" or "inbox", so a
+# slow query shows up by name rather than as one of the five primitives.
+STATEMENT_SECONDS = metrics.histogram(
+    "rps_db_statement_seconds", "Time spent in each database helper, including waiting for a connection.",
+    labels=("helper",))
+
+
+def execute(sql, params=(), label="execute"):
+    """Run a single write statement in autocommit mode and return its rowcount."""
+    start = time.perf_counter()
+    with get_pool().connection() as conn:
+        rowcount = conn.execute(sql, params).rowcount
+    STATEMENT_SECONDS.labels(label).observe(time.perf_counter() - start)
+    return rowcount
+
+
+def executemany(sql, rows, label="executemany"):
+    start = time.perf_counter()
+    with get_pool().transaction() as conn:
+        conn.executemany(sql, rows)
+    STATEMENT_SECONDS.labels(label).observe(time.perf_counter() - start)
+
+
+def fetch_one(sql, params=(), label="fetch_one"):
+    start = time.perf_counter()
+    with get_pool().connection() as conn:
+        row = conn.execute(sql, params).fetchone()
+    STATEMENT_SECONDS.labels(label).observe(time.perf_counter() - start)
+    return row
+
+
+def fetch_all(sql, params=(), label="fetch_all"):
+    start = time.perf_counter()
+    with get_pool().connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    STATEMENT_SECONDS.labels(label).observe(time.perf_counter() - start)
+    return rows
+
+
+@contextmanager
+def transaction(label="transaction"):
+    start = time.perf_counter()
+    with get_pool().transaction() as conn:
+        yield conn
+    STATEMENT_SECONDS.labels(label).observe(time.perf_counter() - start)
@@ -0,0 +1,63 @@
+import logging
+from collections import Counter
+
+import leaderboard
+import protocol
+import replay_log
+import sessions
+import write_behind
+
+INSERT_GAME_SQL = "INSERT INTO games (player1, player2, winner, player1_move, player2_move) VALUES (?, ?, ?, ?, ?)"
+
+# One statement per player per session, however many rounds were played
+SESSION_STATS_SQL = """
+    UPDATE users SET games_played = games_played + ?, wins = wins + ?, losses = losses + ?,
+        ties = ties + ?, score = score + ? WHERE username = ?
+"""
+
+# A score change on its own, for games whose rounds are recorded elsewhere
+SCORE_SQL = "UPDATE users SET score = score + ? WHERE username = ?"
+
+INVERTED = {"win": "loss", "loss": "win", "tie": "tie"}
+
+
+def session_stats_params(username, outcomes):
+    counts = Counter(outcomes)
+    return (len(outcomes), counts["win"], counts["loss"], counts["tie"], counts["win"] - counts["loss"], username)
+
+
+def record_session(player1, player2, outcomes, both_players=True, moves=None, rule_set=None, times=None, games=True):
+    """
+    Queue the results of a whole session at once.
+
+    `outcomes` lists every round result ('win', 'loss' or 'tie') from the point
+    of view of player1, and `moves` optionally the (player1, player2) move
+    names of each round. Each round still gets its own games row, but the
+    user statistics are folded into a single UPDATE per player. With moves,
+    the session also goes to the replay log, if one is configured, stamped
+    with `times` (one time.time() per round) or the current time.
+
+    A round must have exactly one games row, since the rollup trigger counts
+    it for both players. When both sides of a peer-to-peer session record
+    their own stats, only one of them writes the rows: `games=False` skips
+    the games rows and the replay log and updates the stats alone.
+    """
+    if not outcomes:
+        return
+    logging.debug("Recording session %s vs %s: %d rounds.", player1, player2, len(outcomes))
+    if games:
+        codes = [(protocol.MOVE_CODES[a], protocol.MOVE_CODES[b]) for a, b in moves] if moves else [(None, None)] * len(outcomes)
+        for outcome, (move1, move2) in zip(outcomes, codes):
+            winner = player1 if outcome == "win" else (player2 if outcome == "loss" else None)
+            write_behind.submit(INSERT_GAME_SQL, (player1, player2, winner, move1, move2), label="record_session")
+        if moves:
+            replay_log.record_match(player1, player2, moves, rule_set, times)
+    params = session_stats_params(player1, outcomes)
+    write_behind.submit(SESSION_STATS_SQL, params, label="record_session")
+    leaderboard.record_delta(player1, params[4])
+    sessions.invalidate_profile(player1)
+    if both_players:
+        params = session_stats_params(player2, [INVERTED[o] for o in outcomes])
+        write_behind.submit(SESSION_STATS_SQL, params, label="record_session")
+        leaderboard.record_delta(player2, params[4])
+        sessions.invalidate_profile(player2)
@@ -0,0 +1,413 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+import broadcast
+import commitments
+import game_results
+import metrics
+import protocol
+import rules
+import sessions
+import write_behind
+
+HOST = "127.0.0.1"
+PORT = 5555
+
+# Seconds a player may take for the name handshake and for each choice
+HANDSHAKE_TIMEOUT = 10
+CHOICE_TIMEOUT = 60
+
+VALID_CHOICES = rules.CLASSIC.moves
+
+HANDSHAKE_SECONDS = metrics.histogram("rps_handshake_seconds", "Time from accepting a connection to its HELLO.")
+# Its _count is the number of rounds played, so no separate counter is kept
+ROUND_SECONDS = metrics.histogram("rps_round_seconds", "Time from the second choice of a round to both results sent.")
+MATCHES = metrics.counter("rps_matches_total", "Sessions that played at least one round.")
+ACTIVE_SESSIONS = metrics.gauge("rps_active_sessions", "Sessions in progress.")
+
+
+def evaluate_round(choice_a, choice_b, rule_set=rules.CLASSIC):
+    """Return 'win', 'loss' or 'tie' from the point of view of player A."""
+    return rule_set.evaluate(choice_a, choice_b)
+
+
+def identify(msg_type, payload):
+    """
+    Return (name, logged in) for a player's first frame, or None if it does
+    not name a player. LOGIN carries a session token and so a verified
+    name; HELLO carries any name the client likes.
+    """
+    if msg_type == protocol.LOGIN:
+        name = sessions.validate(protocol.decode_hello(payload))
+        return (name, True) if name else None
+    if msg_type == protocol.HELLO:
+        name = protocol.decode_hello(payload)
+        return (name, False) if name else None
+    return None
+
+
+class Player:
+    def __init__(self, name, reader, writer, decoder, logged_in=False):
+        self.name = name
+        self.logged_in = logged_in
+        self.reader = reader
+        self.writer = writer
+        # Frames the client pipelined behind its HELLO stay queued here
+        self.decoder = decoder
+
+    async def send(self, *frames):
+        self.writer.write(b"".join(frames))
+        await self.writer.drain()
+
+    async def read_frame(self, timeout):
+        return await asyncio.wait_for(protocol.read_frame(self.reader, self.decoder), timeout)
+
+    def hung_up(self):
+        """
+        True once a player nobody is reading from has gone away. The transport
+        keeps reading while they wait, so a FIN shows up as EOF on the reader
+        and a reset closes the transport; writer.is_closing() alone only
+        notices the latter.
+        """
+        return self.reader.at_eof() or self.reader.exception() is not None or self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class PlayerLeft(Exception):
+    pass
+
+
+class MatchSession:
+    """
+    A match between two connected players over one pair of connections.
+
+    Every session keeps its own choices and running score, so any number of
+    them can run side by side on the same event loop. With `best_of` set the
+    session ends once a player has won the majority of that many rounds;
+    with `best_of=None` it keeps going until a player leaves. Players move on
+    to the next round simply by sending their next CHOICE (optionally preceded
+    by a REMATCH).
+
+    Instead of a CHOICE a player may send COMMIT, then REVEAL (see
+    commitments.py). Such a player is sent the opponent's COMMIT, empty if
+    the opponent made a plain CHOICE, as soon as the opponent is locked in,
+    and reveals in reply. From the second round on it goes out as soon as
+    the opponent commits, so whoever moves second already holds it and sends
+    COMMIT and REVEAL together. Both reveals of a round are verified with one
+    commitments.verify_many() call before the round is scored. With
+    `require_commit` set a plain CHOICE ends the session, so neither player
+    can be served the other's move ahead of committing to their own.
+
+    Spectators attached with watch() get SPECTATE frames through one shared
+    Broadcast: each event is encoded once, and only while somebody watches.
+
+    Results are recorded only when both players logged in with a session
+    token, since a HELLO name is whatever the client claims.
+    """
+
+    def __init__(self, session_id, player_a, player_b, record_results=True, best_of=1, rule_set=rules.CLASSIC,
+                 require_commit=False):
+        self.session_id = session_id
+        self.rule_set = rule_set
+        self.players = (player_a, player_b)
+        self.choices = [None, None]
+        self.scores = [0, 0]
+        self.round_number = 0
+        self.outcomes = []
+        self.moves = []
+        self.times = []
+        self.record_results = record_results
+        self.best_of = best_of
+        self.require_commit = require_commit
+        self.spectators = None
+        self.ended = False
+        self.recorded = False
+        self.end_reason = ""
+        self.committing = [False, False]  # players who have used COMMIT, and so expect their opponent's
+        self._new_round()
+
+    def _new_round(self):
+        self.locked = [False, False]
+        self.commitments = [None, None]
+        self.reveals = [None, None]  # (commitment, move, nonce) of committing players
+        self.told = [False, False]   # whether the player has been sent their opponent's COMMIT
+
+    def finished(self):
+        if self.best_of is None:
+            return False
+        return max(self.scores) > self.best_of // 2
+
+    async def run(self):
+        player_a, player_b = self.players
+        logging.debug("Session %d: %s vs %s.", self.session_id, player_a.name, player_b.name)
+        try:
+            await asyncio.gather(
+                player_a.send(protocol.encode_hello(player_b.name)),
+                player_b.send(protocol.encode_hello(player_a.name)),
+            )
+            while not self.finished():
+                await self._play_round()
+        except PlayerLeft as left:
+            logging.debug("Session %d: %s", self.session_id, left)
+            self.end_reason = str(left)
+            await self._abort(str(left))
+        except (ConnectionError, asyncio.TimeoutError, protocol.ProtocolError) as error:
+            logging.info("Session %d aborted: %s", self.session_id, error)
+            self.end_reason = str(error)
+            await self._abort(str(error))
+        finally:
+            for player in self.players:
+                player.close()
+            self.ended = True
+            if self.spectators is not None:
+                if self.spectators:
+                    self.spectators.publish(protocol.encode_spectate_end(self.end_reason))
+                self.spectators.close()
+            if self.record_results and self.outcomes:
+                if player_a.logged_in and player_b.logged_in:
+                    game_results.record_session(player_a.name, player_b.name, self.outcomes, moves=self.moves,
+                                                rule_set=self.rule_set, times=self.times)
+                    self.recorded = True
+                else:
+                    logging.debug("Session %d not recorded: not both players logged in.", self.session_id)
+        return self.outcomes
+
+    async def _play_round(self):
+        player_a, player_b = self.players
+        self._new_round()
+        self.choices = await asyncio.gather(self._read_choice(player_a, 0), self._read_choice(player_b, 1))
+        if self.reveals[0] or self.reveals[1]:
+            self._verify_reveals()
+        start = time.perf_counter()
+        self.round_number += 1
+        result = evaluate_round(*self.choices, self.rule_set)
+        self.outcomes.append(result)
+        self.moves.append(tuple(self.choices))
+        self.times.append(time.time())
+        if result == "win":
+            self.scores[0] += 1
+        elif result == "loss":
+            self.scores[1] += 1
+        final = self.finished()
+        await asyncio.gather(
+            player_a.send(protocol.encode_result(
+                self.choices[1], result, self.round_number, self.scores[0], self.scores[1], final)),
+            player_b.send(protocol.encode_result(
+                self.choices[0], game_results.INVERTED[result], self.round_number, self.scores[1], self.scores[0], final)),
+        )
+        ROUND_SECONDS.observe(time.perf_counter() - start)
+        if self.spectators:
+            self.spectators.publish(protocol.encode_spectate_round(
+                self.round_number, *self.choices, result, *self.scores, final))
+
+    async def _read_choice(self, player, index):
+        while True:
+            msg_type, payload = await self._read(player)
+            if msg_type == protocol.CHOICE:
+                if self.require_commit:
+                    raise protocol.ProtocolError(f"{player.name} sent a move without committing to it")
+                choice = protocol.decode_choice(payload)
+                await self._lock_in(index, None)
+                break
+            if msg_type == protocol.COMMIT:
+                commitment = protocol.decode_commit(payload)
+                if not commitment:
+                    raise protocol.ProtocolError(f"{player.name} sent an empty commitment")
+                self.committing[index] = True
+                await self._lock_in(index, commitment)
+                msg_type, payload = await self._read(player)
+                if msg_type != protocol.REVEAL:
+                    raise protocol.ProtocolError(f"{player.name} sent message type {msg_type} instead of a reveal")
+                choice, nonce = protocol.decode_reveal(payload)
+                self.reveals[index] = (commitment, choice, nonce)
+                break
+            if msg_type == protocol.ABORT:
+                raise PlayerLeft(f"{player.name} left the session")
+            if msg_type != protocol.REMATCH:
+                raise protocol.ProtocolError(f"{player.name} sent message type {msg_type} instead of a choice")
+        if choice not in self.rule_set.codes:
+            raise protocol.ProtocolError(f"{player.name} played {choice}, not allowed by {self.rule_set.name} rules")
+        return choice
+
+    async def _read(self, player):
+        try:
+            return await player.read_frame(CHOICE_TIMEOUT)
+        except ConnectionError:
+            if self.round_number:
+                raise PlayerLeft(f"{player.name} left the session")
+            raise
+
+    async def _lock_in(self, index, commitment):
+        """Record that a player has chosen and send each committing player their opponent's COMMIT once it can."""
+        self.locked[index] = True
+        self.commitments[index] = commitment
+        if self.spectators:
+            self.spectators.publish(protocol.encode_spectate_chosen(index))
+        for to in (0, 1):
+            opponent = 1 - to
+            if self.committing[to] and self.locked[opponent] and not self.told[to]:
+                self.told[to] = True
+                await self.players[to].send(protocol.encode_commit(self.commitments[opponent] or b""))
+
+    def _verify_reveals(self):
+        indexes = [index for index in (0, 1) if self.reveals[index]]
+        failed = commitments.verify_many([self.reveals[index] for index in indexes])
+        if failed:
+            cheater = self.players[indexes[failed[0]]].name
+            raise protocol.ProtocolError(f"{cheater} revealed a move that does not match their commitment")
+
+    async def watch(self, writer):
+        """Stream this session's events to a spectator until it ends; False if they were dropped."""
+        if self.spectators is None:
+            self.spectators = broadcast.Broadcast()
+            if self.ended:
+                self.spectators.close()
+        player_a, player_b = self.players
+        return await self.spectators.serve(writer, protocol.encode_spectate_start(
+            player_a.name, player_b.name, self.round_number, *self.scores))
+
+    async def _abort(self, reason):
+        for player in self.players:
+            try:
+                await player.send(protocol.encode_abort(reason))
+            except ConnectionError:
+                pass
+
+
+class GameServer:
+    """
+    Headless game server: a single listener that pairs incoming players in
+    arrival order and runs each pair as its own MatchSession task. Every
+    connection is greeted with SERVER, so a client that could also be
+    talking to another player knows to LOGIN rather than send a HELLO. A
+    connection that opens with WATCH instead spectates the live session of
+    the named player.
+    """
+
+    def __init__(self, host=HOST, port=PORT, record_results=True, best_of=1, rule_set=rules.CLASSIC,
+                 require_commit=False):
+        self.host = host
+        self.port = port
+        self.record_results = record_results
+        self.best_of = best_of
+        self.rule_set = rule_set
+        self.require_commit = require_commit
+        self.sessions = {}
+        self.live = {}  # player name -> their running MatchSession, for spectators
+        self.matches_completed = 0
+        self.rounds_completed = 0
+        self._waiting = None
+        self._ids = itertools.count(1)
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        ACTIVE_SESSIONS.set_function(lambda: len(self.sessions))
+        logging.info("Game server listening on %s:%d.", self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in list(self.sessions.values()):
+            task.cancel()
+        await asyncio.gather(*self.sessions.values(), return_exceptions=True)
+
+    async def _handle_client(self, reader, writer):
+        start = time.perf_counter()
+        decoder = protocol.FrameDecoder()
+        writer.write(protocol.encode_server())
+        try:
+            msg_type, payload = await asyncio.wait_for(protocol.read_frame(reader, decoder), HANDSHAKE_TIMEOUT)
+            if msg_type == protocol.WATCH:
+                name, logged_in = protocol.decode_hello(payload), False
+            else:
+                name, logged_in = identify(msg_type, payload) or ("", False)
+        except (asyncio.TimeoutError, ConnectionError, protocol.ProtocolError, UnicodeDecodeError):
+            writer.close()
+            return
+        if not name:
+            writer.close()
+            return
+        HANDSHAKE_SECONDS.observe(time.perf_counter() - start)
+        if msg_type == protocol.WATCH:
+            await self._watch(name, writer)
+            return
+        player = Player(name, reader, writer, decoder, logged_in)
+
+        waiting, self._waiting = self._waiting, None
+        if waiting is not None and waiting.hung_up():
+            logging.debug("%s left before an opponent arrived.", waiting.name)
+            waiting.close()
+            waiting = None
+        if waiting is None:
+            self._waiting = player
+            return
+        session_id = next(self._ids)
+        session = MatchSession(session_id, waiting, player, self.record_results, self.best_of, self.rule_set,
+                               self.require_commit)
+        self.sessions[session_id] = asyncio.current_task()
+        names = (waiting.name, player.name)
+        for name in names:
+            self.live[name] = session
+        try:
+            outcomes = await session.run()
+            if outcomes:
+                MATCHES.inc()
+                self.matches_completed += 1
+                self.rounds_completed += len(outcomes)
+        finally:
+            del self.sessions[session_id]
+            for name in names:
+                if self.live.get(name) is session:
+                    del self.live[name]
+
+    async def _watch(self, name, writer):
+        session = self.live.get(name)
+        try:
+            if session is None:
+                writer.write(protocol.encode_abort(f"{name} is not playing"))
+                await writer.drain()
+            else:
+                await session.watch(writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a headless Rock, Paper, Scissors game server.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--best-of", type=int, default=1, help="Rounds per session, 0 for unlimited")
+    parser.add_argument("--rules", choices=sorted(rules.RULE_SETS), default=rules.CLASSIC.name)
+    parser.add_argument("--no-record", action="store_true", help="Do not write results to the database")
+    parser.add_argument("--require-commit", action="store_true", help="Reject moves sent without commit-reveal")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = GameServer(args.host, args.port, record_results=not args.no_record, best_of=args.best_of or None,
+                        rule_set=rules.RULE_SETS[args.rules], require_commit=args.require_commit)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        write_behind.shutdown()
+
+
+if __name__ == "__main__":
+    main()
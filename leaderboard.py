@@ -0,0 +1,187 @@
+import bisect
+import logging
+import threading
+
+import database
+import write_behind
+
+PAGE_SIZE = 50
+
+# Served straight from idx_users_score (see migrations.py): no table scan and no sort step
+TOP_PAGE_SQL = """
+    SELECT username, score, games_played FROM users
+    ORDER BY score DESC, username LIMIT ? OFFSET ?
+"""
+
+
+def fetch_page(page=0, page_size=PAGE_SIZE):
+    """Return one page of (username, score, games_played) rows, best first."""
+    write_behind.flush()
+    return database.fetch_all(TOP_PAGE_SQL, (page_size, page * page_size), label="fetch_page")
+
+
+class _ScoreCounts:
+    """Fenwick tree of how many players hold each score, grown on demand."""
+
+    def __init__(self, low=-64, high=64):
+        self.counts = {}
+        self.total = 0
+        self._reset(low, high)
+
+    def _reset(self, low, high):
+        self.low = low
+        self.size = high - low + 1
+        self.tree = [0] * (self.size + 1)
+        for score, count in self.counts.items():
+            self._add_to_tree(score, count)
+
+    def _add_to_tree(self, score, amount):
+        i = score - self.low + 1
+        while i <= self.size:
+            self.tree[i] += amount
+            i += i & -i
+
+    def add(self, score, amount):
+        if not self.low <= score < self.low + self.size:
+            # Double the covered range around the new score and rebuild
+            self._reset(min(self.low, score - self.size), max(self.low + self.size - 1, score + self.size))
+        self._add_to_tree(score, amount)
+        self.counts[score] = self.counts.get(score, 0) + amount
+        self.total += amount
+
+    def at_most(self, score):
+        """Number of players with a score <= `score`."""
+        if score < self.low:
+            return 0
+        i = min(score - self.low + 1, self.size)
+        count = 0
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+
+class Leaderboard:
+    """
+    In-memory ranking of every player, kept up to date as scores change.
+
+    Ranks use competition ranking (players on the same score share a rank), so
+    a rank is one plus the number of players with a strictly higher score,
+    answered from a Fenwick tree in O(log s) for s distinct score values,
+    without touching the database. Pages walk the distinct scores from the
+    top, ordering players on the same score by name.
+    """
+
+    def __init__(self, rows=()):
+        self._lock = threading.Lock()
+        self._scores = {}
+        self._groups = {}
+        self._sorted_groups = {}
+        self._distinct = []
+        self._counts = _ScoreCounts()
+        for username, score in rows:
+            self._place(username, score)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, username):
+        return username in self._scores
+
+    def _place(self, username, score):
+        group = self._groups.get(score)
+        if group is None:
+            group = self._groups[score] = set()
+            bisect.insort(self._distinct, score)
+        group.add(username)
+        self._sorted_groups.pop(score, None)
+        self._scores[username] = score
+        self._counts.add(score, 1)
+
+    def _remove(self, username, score):
+        group = self._groups[score]
+        group.discard(username)
+        self._sorted_groups.pop(score, None)
+        if not group:
+            del self._groups[score]
+            del self._distinct[bisect.bisect_left(self._distinct, score)]
+        self._counts.add(score, -1)
+
+    def set_score(self, username, score):
+        with self._lock:
+            old = self._scores.get(username)
+            if old == score:
+                return
+            if old is not None:
+                self._remove(username, old)
+            self._place(username, score)
+
+    def adjust(self, username, delta):
+        with self._lock:
+            old = self._scores.get(username)
+            # Like the UPDATE it mirrors, a change for an unknown player is a no-op
+            if old is None or delta == 0:
+                return
+            self._remove(username, old)
+            self._place(username, old + delta)
+
+    def score(self, username):
+        return self._scores.get(username)
+
+    def rank(self, username):
+        """1-based rank of `username`, or None if they are not on the board."""
+        with self._lock:
+            score = self._scores.get(username)
+            if score is None:
+                return None
+            return self._counts.total - self._counts.at_most(score) + 1
+
+    def top(self, count=PAGE_SIZE, offset=0):
+        """Return [(rank, username, score)] for `count` players starting at `offset`."""
+        with self._lock:
+            entries = []
+            position = 0
+            for score in reversed(self._distinct):
+                group = self._groups[score]
+                if position + len(group) <= offset:
+                    position += len(group)
+                    continue
+                names = self._sorted_groups.get(score)
+                if names is None:
+                    names = self._sorted_groups[score] = sorted(group)
+                rank = position + 1
+                for name in names[max(0, offset - position):]:
+                    entries.append((rank, name, score))
+                    if len(entries) == count:
+                        return entries
+                position += len(group)
+            return entries
+
+
+_board = None
+_board_lock = threading.Lock()
+
+
+def get_leaderboard():
+    """Return the shared board, loading it from the users table on first use."""
+    global _board
+    if _board is None:
+        with _board_lock:
+            if _board is None:
+                write_behind.flush()
+                rows = database.fetch_all("SELECT username, score FROM users", label="get_leaderboard")
+                _board = Leaderboard(rows)
+                logging.info("Loaded %d players into the leaderboard.", len(rows))
+    return _board
+
+
+# Hooks for the score-changing helpers. Until somebody looks at the board it
+# is not loaded, and loading it later reads the already updated table.
+def record_delta(username, delta):
+    if _board is not None:
+        _board.adjust(username, delta)
+
+
+def record_new_player(username):
+    if _board is not None:
+        _board.set_score(username, 0)
@@ -1,190 +1,136 @@
-import sqlite3
-import hashlib
-from guizero import App, Text, TextBox, PushButton, Window, ListBox
+import commitments
+import credentials
+import database
+import migrations
+import notifications
+import game_results
+import leaderboard
+import predictor
+import protocol
+import rollups
+import rules
+import sessions
 import threading
 import socket
+import time
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
 # Database setup
 def setup_database():
     logging.info("Setting up the database.")
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password TEXT NOT NULL,
-            score INTEGER DEFAULT 0,
-            games_played INTEGER DEFAULT 0,
-            wins INTEGER DEFAULT 0,
-            losses INTEGER DEFAULT 0,
-            ties INTEGER DEFAULT 0
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS games (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player1 TEXT NOT NULL,
-            player2 TEXT NOT NULL,
-            winner TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(player1) REFERENCES users(username),
-            FOREIGN KEY(player2) REFERENCES users(username)
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-def setup_invitations_table():
-    logging.info("Setting up invitations table.")
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS invitations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sender TEXT NOT NULL,
-            recipient TEXT NOT NULL,
-            status TEXT DEFAULT 'pending',
-            FOREIGN KEY(sender) REFERENCES users(username),
-            FOREIGN KEY(recipient) REFERENCES users(username)
-        )
-    """)
-    conn.commit()
-    conn.close()
-# Update user statistics after a game
-def update_user_stats(username, result):
-    logging.info(f"Updating stats for user {username} with result: {result}.")
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    stats_update = {
-        'win': "wins = wins + 1, score = score + 1",
-        'loss': "losses = losses + 1, score = score - 1",
-        'tie': "ties = ties + 1"
-    }
-    query = f"""
-        UPDATE users SET games_played = games_played + 1, {stats_update[result]} WHERE username = ?
-    """
-    cursor.execute(query, (username,))
-    conn.commit()
-    conn.close()
-
-# Record a game in the database
-def record_game(player1, player2, winner):
-    logging.info(f"Recording game: {player1} vs {player2}, winner: {winner}.")
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO games (player1, player2, winner) VALUES (?, ?, ?)", (player1, player2, winner))
-    conn.commit()
-    conn.close()
+    migrations.migrate()
 
 # Display leaderboard
-def show_leaderboard():
-    logging.info("Displaying leaderboard.")
+def show_leaderboard(page=0):
+    logging.info("Displaying leaderboard page %s.", page)
+    leaderboard_state["page"] = page
     leaderboard_list.clear()
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, score, games_played FROM users ORDER BY score DESC")
-    for row in cursor.fetchall():
-        leaderboard_list.append(f"{row[0]}: {row[1]} points, {row[2]} games played")
-    conn.close()
+    rank = leaderboard.get_leaderboard().rank(current_user)
+    leaderboard_rank_text.value = f"Your rank: {rank}" if rank else ""
+    for position, row in enumerate(leaderboard.fetch_page(page), start=page * leaderboard.PAGE_SIZE + 1):
+        leaderboard_list.append(f"{position}. {row[0]}: {row[1]} points, {row[2]} games played")
 
-# Evaluate game result
-def evaluate_winner():
-    user = game_choices["user_choice"]
-    opponent = game_choices["opponent_choice"]
-
-    if user == opponent:
-        logging.info("Game was a tie.")
-        return "The game was a tie!", "tie"
-    elif [user, opponent] in WINNING_CASES:
-        logging.info("User won the game.")
-        return "You won the game!", "win"
-    else:
-        logging.info("User lost the game.")
-        return "You lost the game!", "loss"
+def change_leaderboard_page(step):
+    show_leaderboard(max(0, leaderboard_state["page"] + step))
 
-# Display game results
-def display_results():
-    result_message, result = evaluate_winner()
-    connection_status_text.value = result_message
-    choice_text.value = f"You chose {game_choices['user_choice']}, opponent chose {game_choices['opponent_choice']}"
-    update_user_stats(current_user, result)
-    record_game(current_user, "Opponent", current_user if result == "win" else ("Opponent" if result == "loss" else None))
-    exit_button.show()
+# Evaluate game result
+RESULT_MESSAGES = {
+    "win": "You won the game!",
+    "loss": "You lost the game!",
+    "tie": "The game was a tie!"
+}
 
-# Utility function for hashing passwords
-def hash_password(password):
-    logging.debug("Hashing password.")
-    return hashlib.sha256(password.encode()).hexdigest()
+def evaluate_winner():
+    result = rules.CLASSIC.evaluate(game_choices["user_choice"], game_choices["opponent_choice"])
+    logging.debug("Round result: %s.", result)
+    return RESULT_MESSAGES[result], result
 
-# Authentication functions
+# Authentication functions. The login service checks the password and signs
+# the session token; these send the request off the GUI thread.
 def register_user():
     username = username_input.value
     password = password_input.value
 
-    logging.info(f"Attempting to register user: {username}")
+    logging.info("Attempting to register user: %s", username)
 
     if username and password:
-        hashed_password = hash_password(password)
-        conn = sqlite3.connect("users.db")
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
-            conn.commit()
-            auth_status.value = "Registration successful!"
-            logging.info(f"User {username} registered successfully.")
-        except sqlite3.IntegrityError:
-            auth_status.value = "Username already exists."
-            logging.warning(f"Registration failed. Username {username} already exists.")
-        conn.close()
+        auth_status.value = "Registering..."
+        threading.Thread(target=registration_thread, args=(username, password), daemon=True).start()
     else:
         auth_status.value = "Please fill in both fields."
         logging.warning("Registration failed. Missing username or password.")
 
+def registration_thread(username, password):
+    try:
+        credentials.request_registration(username, password)
+    except credentials.LoginRefused as refused:
+        auth_status.value = str(refused)
+        logging.warning("Registration of %s refused: %s", username, refused)
+        return
+    except (OSError, protocol.ProtocolError):
+        auth_status.value = "The login service is unavailable."
+        logging.error("Could not reach the login service.")
+        return
+    auth_status.value = "Registration successful!"
+    logging.info("User %s registered successfully.", username)
+
 def login_user():
     username = username_input.value
     password = password_input.value
 
-    logging.info(f"Attempting to log in user: {username}")
-
-    hashed_password = hash_password(password)
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-    user = cursor.fetchone()
-    conn.close()
-
-    if user:
-        global current_user
-        current_user = username
-        auth_window.hide()
-        main_window.show()
-        logging.info(f"User {username} logged in successfully.")
-    else:
-        auth_status.value = "Invalid username or password."
-        logging.warning(f"Login failed for user {username}.")
-
-# Update score after the game
-def update_score(username, delta):
-    logging.info(f"Updating score for user {username} by {delta}.")
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET score = score + ? WHERE username = ?", (delta, username))
-    conn.commit()
-    conn.close()
+    logging.info("Attempting to log in user: %s", username)
+
+    auth_status.value = "Logging in..."
+    threading.Thread(target=login_thread, args=(username, password), daemon=True).start()
+
+def login_thread(username, password):
+    try:
+        # Services that need to know who we are check this token, not the password
+        token = credentials.request_login(username, password)
+    except credentials.LoginRefused as refused:
+        auth_status.value = str(refused)
+        logging.warning("Login failed for user %s: %s", username, refused)
+        return
+    except (OSError, protocol.ProtocolError):
+        auth_status.value = "The login service is unavailable."
+        logging.error("Could not reach the login service.")
+        return
+    finish_login(username, token)
+
+def finish_login(username, token):
+    global current_user
+    current_user = username
+    session_state["token"] = token
+    auth_status.value = ""
+    auth_window.hide()
+    main_window.show()
+    start_invitation_listener()
+    logging.info("User %s logged in successfully.", username)
+
+# Leaderboard paging
+leaderboard_state = {"page": 0}
+
+# Invite window search: the username prefix and the last name shown, if more follow
+invite_state = {"prefix": "", "last": None}
+
+# Signed session token of the logged-in user, see sessions.py
+session_state = {"token": None}
 
 # Host IP address and port
 HOST = "127.0.0.1"
 PORT = 5555
 
+# How long an invitee keeps trying to reach the inviter, who only starts
+# listening once the acceptance has been pushed to them
+INVITE_CONNECT_SECONDS = 5
+AI_NAME = "Computer"
+
 # State management flags
 game_state = {
     "server_running": False,
     "client_running": False,
     "round_exit": threading.Event(),
+    "play_again": False,
     "choice_set": threading.Event()
 }
 
@@ -194,22 +140,20 @@ game_choices = {
     "opponent_choice": None
 }
 
-# Winning scenarios
-WINNING_CASES = [
-    ["scissors", "paper"],
-    ["rock", "scissors"],
-    ["paper", "rock"]
-]
-
 def start_server():
     if not game_state["server_running"]:
         logging.info("Starting server thread.")
         threading.Thread(target=server_thread, daemon=True).start()
 
-def start_client():
+def start_client(retry_for=0):
     if not game_state["client_running"]:
         logging.info("Starting client thread.")
-        threading.Thread(target=client_thread, daemon=True).start()
+        threading.Thread(target=client_thread, args=(retry_for,), daemon=True).start()
+
+def start_ai_game():
+    if not game_state["server_running"] and not game_state["client_running"]:
+        logging.info("Starting a game against the computer.")
+        threading.Thread(target=ai_game_thread, daemon=True).start()
 
 def server_thread():
     logging.info("Server thread started.")
@@ -231,20 +175,32 @@ def server_thread():
     game_state["server_running"] = False
     logging.info("Server thread stopped.")
 
-def client_thread():
+def connect(address, retry_for=0):
+    """Connect to `address`, retrying refused connections with backoff for up to `retry_for` seconds."""
+    deadline = time.monotonic() + retry_for
+    delay = 0.05
+    while True:
+        try:
+            return socket.create_connection(address)
+        except ConnectionRefusedError:
+            if time.monotonic() + delay > deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+def client_thread(retry_for=0):
     logging.info("Client thread started.")
     setup_game_ui("client")
     game_state["client_running"] = True
     connection_status_text.value = "Connecting..."
 
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-            client_socket.connect((host_input.value, PORT))
+        with connect((host_input.value, PORT), retry_for) as client_socket:
             logging.info("Client connected to the server.")
             handle_connection(client_socket, role="client")
     except ConnectionRefusedError:
         connection_status_text.value = f"Couldn't connect to {host_input.value}"
-        logging.error(f"Connection refused to {host_input.value}.")
+        logging.error("Connection refused to %s.", host_input.value)
     except OSError:
         connection_status_text.value = "Invalid address entered"
         logging.error("Invalid address entered.")
@@ -253,65 +209,161 @@ def client_thread():
     game_state["client_running"] = False
     logging.info("Client thread stopped.")
 
-def handle_connection(conn, role):
-    local_name = name_input.value or "Default"
+def ai_game_thread():
+    logging.info("AI game thread started.")
+    setup_game_ui("server")
+    game_state["client_running"] = True
+    connection_status_text.value = "Starting a game against the computer..."
 
-    logging.info(f"Handling connection as {role}.")
+    # The computer plays the other end of a local socket pair, so the session
+    # runs through exactly the same handle_connection as a networked one
+    player_end, ai_end = socket.socketpair()
+    threading.Thread(target=ai_opponent, args=(ai_end, current_user), daemon=True).start()
+    with player_end:
+        handle_connection(player_end, role="ai")
 
-    if role == "server":
-        conn.sendall(local_name.encode())
-        opponent_name = conn.recv(1024).decode()
-    else:
-        conn.sendall(local_name.encode())
-        opponent_name = conn.recv(1024).decode()
+    reset_game_ui()
+    game_state["client_running"] = False
+    logging.info("AI game thread stopped.")
+
+def ai_opponent(conn, username):
+    # The player's history is loaded here, before the first round, so every
+    # prediction afterwards is an in-memory lookup
+    model = predictor.get_predictor()
+    model.warm(username)
+    decoder = protocol.FrameDecoder()
+    with conn:
+        try:
+            protocol.send_frames(conn, protocol.encode_hello(AI_NAME))
+            protocol.recv_frame(conn, decoder)
+            while True:
+                # Decided, and committed to, before the player's commitment is read
+                move = model.choose(username)
+                commitment, nonce = commitments.commit(move)
+                msg_type, payload = protocol.recv_frame(conn, decoder)
+                while msg_type == protocol.REMATCH:
+                    msg_type, payload = protocol.recv_frame(conn, decoder)
+                if msg_type != protocol.COMMIT:
+                    break
+                player_commitment = protocol.decode_commit(payload)
+                protocol.send_frames(conn, protocol.encode_commit(commitment), protocol.encode_reveal(move, nonce))
+                msg_type, payload = protocol.recv_frame(conn, decoder)
+                if msg_type != protocol.REVEAL:
+                    break
+                player_move, player_nonce = protocol.decode_reveal(payload)
+                if not commitments.verify(player_commitment, player_move, player_nonce):
+                    break
+                model.record(username, player_move)
+        except (ConnectionError, protocol.ProtocolError):
+            pass
+    logging.info("AI opponent finished.")
 
-    logging.info(f"Connected to opponent: {opponent_name}")
+def handle_connection(conn, role):
+    # Peers are recorded under the name they say hello with, so it is the
+    # logged-in username rather than anything typed into the window
+    local_name = current_user
+    decoder = protocol.FrameDecoder()
+    if conn.family in (socket.AF_INET, socket.AF_INET6):
+        # A REVEAL written right behind its COMMIT must not wait for the COMMIT's ACK
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    logging.info("Handling connection as %s.", role)
+
+    # Both roles exchange the same framed messages, so the client side can also
+    # play through the dedicated game_server.py, which then records the session
+    try:
+        if role == "client":
+            opponent_name, via_server = protocol.connect_handshake(conn, decoder, local_name, session_state["token"])
+        else:
+            protocol.send_frames(conn, protocol.encode_hello(local_name))
+            msg_type, payload = protocol.recv_frame(conn, decoder)
+            if msg_type != protocol.HELLO:
+                raise protocol.ProtocolError(f"Expected HELLO, received message type {msg_type}")
+            opponent_name, via_server = protocol.decode_hello(payload), False
+    except protocol.ProtocolError as error:
+        connection_status_text.value = "Opponent sent an invalid handshake"
+        logging.error("Handshake failed: %s", error)
+        return
+
+    logging.info("Connected to opponent: %s", opponent_name)
 
     connection_status_text.value = f"Connected to {opponent_name}"
 
-    game_state["choice_set"].wait()
-    game_state["choice_set"].clear()
-
-    conn.sendall(game_choices["user_choice"].encode())
-    game_choices["opponent_choice"] = conn.recv(1024).decode()
-
-    logging.info(f"User choice: {game_choices['user_choice']}, Opponent choice: {game_choices['opponent_choice']}.")
-
-    display_results()
-
-    game_state["round_exit"].wait()
-    game_state["round_exit"].clear()
+    # Rounds repeat over the same connection until a player leaves; the
+    # results are written once, when the session is over.
+    outcomes = []
+    moves = []
+    scores = [0, 0]
+    try:
+        while True:
+            game_state["choice_set"].wait()
+            game_state["choice_set"].clear()
+
+            exchanged = commitments.exchange_moves(conn, decoder, game_choices["user_choice"])
+            if exchanged is None:
+                connection_status_text.value = f"{opponent_name} left the session"
+                logging.info("Session ended by %s.", opponent_name)
+                break
+            game_choices["opponent_choice"], final = exchanged
+
+            logging.debug("User choice: %s, Opponent choice: %s.", game_choices['user_choice'], game_choices['opponent_choice'])
+
+            result = display_results()
+            outcomes.append(result)
+            moves.append((game_choices["user_choice"], game_choices["opponent_choice"]))
+            if role != "ai":
+                # Against the computer its own thread keeps the model current
+                predictor.record_move(current_user, game_choices["user_choice"])
+            if result == "win":
+                scores[0] += 1
+            elif result == "loss":
+                scores[1] += 1
+            choice_text.value += f" (round {len(outcomes)}, score {scores[0]}-{scores[1]})"
+            if not final:
+                play_again_button.show()
+
+            game_state["round_exit"].wait()
+            game_state["round_exit"].clear()
+            if final or not game_state["play_again"]:
+                break
+
+            protocol.send_frames(conn, protocol.encode_rematch())
+            toggle_choice_buttons(True)
+            choice_text.value = ""
+            connection_status_text.value = f"Connected to {opponent_name}"
+    except ConnectionError:
+        connection_status_text.value = f"{opponent_name} left the session"
+        logging.info("Connection to %s closed.", opponent_name)
+    except protocol.ProtocolError as error:
+        connection_status_text.value = f"Session with {opponent_name} ended: {error}"
+        logging.warning("Session with %s ended: %s", opponent_name, error)
+
+    if not via_server:
+        # Each peer updates its own stats, but only the host writes the games rows
+        game_results.record_session(current_user, opponent_name, outcomes, both_players=False, moves=moves,
+                                    games=role != "client")
+    elif outcomes:
+        # The game server wrote the results; these are the in-process hooks for this side
+        leaderboard.record_delta(current_user, scores[0] - scores[1])
+        sessions.invalidate_profile(current_user)
 
 def set_choice(choice):
-    logging.info(f"User selected choice: {choice}")
+    logging.debug("User selected choice: %s", choice)
     game_choices["user_choice"] = choice
     game_state["choice_set"].set()
     toggle_choice_buttons(False)
     choice_text.value = "Waiting for opponent to make their choice..."
 
-def evaluate_winner():
-    user = game_choices["user_choice"]
-    opponent = game_choices["opponent_choice"]
-
-    if user == opponent:
-        logging.info("Game was a tie.")
-        return "The game was a tie!", 0
-    elif [user, opponent] in WINNING_CASES:
-        logging.info("User won the game.")
-        return "You won the game!", 1
-    else:
-        logging.info("User lost the game.")
-        return "You lost the game!", -1
-
+# Display game results
 def display_results():
-    result_message, score_delta = evaluate_winner()
+    result_message, result = evaluate_winner()
     connection_status_text.value = result_message
     choice_text.value = f"You chose {game_choices['user_choice']}, opponent chose {game_choices['opponent_choice']}"
-    update_score(current_user, score_delta)
     exit_button.show()
+    return result
 
 def setup_game_ui(role):
-    logging.info(f"Setting up game UI for {role}.")
+    logging.info("Setting up game UI for %s.", role)
     toggle_ui_elements(False)
     toggle_choice_buttons(True)
     if role == "server":
@@ -326,7 +378,7 @@ def reset_game_ui():
     choice_text.value = ""
 
 def toggle_ui_elements(visible):
-    elements = [host_label, host_input, name_label, name_input, connect_button, wait_for_connection_button]
+    elements = [host_label, host_input, connect_button, wait_for_connection_button, play_computer_button]
     for element in elements:
         if visible:
             element.show()
@@ -343,51 +395,68 @@ def toggle_choice_buttons(visible):
 
 def exit_round():
     logging.info("Exiting round.")
+    game_state["play_again"] = False
     game_state["round_exit"].set()
     exit_button.hide()
+    play_again_button.hide()
+
+def play_again():
+    logging.info("Starting another round.")
+    game_state["play_again"] = True
+    game_state["round_exit"].set()
+    exit_button.hide()
+    play_again_button.hide()
 
 # Invitation system
 def invite_player():
     logging.info("Opening invite player window.")
-    invite_list.clear()
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT username FROM users WHERE username != ?", (current_user,))
-    users = cursor.fetchall()
-    conn.close()
+    invite_search_input.value = ""
+    search_invite_players()
+    invite_window.show()
+
+def search_invite_players():
+    invite_state["prefix"] = invite_search_input.value.strip()
+    show_invite_page(after=None)
 
+def show_invite_page(after):
+    """Fill the invite list with the next page of matching players after `after`."""
+    low, high = notifications.search_range(invite_state["prefix"], after)
+    users = database.fetch_all(notifications.INVITE_SEARCH_SQL,
+                               (low, high, current_user, notifications.INVITE_PAGE_SIZE), label="invite_player")
+    invite_list.clear()
     for user in users:
         invite_list.append(user[0])
-
-    invite_window.show()
+    # A short page is the last one; "More" starts over from the first
+    invite_state["last"] = users[-1][0] if len(users) == notifications.INVITE_PAGE_SIZE else None
 
 def send_invite():
     selected_user = invite_list.value
     if selected_user:
-        conn = sqlite3.connect("users.db")
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO invitations (sender, recipient) VALUES (?, ?)", (current_user, selected_user))
-        conn.commit()
-        conn.close()
-        logging.info(f"Invitation sent from {current_user} to {selected_user}.")
+        conn = invitation_state["connection"]
+        if conn:
+            # The notification service records it and pushes it to the recipient
+            protocol.send_frames(conn, protocol.encode_invite("pending", selected_user))
+        else:
+            database.execute(notifications.INSERT_INVITE_SQL, (current_user, selected_user), label="send_invite")
+        logging.info("Invitation sent from %s to %s.", current_user, selected_user)
         invitation_status.value = f"Invitation sent to {selected_user}!"
     else:
         invitation_status.value = "Please select a user to invite."
 
 def show_received_invitations():
-    logging.info("Fetching received invitations.")
+    refresh_received_invitations()
+    received_invitations_window.show()
+
+def refresh_received_invitations():
     received_invitations_list.clear()
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT sender, status 
-        FROM invitations 
-        WHERE recipient = ? AND status IN ('pending', 'accepted')
-    """, (current_user,))
-    for row in cursor.fetchall():
+    if invitation_state["connection"]:
+        # Kept up to date by pushes from the notification service
+        rows = list(invitation_state["inbox"].items())
+    else:
+        logging.info("Fetching received invitations.")
+        rows = database.fetch_all(notifications.INBOX_SQL, (current_user,), label="refresh_received_invitations")
+    for row in rows:
         received_invitations_list.append(f"Invite from {row[0]} ({row[1]})")
-    conn.close()
-    received_invitations_window.show()
 
 def accept_invite():
     """
@@ -397,17 +466,14 @@ def accept_invite():
     selected_invitation = received_invitations_list.value
     if selected_invitation:
         sender = selected_invitation.split("(")[0].strip().replace("Invite from ", "")
-        conn = sqlite3.connect("users.db")
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE invitations 
-            SET status = 'accepted' 
-            WHERE sender = ? AND recipient = ? AND status = 'pending'
-        """, (sender, current_user))
-        conn.commit()
-        conn.close()
+        conn = invitation_state["connection"]
+        if conn:
+            invitation_state["inbox"][sender] = "accepted"
+            protocol.send_frames(conn, protocol.encode_invite("accepted", sender))
+        else:
+            database.execute(notifications.ACCEPT_INVITE_SQL, (sender, current_user), label="accept_invite")
         
-        logging.info(f"Invitation from {sender} accepted by {current_user}.")
+        logging.info("Invitation from %s accepted by %s.", sender, current_user)
         received_invitations_window.hide()
         
         # Start the match - invitee connects to inviter
@@ -415,115 +481,161 @@ def accept_invite():
     else:
         logging.warning("No invitation selected to accept.")
 
+# Invitation push channel
+invitation_state = {
+    "connection": None,
+    "inbox": {}
+}
+
+def start_invitation_listener():
+    threading.Thread(target=invitation_listener_thread, daemon=True).start()
+
+def invitation_listener_thread():
+    try:
+        conn = socket.create_connection((HOST, notifications.NOTIFY_PORT))
+    except OSError:
+        logging.warning("Notification service unavailable, invitations will be read from the database.")
+        return
+
+    decoder = protocol.FrameDecoder()
+    with conn:
+        protocol.send_frames(conn, protocol.encode_subscribe(session_state["token"]))
+        invitation_state["connection"] = conn
+        logging.info("Subscribed to invitation notifications.")
+        try:
+            while True:
+                msg_type, payload = protocol.recv_frame(conn, decoder)
+                if msg_type == protocol.INVITE:
+                    status, sender = protocol.decode_invite(payload)
+                    invitation_state["inbox"][sender] = status
+                    if received_invitations_window.visible:
+                        refresh_received_invitations()
+                elif msg_type == protocol.INVITE_ACCEPTED:
+                    opponent = protocol.decode_hello(payload)
+                    logging.info("%s accepted the invitation from %s.", opponent, current_user)
+                    start_match(opponent=opponent, is_inviter=True)
+        except (ConnectionError, protocol.ProtocolError):
+            logging.warning("Lost connection to the notification service.")
+        finally:
+            invitation_state["connection"] = None
+
 def start_match(opponent, is_inviter):
     """
     Initiate the match between two players.
     The inviter starts the server, and the invitee starts the client.
     """
-    logging.info(f"Starting match between {current_user} and {opponent}.")
+    logging.info("Starting match between %s and %s.", current_user, opponent)
     
     if is_inviter:
         # Current user is the inviter, start as server
-        logging.info(f"{current_user} is the inviter, starting as server.")
+        logging.info("%s is the inviter, starting as server.", current_user)
         start_server()
     else:
         # Current user is the invitee, start as client
-        logging.info(f"{current_user} is the invitee, starting as client.")
+        logging.info("%s is the invitee, starting as client.", current_user)
         
         # Use a predefined host address for the inviter (could be dynamic in a real app)
         host_input.value = HOST  # Replace HOST with inviter's IP if dynamic IPs are used
-        start_client()
-
-# GUI Setup
-app = App(title="Rock, Paper, Scissors", width=700, height=400, visible=False)
-
-# Authentication window
-auth_window = Window(app, title="Login", width=400, height=300)
-auth_window.when_closed = app.destroy
-
-Text(auth_window, text="Username:")
-username_input = TextBox(auth_window, width="fill")
-Text(auth_window, text="Password:")
-password_input = TextBox(auth_window, width="fill", hide_text=True)
-
-auth_status = Text(auth_window, text="")
-PushButton(auth_window, text="Login", command=login_user)
-PushButton(auth_window, text="Register", command=register_user)
-
-# Main game window (hidden until login)
-main_window = Window(app, title="Rock, Paper, Scissors", width=700, height=400, visible=False)
-
-ip_text = Text(main_window, text=f"Your IP: {HOST}", grid=[0, 0])
-connection_status_text = Text(main_window, text="Not connected right now", grid=[0, 1])
-choice_text = Text(main_window, text="", grid=[0, 2])
-
-host_label = Text(main_window, text="Host:", grid=[0, 3])
-host_input = TextBox(main_window, width="fill", grid=[1, 3])
-connect_button = PushButton(main_window, text="Connect", grid=[2, 3], command=start_client)
-wait_for_connection_button = PushButton(main_window, text="Wait for Connection", grid=[3, 3], command=start_server)
-
-rock_button = PushButton(main_window, text="Rock", grid=[0, 5], command=lambda: set_choice("rock"), visible=False)
-paper_button = PushButton(main_window, text="Paper", grid=[1, 5], command=lambda: set_choice("paper"), visible=False)
-scissors_button = PushButton(main_window, text="Scissors", grid=[2, 5], command=lambda: set_choice("scissors"), visible=False)
-
-name_label = Text(main_window, text="Name:", grid=[0, 4])
-name_input = TextBox(main_window, width="fill", text="Default")
-
-exit_button = PushButton(main_window, text="Exit", grid=[0, 6], command=exit_round, visible=False)
-PushButton(main_window, text="Invite Player", grid=[0, 8], command=invite_player)
-
-# Leaderboard window
-leaderboard_window = Window(app, title="Leaderboard", width=400, height=300, visible=False)
-leaderboard_list = ListBox(leaderboard_window, items=[], width="fill", height="fill")
-PushButton(leaderboard_window, text="Close", command=leaderboard_window.hide)
-PushButton(main_window, text="Leaderboard", grid=[0, 7], command=lambda: [leaderboard_window.show(), show_leaderboard()])
-
-# Game Stats window
-stats_window = Window(app, title="Game Stats", width=400, height=300, visible=False)
-stats_list = ListBox(stats_window, items=[], width="fill", height="fill")
-PushButton(stats_window, text="Close", command=stats_window.hide)
+        # The inviter starts listening only when our acceptance reaches them
+        start_client(retry_for=INVITE_CONNECT_SECONDS)
 
 # Function to display game stats
 def show_game_stats():
     logging.info("Displaying game stats for the user.")
     stats_list.clear()
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT games_played, wins, losses, ties, score 
-        FROM users 
-        WHERE username = ?
-    """, (current_user,))
-    stats = cursor.fetchone()
-    conn.close()
-    
+    stats = sessions.profile(current_user)
+
     if stats:
-        stats_list.append(f"Games Played: {stats[0]}")
-        stats_list.append(f"Wins: {stats[1]}")
-        stats_list.append(f"Losses: {stats[2]}")
-        stats_list.append(f"Ties: {stats[3]}")
-        stats_list.append(f"Score: {stats[4]}")
+        stats_list.append(f"Games Played: {stats.games_played}")
+        stats_list.append(f"Wins: {stats.wins}")
+        stats_list.append(f"Losses: {stats.losses}")
+        stats_list.append(f"Ties: {stats.ties}")
+        stats_list.append(f"Score: {stats.score}")
+        recent = rollups.last_days(current_user, 7)
+        stats_list.append(f"Last 7 days: {recent.games} games, {recent.wins} wins, {recent.losses} losses, {recent.ties} ties")
     else:
         stats_list.append("No stats available for the user.")
 
-# Add "Game Stats" button to main window
-PushButton(main_window, text="Game Stats", grid=[2, 7], command=lambda: [stats_window.show(), show_game_stats()])
-
-# Invite player window
-invite_window = Window(app, title="Invite Player", width=400, height=300, visible=False)
-invite_list = ListBox(invite_window, items=[], width="fill", height="fill")
-invitation_status = Text(invite_window, text="")
-PushButton(invite_window, text="Send Invite", command=send_invite)
-PushButton(invite_window, text="Close", command=invite_window.hide)
-
-# Received invitations window
-received_invitations_window = Window(app, title="Received Invitations", width=400, height=300, visible=False)
-received_invitations_list = ListBox(received_invitations_window, items=[], width="fill", height="fill")
-PushButton(received_invitations_window, text="Close", command=received_invitations_window.hide)
-PushButton(received_invitations_window, text="Accept Invite", command=accept_invite)
-PushButton(main_window, text="View Invitations", grid=[1, 8], command=show_received_invitations)
-
-auth_window.show()
-setup_database()
-setup_invitations_table()
-app.display()
+if __name__ == "__main__":
+    # The GUI is only built when run as a script, so the helpers above can be
+    # imported by headless code without a display or guizero installed.
+    from guizero import App, Text, TextBox, PushButton, Window, ListBox
+
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # GUI Setup
+    app = App(title="Rock, Paper, Scissors", width=700, height=400, visible=False)
+
+    # Authentication window
+    auth_window = Window(app, title="Login", width=400, height=300)
+    auth_window.when_closed = app.destroy
+
+    Text(auth_window, text="Username:")
+    username_input = TextBox(auth_window, width="fill")
+    Text(auth_window, text="Password:")
+    password_input = TextBox(auth_window, width="fill", hide_text=True)
+
+    auth_status = Text(auth_window, text="")
+    PushButton(auth_window, text="Login", command=login_user)
+    PushButton(auth_window, text="Register", command=register_user)
+
+    # Main game window (hidden until login)
+    main_window = Window(app, title="Rock, Paper, Scissors", width=700, height=400, visible=False)
+
+    ip_text = Text(main_window, text=f"Your IP: {HOST}", grid=[0, 0])
+    connection_status_text = Text(main_window, text="Not connected right now", grid=[0, 1])
+    choice_text = Text(main_window, text="", grid=[0, 2])
+
+    host_label = Text(main_window, text="Host:", grid=[0, 3])
+    host_input = TextBox(main_window, width="fill", grid=[1, 3])
+    connect_button = PushButton(main_window, text="Connect", grid=[2, 3], command=start_client)
+    wait_for_connection_button = PushButton(main_window, text="Wait for Connection", grid=[3, 3], command=start_server)
+    play_computer_button = PushButton(main_window, text="Play vs Computer", grid=[4, 3], command=start_ai_game)
+
+    rock_button = PushButton(main_window, text="Rock", grid=[0, 5], command=lambda: set_choice("rock"), visible=False)
+    paper_button = PushButton(main_window, text="Paper", grid=[1, 5], command=lambda: set_choice("paper"), visible=False)
+    scissors_button = PushButton(main_window, text="Scissors", grid=[2, 5], command=lambda: set_choice("scissors"), visible=False)
+
+
+    exit_button = PushButton(main_window, text="Exit", grid=[0, 6], command=exit_round, visible=False)
+    play_again_button = PushButton(main_window, text="Play Again", grid=[1, 6], command=play_again, visible=False)
+    PushButton(main_window, text="Invite Player", grid=[0, 8], command=invite_player)
+
+    # Leaderboard window
+    leaderboard_window = Window(app, title="Leaderboard", width=400, height=300, visible=False)
+    leaderboard_rank_text = Text(leaderboard_window, text="")
+    leaderboard_list = ListBox(leaderboard_window, items=[], width="fill", height="fill")
+    PushButton(leaderboard_window, text="Previous Page", command=lambda: change_leaderboard_page(-1))
+    PushButton(leaderboard_window, text="Next Page", command=lambda: change_leaderboard_page(1))
+    PushButton(leaderboard_window, text="Close", command=leaderboard_window.hide)
+    PushButton(main_window, text="Leaderboard", grid=[0, 7], command=lambda: [leaderboard_window.show(), show_leaderboard()])
+
+    # Game Stats window
+    stats_window = Window(app, title="Game Stats", width=400, height=300, visible=False)
+    stats_list = ListBox(stats_window, items=[], width="fill", height="fill")
+    PushButton(stats_window, text="Close", command=stats_window.hide)
+
+    # Add "Game Stats" button to main window
+    PushButton(main_window, text="Game Stats", grid=[2, 7], command=lambda: [stats_window.show(), show_game_stats()])
+
+    # Invite player window
+    invite_window = Window(app, title="Invite Player", width=400, height=300, visible=False)
+    invite_search_input = TextBox(invite_window, width="fill")
+    PushButton(invite_window, text="Search", command=search_invite_players)
+    invite_list = ListBox(invite_window, items=[], width="fill", height="fill")
+    PushButton(invite_window, text="More", command=lambda: show_invite_page(invite_state["last"]))
+    invitation_status = Text(invite_window, text="")
+    PushButton(invite_window, text="Send Invite", command=send_invite)
+    PushButton(invite_window, text="Close", command=invite_window.hide)
+
+    # Received invitations window
+    received_invitations_window = Window(app, title="Received Invitations", width=400, height=300, visible=False)
+    received_invitations_list = ListBox(received_invitations_window, items=[], width="fill", height="fill")
+    PushButton(received_invitations_window, text="Close", command=received_invitations_window.hide)
+    PushButton(received_invitations_window, text="Accept Invite", command=accept_invite)
+    PushButton(main_window, text="View Invitations", grid=[1, 8], command=show_received_invitations)
+
+    auth_window.show()
+    setup_database()
+    app.display()
@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+import database
+import metrics
+import protocol
+import sessions
+
+HOST = "127.0.0.1"
+MM_PORT = 5556
+
+# Seconds a client may take to send JOIN, and may wait for an opponent
+JOIN_TIMEOUT = 10
+MATCH_TIMEOUT = 300
+
+# Skill-based matching: players start out only accepting opponents within
+# BASE_WINDOW points of their score, widening by WIDEN_PER_SECOND while they
+# wait, up to MAX_WINDOW. Scores are grouped into buckets of BUCKET_WIDTH.
+DEFAULT_RATING = 0
+BUCKET_WIDTH = 10
+BASE_WINDOW = 20
+WIDEN_PER_SECOND = 10
+MAX_WINDOW = 500
+# How often waiting players are re-checked as their windows widen
+REMATCH_INTERVAL = 1.0
+
+QUEUE_DEPTH = metrics.gauge("rps_matchmaking_queue_depth", "Players waiting for an opponent.")
+WAIT_SECONDS = metrics.histogram("rps_matchmaking_wait_seconds", "Time from JOIN to being paired.")
+PAIRINGS = metrics.counter("rps_matchmaking_pairings_total", "Pairs of players matched.")
+TIMEOUTS = metrics.counter("rps_matchmaking_timeouts_total", "Players who waited MATCH_TIMEOUT without a match.")
+
+
+class WaitingPlayer:
+    def __init__(self, name, address, seq, rating=DEFAULT_RATING):
+        self.name = name
+        self.address = address
+        self.seq = seq
+        self.rating = rating
+        self.joined_at = time.monotonic()
+        self.active = True
+        # Resolved with (role, opponent address, opponent name) once paired
+        self.matched = asyncio.get_running_loop().create_future()
+
+    def __lt__(self, other):
+        return self.seq < other.seq
+
+
+class FifoQueue:
+    """
+    Waiting players ordered by arrival in a binary heap.
+
+    Pairing pops the oldest live player in O(log n). Players who leave are only
+    flagged inactive and skipped when they reach the top; the heap is rebuilt
+    once dead entries outnumber live ones so memory stays proportional to the
+    number of players actually waiting.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def add(self, player):
+        heapq.heappush(self._heap, player)
+        self._live += 1
+
+    def discard(self, player):
+        if player.active:
+            player.active = False
+            self._live -= 1
+            if len(self._heap) > 2 * self._live + 64:
+                self._heap = [p for p in self._heap if p.active]
+                heapq.heapify(self._heap)
+
+    def find_partner(self, player):
+        while self._heap:
+            candidate = heapq.heappop(self._heap)
+            if candidate.active:
+                candidate.active = False
+                self._live -= 1
+                return candidate
+        return None
+
+    def pop_pairs(self, now=None):
+        # Arrival order pairs everyone immediately, nobody is left to re-check
+        return []
+
+
+class RatingQueue:
+    """
+    Waiting players bucketed by rating.
+
+    Each bucket maps the ratings in it to an OrderedDict of players in
+    arrival order, so adding and removing a player is O(1). Players on the
+    same rating are the same distance from anyone looking, and the first to
+    arrive has the widest window, so only the first of each rating needs to
+    be checked. Looking for a partner checks the player's own bucket first
+    and then neighbouring buckets outwards, no further than the wider of the
+    player's window and that of whoever has waited longest, independent of
+    how many players are waiting. Two players are compatible when their
+    ratings are within the wider of their two search windows, and windows
+    widen the longer a player waits.
+    """
+
+    def __init__(self, bucket_width=BUCKET_WIDTH, base_window=BASE_WINDOW,
+                 widen_per_second=WIDEN_PER_SECOND, max_window=MAX_WINDOW):
+        self.bucket_width = bucket_width
+        self.base_window = base_window
+        self.widen_per_second = widen_per_second
+        self.max_window = max_window
+        self._buckets = {}
+        self._arrivals = OrderedDict()  # every waiting player, oldest first
+
+    def __len__(self):
+        return len(self._arrivals)
+
+    def window(self, player, now):
+        return min(self.max_window, self.base_window + self.widen_per_second * (now - player.joined_at))
+
+    def add(self, player):
+        bucket = self._buckets.setdefault(player.rating // self.bucket_width, {})
+        bucket.setdefault(player.rating, OrderedDict())[player.seq] = player
+        self._arrivals[player.seq] = player
+
+    def discard(self, player):
+        if self._arrivals.pop(player.seq, None) is None:
+            return
+        player.active = False
+        key = player.rating // self.bucket_width
+        bucket = self._buckets[key]
+        same_rating = bucket[player.rating]
+        del same_rating[player.seq]
+        if not same_rating:
+            del bucket[player.rating]
+            if not bucket:
+                del self._buckets[key]
+
+    def find_partner(self, player, now=None):
+        """Remove and return the longest-waiting compatible player in the nearest bucket that has one."""
+        if not self._arrivals:
+            return None
+        now = time.monotonic() if now is None else now
+        own_window = self.window(player, now)
+        reach = max(own_window, self.window(next(iter(self._arrivals.values())), now))
+        home = player.rating // self.bucket_width
+        for distance in range(int(reach) // self.bucket_width + 2):
+            partner = None
+            for key in ((home,) if distance == 0 else (home - distance, home + distance)):
+                for rating, same_rating in self._buckets.get(key, {}).items():
+                    gap = abs(rating - player.rating)
+                    for candidate in same_rating.values():
+                        if candidate is player:
+                            continue
+                        # Later arrivals on this rating have narrower windows than this one
+                        if gap <= own_window or gap <= self.window(candidate, now):
+                            if partner is None or candidate.seq < partner.seq:
+                                partner = candidate
+                        break
+            if partner is not None:
+                self.discard(partner)
+                return partner
+        return None
+
+    def pop_pairs(self, now=None):
+        """Pair up waiting players whose windows have widened enough to overlap."""
+        now = time.monotonic() if now is None else now
+        pairs = []
+        for key in sorted(self._buckets):
+            while key in self._buckets:
+                bucket = self._buckets[key]
+                player = min((next(iter(same_rating.values())) for same_rating in bucket.values()),
+                             key=lambda waiting: waiting.seq)
+                partner = self.find_partner(player, now)
+                if partner is None:
+                    break
+                self.discard(player)
+                pairs.append((player, partner))
+        return pairs
+
+
+# A primary key lookup, so reading it on every JOIN stays cheap
+RATING_SQL = "SELECT score FROM users WHERE username = ?"
+
+
+def player_rating(name):
+    """
+    The player's current score from the users table. It is read when they
+    join, so ratings follow the games played since the service started,
+    whichever process recorded them.
+    """
+    try:
+        row = database.fetch_one(RATING_SQL, (name,), label="player_rating")
+    except sqlite3.OperationalError:
+        logging.warning("Users table not available, %s is matched with the default rating.", name)
+        return DEFAULT_RATING
+    return DEFAULT_RATING if row is None else row[0]
+
+
+class MatchmakingService:
+    """
+    Event-driven matchmaking: every client is a coroutine on one event loop,
+    so a slow or silent client never holds up anyone else.
+
+    A client sends JOIN with its session token and either gets paired immediately with
+    someone already waiting or waits until the next arrival. Both receive a
+    MATCHED frame telling them whether to host the game or whom to connect
+    to, and the matchmaking connection is closed. `rating_of(name)`, such as
+    player_rating, gives the rating a player joins with and is called on a
+    worker thread, so it may block; without it everybody joins with
+    DEFAULT_RATING.
+    """
+
+    def __init__(self, host=HOST, port=MM_PORT, match_timeout=MATCH_TIMEOUT, waiting_queue=None, rating_of=None):
+        self.host = host
+        self.port = port
+        self.match_timeout = match_timeout
+        self.queue = waiting_queue if waiting_queue is not None else FifoQueue()
+        self.rating_of = rating_of
+        self.pairings = 0
+        self.timeouts = 0
+        self._seq = itertools.count()
+        self._server = None
+        self._rematch_task = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._rematch_task = asyncio.ensure_future(self._rematch_loop())
+        QUEUE_DEPTH.set_function(lambda: len(self.queue))
+        logging.info("Matchmaking service listening on %s:%d.", self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._rematch_task is not None:
+            self._rematch_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def pair(self, player):
+        """Pair `player` with someone waiting, or queue them. Returns the partner or None."""
+        partner = self.queue.find_partner(player)
+        if partner is None:
+            self.queue.add(player)
+            return None
+        self._notify(partner, player)
+        return partner
+
+    def _notify(self, host, other):
+        self.pairings += 1
+        PAIRINGS.inc()
+        now = time.monotonic()
+        WAIT_SECONDS.observe(now - host.joined_at)
+        WAIT_SECONDS.observe(now - other.joined_at)
+        # The player who waited longest hosts the game, as before
+        if other.seq < host.seq:
+            host, other = other, host
+        host.matched.set_result((protocol.ROLE_HOST, other.address, other.name))
+        other.matched.set_result((protocol.ROLE_CONNECT, host.address, host.name))
+
+    async def _rematch_loop(self):
+        while True:
+            await asyncio.sleep(REMATCH_INTERVAL)
+            for player, partner in self.queue.pop_pairs():
+                self._notify(player, partner)
+
+    async def _handle_client(self, reader, writer):
+        decoder = protocol.FrameDecoder()
+        try:
+            msg_type, payload = await asyncio.wait_for(protocol.read_frame(reader, decoder), JOIN_TIMEOUT)
+            if msg_type != protocol.JOIN:
+                raise protocol.ProtocolError(f"Expected JOIN, received message type {msg_type}")
+            name = sessions.validate(protocol.decode_hello(payload))
+            if name is None:
+                raise protocol.ProtocolError("Invalid or expired session token")
+        except (asyncio.TimeoutError, ConnectionError, protocol.ProtocolError, UnicodeDecodeError):
+            writer.close()
+            return
+
+        if self.rating_of is None:
+            rating = DEFAULT_RATING
+        else:
+            # A database read; on a worker thread it does not hold up other players' JOINs
+            rating = await asyncio.to_thread(self.rating_of, name)
+        player = WaitingPlayer(name, writer.get_extra_info("peername")[0], next(self._seq), rating)
+        if self.pair(player) is None:
+            await self._wait_for_partner(player, reader)
+
+        try:
+            if player.matched.done():
+                writer.write(protocol.encode_matched(*player.matched.result()))
+            else:
+                writer.write(protocol.encode_abort("No opponent found"))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _wait_for_partner(self, player, reader):
+        # Reading from the socket while we wait is how a disconnect is noticed
+        disconnected = asyncio.ensure_future(reader.read(1))
+        try:
+            await asyncio.wait({player.matched, disconnected}, timeout=self.match_timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+            timed_out = not disconnected.done()
+        finally:
+            disconnected.cancel()
+        if not player.matched.done():
+            if timed_out:
+                self.timeouts += 1
+                TIMEOUTS.inc()
+            self.queue.discard(player)
+            logging.debug("%s left matchmaking without a match.", player.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Rock, Paper, Scissors matchmaking service.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=MM_PORT)
+    parser.add_argument("--fifo", action="store_true", help="Pair in arrival order instead of by rating")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.fifo:
+        service = MatchmakingService(args.host, args.port)
+    else:
+        service = MatchmakingService(args.host, args.port, waiting_queue=RatingQueue(), rating_of=player_rating)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Counters, gauges and histograms for the servers, exposed in the Prometheus
+text format, plus a sampling profiler.
+
+Modules create their metrics once at import time and the hot paths only
+add to them: a counter increment or a histogram observation is a few
+hundred nanoseconds under an uncontended lock, and values like queue depths
+are gauges read by a function at scrape time, costing nothing in between.
+metrics_server.py serves them over HTTP.
+
+SamplingProfiler.collapsed() returns one "frame;frame;frame count" line
+per distinct stack, the input format of flamegraph.pl and speedscope.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as _StackCounts
+from contextlib import contextmanager
+
+# Seconds, from 100us to a minute
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROFILE_INTERVAL = 0.005  # seconds between samples
+
+_enabled = True
+
+
+def set_enabled(enabled):
+    """Turn every update into a no-op, or back on; used to measure the overhead."""
+    global _enabled
+    _enabled = enabled
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if _enabled:
+            with self._lock:
+                self.value += amount
+
+    def samples(self):
+        return [("", (), self.value)]
+
+
+class Gauge:
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        if _enabled:
+            with self._lock:
+                self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """Report function() at every scrape instead of the stored value."""
+        self.function = function
+
+    def samples(self):
+        return [("", (), self.function() if self.function is not None else self.value)]
+
+
+class Histogram:
+    """Observations counted into cumulative `le` buckets, Prometheus style."""
+
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if _enabled:
+            index = bisect.bisect_left(self.bounds, value)
+            with self._lock:
+                self.counts[index] += 1
+                self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        samples, cumulative = [], 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            samples.append(("_bucket", (("le", _format_value(bound)),), cumulative))
+        samples.append(("_sum", (), total))
+        samples.append(("_count", (), cumulative))
+        return samples
+
+
+class Family:
+    """All children of one metric name, one per combination of label values."""
+
+    def __init__(self, name, documentation, kind, label_names, factory):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self.factory = factory
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {values}")
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, documentation, kind, labels, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = Family(name, documentation, kind, labels, factory)
+            elif family.kind != kind or family.label_names != tuple(labels):
+                raise ValueError(f"Metric {name} is already registered differently")
+        # Unlabelled metrics are used directly rather than through labels()
+        return family if labels else family.labels()
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(name, documentation, "counter", labels, Counter)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(name, documentation, "gauge", labels, Gauge)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(name, documentation, "histogram", labels, lambda: Histogram(buckets))
+
+    def get(self, name):
+        return self._families.get(name)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for family in sorted(self._families.values(), key=lambda family: family.name):
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in sorted(family.children.items()):
+                base = tuple(zip(family.label_names, values))
+                for suffix, extra, value in child.samples():
+                    labels = ",".join(f'{key}="{_escape(label)}"' for key, label in base + extra)
+                    lines.append(f"{family.name}{suffix}{{{labels}}} {_format_value(value)}" if labels
+                                 else f"{family.name}{suffix} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return REGISTRY.counter(name, documentation, labels)
+
+
+def gauge(name, documentation, labels=()):
+    return REGISTRY.gauge(name, documentation, labels)
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, documentation, labels, buckets)
+
+
+def render():
+    return REGISTRY.render()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every other thread every `interval` seconds from a
+    background thread. Nothing is traced, so the profiled code runs at full
+    speed apart from the GIL the sampler briefly takes for each sample.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = _StackCounts()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
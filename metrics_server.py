@@ -0,0 +1,108 @@
+"""
+Local HTTP endpoint for the metrics registry and the sampling profiler.
+
+    GET /metrics                          every registered metric
+    GET /profile?seconds=10&interval=5    collapsed stacks sampled meanwhile
+
+Kept apart from metrics.py so that recording metrics never imports asyncio
+into the GUI client. Run as a script it fetches a profile from a running
+server and prints it.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+
+HOST = "127.0.0.1"
+METRICS_PORT = 5558
+MAX_PROFILE_SECONDS = 300
+REQUEST_TIMEOUT = 10
+
+
+class MetricsServer:
+    """A minimal local HTTP endpoint for scraping metrics and taking profiles."""
+
+    def __init__(self, host=HOST, port=METRICS_PORT, registry=metrics.REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.profiling = False
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Metrics endpoint listening on http://%s:%d/metrics.", self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_client(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            method, target = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ")[:2]
+            status, body = await self._respond(method, target)
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, target):
+        if method != "GET":
+            return "405 Method Not Allowed", b"GET only\n"
+        url = urlsplit(target)
+        if url.path == "/metrics":
+            return "200 OK", self.registry.render().encode()
+        if url.path == "/profile":
+            query = parse_qs(url.query)
+            try:
+                seconds = min(float(query.get("seconds", ["10"])[0]), MAX_PROFILE_SECONDS)
+                interval = float(query.get("interval", [str(metrics.PROFILE_INTERVAL * 1000)])[0]) / 1000
+            except ValueError:
+                return "400 Bad Request", b"seconds and interval (ms) must be numbers\n"
+            if self.profiling:
+                return "409 Conflict", b"A profile is already being taken\n"
+            self.profiling = True
+            profiler = metrics.SamplingProfiler(max(interval, 0.001)).start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                # Also when the client disconnects and this task is cancelled,
+                # or the sampler thread would run until the process exits
+                profiler.stop()
+                self.profiling = False
+            return "200 OK", profiler.collapsed().encode()
+        return "404 Not Found", b"Try /metrics or /profile\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Take a profile from a running server's metrics endpoint.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=METRICS_PORT)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--interval", type=float, default=metrics.PROFILE_INTERVAL * 1000, help="Milliseconds between samples")
+    args = parser.parse_args()
+
+    from urllib.request import urlopen
+    url = f"http://{args.host}:{args.port}/profile?seconds={args.seconds}&interval={args.interval}"
+    with urlopen(url, timeout=args.seconds + REQUEST_TIMEOUT) as response:
+        sys.stdout.write(response.read().decode())
+
+
+if __name__ == "__main__":
+    main()
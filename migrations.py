@@ -0,0 +1,163 @@
+"""
+Versioned schema migrations.
+
+The schema version lives in SQLite's `PRAGMA user_version`. Each migration
+runs in its own transaction together with the version bump, so a database
+is never left half migrated. Migration 1 uses IF NOT EXISTS so databases
+created before migrations existed are adopted as they are.
+"""
+import logging
+
+import database
+
+MIGRATIONS = [
+    (1, "Base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            score INTEGER DEFAULT 0,
+            games_played INTEGER DEFAULT 0,
+            wins INTEGER DEFAULT 0,
+            losses INTEGER DEFAULT 0,
+            ties INTEGER DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player1 TEXT NOT NULL,
+            player2 TEXT NOT NULL,
+            winner TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(player1) REFERENCES users(username),
+            FOREIGN KEY(player2) REFERENCES users(username)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS invitations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            FOREIGN KEY(sender) REFERENCES users(username),
+            FOREIGN KEY(recipient) REFERENCES users(username)
+        )
+        """,
+    ]),
+    (2, "Secondary indexes", [
+        # Leaderboard pages and rank counts, in score order
+        "CREATE INDEX IF NOT EXISTS idx_users_score ON users (score DESC, username)",
+        # Received invitations (recipient + status) and accepting one
+        # (sender + recipient + status) are both answered from this index alone
+        "CREATE INDEX IF NOT EXISTS idx_invitations_recipient ON invitations (recipient, status, sender)",
+        # Per-player game history
+        "CREATE INDEX IF NOT EXISTS idx_games_player1 ON games (player1, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_games_player2 ON games (player2, timestamp)",
+    ]),
+    (3, "Tournaments", [
+        """
+        CREATE TABLE IF NOT EXISTS tournaments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            format TEXT NOT NULL,
+            players INTEGER NOT NULL,
+            winner TEXT,
+            started DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished DATETIME
+        )
+        """,
+        # NULL for ordinary games
+        "ALTER TABLE games ADD COLUMN tournament_id INTEGER REFERENCES tournaments(id)",
+        "CREATE INDEX IF NOT EXISTS idx_games_tournament ON games (tournament_id)",
+    ]),
+    (4, "Round moves", [
+        # Move codes as in protocol.MOVES, NULL where the moves were not recorded
+        "ALTER TABLE games ADD COLUMN player1_move INTEGER",
+        "ALTER TABLE games ADD COLUMN player2_move INTEGER",
+    ]),
+    (5, "Per-user stats rollups", [
+        # Periods are whole UTC hours and days since the Unix epoch
+        """
+        CREATE TABLE IF NOT EXISTS stats_hourly (
+            username TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            games INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            ties INTEGER NOT NULL,
+            PRIMARY KEY (username, hour)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            username TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            games INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            losses INTEGER NOT NULL,
+            ties INTEGER NOT NULL,
+            PRIMARY KEY (username, day)
+        ) WITHOUT ROWID
+        """,
+        # Every recorded round updates both players' rollups in the same
+        # transaction as the games row, whoever wrote it, so a round must
+        # have exactly one row (see game_results.record_session). Existing
+        # games are rolled up by `python rollups.py backfill`.
+        """
+        CREATE TRIGGER IF NOT EXISTS games_rollup AFTER INSERT ON games BEGIN
+            INSERT INTO stats_hourly (username, hour, games, wins, losses, ties)
+            VALUES (NEW.player1, CAST(strftime('%s', NEW.timestamp) AS INTEGER) / 3600, 1,
+                    NEW.winner IS NEW.player1, NEW.winner IS NEW.player2, NEW.winner IS NULL)
+            ON CONFLICT (username, hour) DO UPDATE SET games = games + 1, wins = wins + excluded.wins,
+                losses = losses + excluded.losses, ties = ties + excluded.ties;
+            INSERT INTO stats_hourly (username, hour, games, wins, losses, ties)
+            VALUES (NEW.player2, CAST(strftime('%s', NEW.timestamp) AS INTEGER) / 3600, 1,
+                    NEW.winner IS NEW.player2, NEW.winner IS NEW.player1, NEW.winner IS NULL)
+            ON CONFLICT (username, hour) DO UPDATE SET games = games + 1, wins = wins + excluded.wins,
+                losses = losses + excluded.losses, ties = ties + excluded.ties;
+            INSERT INTO stats_daily (username, day, games, wins, losses, ties)
+            VALUES (NEW.player1, CAST(strftime('%s', NEW.timestamp) AS INTEGER) / 86400, 1,
+                    NEW.winner IS NEW.player1, NEW.winner IS NEW.player2, NEW.winner IS NULL)
+            ON CONFLICT (username, day) DO UPDATE SET games = games + 1, wins = wins + excluded.wins,
+                losses = losses + excluded.losses, ties = ties + excluded.ties;
+            INSERT INTO stats_daily (username, day, games, wins, losses, ties)
+            VALUES (NEW.player2, CAST(strftime('%s', NEW.timestamp) AS INTEGER) / 86400, 1,
+                    NEW.winner IS NEW.player2, NEW.winner IS NEW.player1, NEW.winner IS NULL)
+            ON CONFLICT (username, day) DO UPDATE SET games = games + 1, wins = wins + excluded.wins,
+                losses = losses + excluded.losses, ties = ties + excluded.ties;
+        END
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(target=LATEST_VERSION):
+    """Apply every pending migration up to `target` and return the new version."""
+    with database.get_pool().connection() as conn:
+        version = current_version(conn)
+        for number, description, statements in MIGRATIONS:
+            if number <= version or number > target:
+                continue
+            logging.info("Applying schema migration %d: %s.", number, description)
+            conn.execute("BEGIN IMMEDIATE")
+            if current_version(conn) >= number:
+                # Another process applied it while we were waiting for the lock
+                conn.rollback()
+                continue
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            version = number
+        return version
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import logging
+
+import database
+import protocol
+import sessions
+import write_behind
+
+HOST = "127.0.0.1"
+NOTIFY_PORT = 5557
+
+SUBSCRIBE_TIMEOUT = 10
+
+INBOX_SQL = """
+    SELECT sender, status
+    FROM invitations
+    WHERE recipient = ? AND status IN ('pending', 'accepted')
+"""
+INSERT_INVITE_SQL = "INSERT INTO invitations (sender, recipient) VALUES (?, ?)"
+ACCEPT_INVITE_SQL = """
+    UPDATE invitations
+    SET status = 'accepted'
+    WHERE sender = ? AND recipient = ? AND status = 'pending'
+"""
+# Players offered in the invite window: a page of usernames in [low, high),
+# read as a range of the username index, see search_range
+INVITE_SEARCH_SQL = """
+    SELECT username FROM users WHERE username >= ? AND username < ? AND username != ?
+    ORDER BY username LIMIT ?
+"""
+INVITE_PAGE_SIZE = 100
+# Sorts after every username anyone can type
+_LAST_NAME = "\U0010ffff"
+
+
+def search_range(prefix, after=None):
+    """
+    The (low, high) bounds of INVITE_SEARCH_SQL for usernames starting with
+    `prefix`, every username for an empty prefix. With `after`, the last name
+    of the previous page, the range starts just past it, so each page is one
+    index seek however far into the list it is.
+    """
+    high = prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else _LAST_NAME
+    # No string sorts between a name and the same name followed by NUL
+    return (prefix if after is None else after + "\0"), high
+
+
+class NotificationService:
+    """
+    Pushes invitations to players over a persistent connection.
+
+    Each player's inbox is read from the invitations table once, the first
+    time they subscribe or are invited, and kept in memory afterwards. The read
+    runs on a worker thread, so loading one inbox never holds up pushes to
+    everyone else. New invitations and
+    acceptances arrive as INVITE frames, are appended to the inbox, pushed to
+    every open connection of the other player and written to the database
+    through the write-behind queue. The table is the durable log; clients
+    never poll it.
+    """
+
+    def __init__(self, host=HOST, port=NOTIFY_PORT, persist=True):
+        self.host = host
+        self.port = port
+        self.persist = persist
+        self.inboxes = {}
+        self._loading = {}  # username -> task reading their inbox
+        self.subscribers = {}
+        self.db_reads = 0
+        self.delivered = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info("Notification service listening on %s:%d.", self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writers in list(self.subscribers.values()):
+            for writer in list(writers):
+                writer.close()
+
+    async def inbox(self, username):
+        """Return {sender: status} for `username`, loading it on first use."""
+        inbox = self.inboxes.get(username)
+        if inbox is None:
+            # Everyone asking while it loads waits on the same read
+            if username not in self._loading:
+                self._loading[username] = asyncio.ensure_future(self._load_inbox(username))
+            inbox = await asyncio.shield(self._loading[username])
+        return inbox
+
+    async def _load_inbox(self, username):
+        try:
+            rows = await asyncio.to_thread(_read_inbox, username)
+            self.db_reads += 1
+            return self.inboxes.setdefault(username, dict(rows))
+        finally:
+            del self._loading[username]
+
+    async def send_invite(self, sender, recipient):
+        inbox = await self.inbox(recipient)
+        if inbox.get(sender) == "pending":
+            return
+        inbox[sender] = "pending"
+        if self.persist:
+            write_behind.submit(INSERT_INVITE_SQL, (sender, recipient), label="send_invite")
+        self._push(recipient, protocol.encode_invite("pending", sender))
+
+    async def accept_invite(self, sender, recipient):
+        inbox = await self.inbox(recipient)
+        if inbox.get(sender) != "pending":
+            return
+        inbox[sender] = "accepted"
+        if self.persist:
+            write_behind.submit(ACCEPT_INVITE_SQL, (sender, recipient), label="accept_invite")
+        # Both sides hear about it: the recipient's other sessions and the sender
+        self._push(recipient, protocol.encode_invite("accepted", sender))
+        self._push(sender, protocol.encode_invite_accepted(recipient))
+
+    def _push(self, username, frame):
+        for writer in self.subscribers.get(username, ()):
+            if not writer.is_closing():
+                writer.write(frame)
+                self.delivered += 1
+
+    async def _handle_client(self, reader, writer):
+        decoder = protocol.FrameDecoder()
+        try:
+            msg_type, payload = await asyncio.wait_for(protocol.read_frame(reader, decoder), SUBSCRIBE_TIMEOUT)
+            if msg_type != protocol.SUBSCRIBE:
+                raise protocol.ProtocolError(f"Expected SUBSCRIBE, received message type {msg_type}")
+            username = sessions.validate(protocol.decode_hello(payload))
+            if username is None:
+                raise protocol.ProtocolError("Invalid or expired session token")
+        except (asyncio.TimeoutError, ConnectionError, protocol.ProtocolError, UnicodeDecodeError):
+            writer.close()
+            return
+
+        self.subscribers.setdefault(username, set()).add(writer)
+        try:
+            # Everything already in the inbox goes out in one write
+            backlog = [protocol.encode_invite(status, sender) for sender, status in (await self.inbox(username)).items()]
+            if backlog:
+                writer.write(b"".join(backlog))
+            while True:
+                await writer.drain()
+                msg_type, payload = await protocol.read_frame(reader, decoder)
+                if msg_type != protocol.INVITE:
+                    raise protocol.ProtocolError(f"Unexpected message type {msg_type}")
+                status, other_player = protocol.decode_invite(payload)
+                if status == "pending":
+                    await self.send_invite(username, other_player)
+                else:
+                    await self.accept_invite(other_player, username)
+        except (ConnectionError, protocol.ProtocolError, UnicodeDecodeError) as error:
+            logging.debug("Notification channel for %s closed: %s", username, error)
+        finally:
+            subscribers = self.subscribers.get(username)
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.subscribers[username]
+            writer.close()
+
+
+def _read_inbox(username):
+    # Invitations still in the write-behind queue must land before the read
+    write_behind.flush()
+    return database.fetch_all(INBOX_SQL, (username,), label="inbox")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Rock, Paper, Scissors invitation push service.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=NOTIFY_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(NotificationService(args.host, args.port).serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        write_behind.shutdown()
+
+
+if __name__ == "__main__":
+    main()
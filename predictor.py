@@ -0,0 +1,191 @@
+"""
+Incremental n-gram predictor of a player's next move.
+
+Each player gets an NGramModel: counts of which move followed each context
+of their last 0..order moves, kept in one flat array of 16-bit counters.
+Recording a move touches order + 1 counters and predicting reads at most
+order + 1 rows, so both are constant time however long the history is.
+Models are seeded once from the player's recorded games and held in an LRU
+cache, so memory stays bounded and cold players are dropped first.
+"""
+import logging
+import random
+import threading
+from array import array
+from collections import OrderedDict
+
+import database
+import rules
+import write_behind
+
+ORDER = 3
+MAX_PLAYERS = 10000
+HISTORY_LIMIT = 2000  # recorded rounds a model is seeded with
+MAX_COUNT = 0xFFFF
+
+# The player's most recent moves, newest first. Both halves are read from the
+# per-player (player, timestamp) game indexes already in that order, so the
+# union is a merge without a sort.
+HISTORY_SQL = """
+    SELECT timestamp, id, player1_move FROM games WHERE player1 = ? AND player1_move IS NOT NULL
+    UNION ALL
+    SELECT timestamp, id, player2_move FROM games WHERE player2 = ? AND player2_move IS NOT NULL
+    ORDER BY timestamp DESC, id DESC LIMIT ?
+"""
+
+
+class NGramModel:
+    """
+    Move counts for every context of up to `order` previous moves.
+
+    The table for context length k holds size ** k rows of `size` counters,
+    and the context is the last moves as a base-`size` number with the most
+    recent move in the lowest digit, so the row for length k is simply
+    context % size ** k. A counter about to overflow halves its whole row,
+    which also lets old habits fade.
+    """
+
+    __slots__ = ("size", "order", "offsets", "powers", "counts", "context", "seen")
+
+    def __init__(self, size, order=ORDER):
+        self.size = size
+        self.order = order
+        self.powers = [size ** k for k in range(order + 1)]
+        self.offsets = []
+        total = 0
+        for power in self.powers:
+            self.offsets.append(total)
+            total += power * size
+        self.counts = array("H", bytes(2 * total))
+        self.context = 0
+        self.seen = 0
+
+    def record(self, move):
+        counts, size = self.counts, self.size
+        for k in range(min(self.seen, self.order) + 1):
+            index = self.offsets[k] + (self.context % self.powers[k]) * size + move
+            if counts[index] == MAX_COUNT:
+                row = index - move
+                for i in range(row, row + size):
+                    counts[i] >>= 1
+            counts[index] += 1
+        self.context = (self.context * size + move) % self.powers[self.order]
+        self.seen += 1
+
+    def predict(self):
+        """Most likely next move, backing off to shorter contexts, or None without data."""
+        counts, size = self.counts, self.size
+        for k in range(min(self.seen, self.order), -1, -1):
+            row = self.offsets[k] + (self.context % self.powers[k]) * size
+            best, best_count = None, 0
+            for move in range(size):
+                if counts[row + move] > best_count:
+                    best, best_count = move, counts[row + move]
+            if best is not None:
+                return best
+        return None
+
+    def nbytes(self):
+        return self.counts.itemsize * len(self.counts)
+
+
+class MovePredictor:
+    """
+    Per-player NGramModels behind an LRU cache of at most `max_players`.
+
+    A player's model is built from their last `history_limit` recorded moves
+    the first time it is needed (call warm() before a session so that read
+    never happens mid-round) and then kept current with record().
+    """
+
+    def __init__(self, rule_set=rules.CLASSIC, order=ORDER, max_players=MAX_PLAYERS, history_limit=HISTORY_LIMIT):
+        self.rule_set = rule_set
+        self.order = order
+        self.max_players = max_players
+        self.history_limit = history_limit
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, username):
+        return username in self._models
+
+    def _load(self, username):
+        write_behind.flush()
+        rows = database.fetch_all(HISTORY_SQL, (username, username, self.history_limit), label="load_history")
+        model = NGramModel(len(self.rule_set), self.order)
+        size = len(self.rule_set)
+        for _, _, code in reversed(rows):
+            # Moves are stored with protocol codes; skip ones outside this rule set
+            if code < size:
+                model.record(code)
+        self.loads += 1
+        logging.debug("Seeded the move model for %s from %d rounds.", username, len(rows))
+        return model
+
+    def model(self, username):
+        with self._lock:
+            model = self._models.get(username)
+            if model is not None:
+                self._models.move_to_end(username)
+                return model
+        model = self._load(username)
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep the first one
+            model = self._models.setdefault(username, model)
+            self._models.move_to_end(username)
+            while len(self._models) > self.max_players:
+                self._models.popitem(last=False)
+                self.evictions += 1
+        return model
+
+    def warm(self, username):
+        self.model(username)
+
+    def record(self, username, move):
+        """Add one move name to the player's model, if it is cached."""
+        with self._lock:
+            model = self._models.get(username)
+            code = self.rule_set.codes.get(move)
+            if model is not None and code is not None:
+                model.record(code)
+
+    def predict(self, username):
+        """The player's most likely next move name, or None."""
+        model = self.model(username)
+        with self._lock:
+            code = model.predict()
+        return None if code is None else self.rule_set.moves[code]
+
+    def choose(self, username, rng=random):
+        """A move that beats the player's predicted move, or a random one."""
+        model = self.model(username)
+        with self._lock:
+            code = model.predict()
+        if code is None:
+            return rng.choice(self.rule_set.moves)
+        return self.rule_set.moves[self.rule_set.counter_to(code)]
+
+
+_predictor = None
+_predictor_lock = threading.Lock()
+
+
+def get_predictor():
+    global _predictor
+    if _predictor is None:
+        with _predictor_lock:
+            if _predictor is None:
+                _predictor = MovePredictor()
+    return _predictor
+
+
+# Hook for finished rounds. Only players whose model is already cached are
+# updated; anyone else is seeded from the games table when next needed.
+def record_move(username, move):
+    if _predictor is not None:
+        _predictor.record(username, move)
@@ -0,0 +1,381 @@
+"""
+Compact, length-prefixed wire protocol shared by the GUI clients and the
+headless servers.
+
+Every frame is a 4 byte header followed by the payload:
+
+    version (1 byte) | message type (1 byte) | payload length (2 bytes, big endian)
+
+Several frames may be written with one send() call and a single recv() may
+return several frames or part of one; FrameDecoder takes care of both.
+"""
+import select
+import struct
+from collections import deque, namedtuple
+
+import rules
+
+VERSION = 1
+
+HEADER = struct.Struct("!BBH")
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 0xFFFF
+
+# Message types
+HELLO = 1      # payload: UTF-8 player name
+CHOICE = 2     # payload: one move code
+RESULT = 3     # payload: round number, opponent move, outcome, both scores, final flag
+REMATCH = 4    # payload: empty, asks to keep the session going for another round
+ABORT = 5      # payload: optional UTF-8 reason
+JOIN = 6       # payload: session token (see sessions.py), sent to the matchmaking service
+MATCHED = 7    # payload: role, opponent address, opponent name
+SUBSCRIBE = 8  # payload: session token, opens a notification channel
+INVITE = 9     # payload: invitation status, UTF-8 name of the other player
+INVITE_ACCEPTED = 10  # payload: UTF-8 name of the player who accepted your invitation
+WATCH = 11     # payload: UTF-8 name of a player, asks the game server to spectate their match
+SPECTATE = 12  # payload: event kind, then the event (see encode_spectate_*), sent to spectators
+COMMIT = 13    # payload: commitment to this round's move (see commitments.py); empty from the game server
+               # when the opponent locked in with a plain CHOICE
+REVEAL = 14    # payload: move code, then the nonce the commitment was made with
+SERVER = 15    # payload: empty, sent by the game server as soon as it accepts a connection
+LOGIN = 16     # payload: session token, a HELLO to the game server that proves who is playing
+AUTH = 17      # payload: action, name length, UTF-8 name and password, sent to the login service
+TOKEN = 18     # payload: session token issued by the login service, empty after a registration
+
+# Move codes. The extended rule set numbers the classic moves the same way,
+# so one table covers every variant; sessions check moves against their rules.
+MOVES = rules.LIZARD_SPOCK.moves
+MOVE_CODES = {move: code for code, move in enumerate(MOVES)}
+
+# AUTH actions
+AUTH_LOGIN, AUTH_REGISTER = 0, 1
+
+# Roles handed out by the matchmaking service
+ROLE_CONNECT, ROLE_HOST = 0, 1
+
+# Invitation statuses carried by INVITE frames
+INVITE_STATUSES = ("pending", "accepted")
+INVITE_STATUS_CODES = {status: code for code, status in enumerate(INVITE_STATUSES)}
+
+# Outcome codes, from the point of view of the receiving player
+TIE, WIN, LOSS = 0, 1, 2
+OUTCOMES = ("tie", "win", "loss")
+OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+
+# Sizes of COMMIT and REVEAL contents, matching commitments.DIGEST_SIZE and NONCE_SIZE
+COMMITMENT_SIZE = 32
+NONCE_SIZE = 16
+
+# Spectator event kinds
+SPECTATE_START, SPECTATE_CHOSEN, SPECTATE_ROUND, SPECTATE_END = range(4)
+
+_RESULT = struct.Struct("!HBBHHB")
+_AUTH = struct.Struct("!BH")  # action, length of the name
+_SPECTATE_START = struct.Struct("!BHHHH")   # kind, round number, both scores, length of the first name
+_SPECTATE_ROUND = struct.Struct("!BHBBBHHB")  # kind, round number, both moves, outcome for A, scores, final
+
+RoundResult = namedtuple("RoundResult", "round_number opponent_move outcome score opponent_score final")
+SpectatorRound = namedtuple("SpectatorRound", "round_number move_a move_b outcome score_a score_b final")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# Encoding
+def encode(msg_type, payload=b""):
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"Payload too large: {len(payload)} bytes")
+    return HEADER.pack(VERSION, msg_type, len(payload)) + payload
+
+
+def encode_into(buffer, offset, msg_type, payload=b""):
+    """Write one frame into a preallocated bytearray and return the new offset."""
+    end = offset + HEADER_SIZE + len(payload)
+    HEADER.pack_into(buffer, offset, VERSION, msg_type, len(payload))
+    buffer[offset + HEADER_SIZE:end] = payload
+    return end
+
+
+def encode_hello(name):
+    return encode(HELLO, name.encode())
+
+
+def encode_choice(move):
+    return encode(CHOICE, bytes((MOVE_CODES[move],)))
+
+
+def encode_result(opponent_move, outcome, round_number=1, score=0, opponent_score=0, final=True):
+    return encode(RESULT, _RESULT.pack(round_number, MOVE_CODES[opponent_move], OUTCOME_CODES[outcome],
+                                       score, opponent_score, final))
+
+
+def encode_rematch():
+    return encode(REMATCH)
+
+
+def encode_abort(reason=""):
+    return encode(ABORT, reason.encode())
+
+
+def encode_join(token):
+    return encode(JOIN, token.encode())
+
+
+def encode_server():
+    return encode(SERVER)
+
+
+def encode_login(token):
+    return encode(LOGIN, token.encode())
+
+
+def encode_auth(action, username, password):
+    username = username.encode()
+    return encode(AUTH, _AUTH.pack(action, len(username)) + username + password.encode())
+
+
+def encode_token(token=""):
+    return encode(TOKEN, token.encode())
+
+
+def encode_matched(role, address, opponent_name):
+    address = address.encode()
+    return encode(MATCHED, bytes((role, len(address))) + address + opponent_name.encode())
+
+
+# Payload decoding. Payloads are memoryviews into the receive buffer.
+def decode_hello(payload):
+    return str(payload, "utf-8")
+
+
+def decode_choice(payload):
+    if len(payload) != 1 or payload[0] >= len(MOVES):
+        raise ProtocolError("Invalid choice payload")
+    return MOVES[payload[0]]
+
+
+def decode_commit(payload):
+    if len(payload) not in (0, COMMITMENT_SIZE):
+        raise ProtocolError("Invalid commitment payload")
+    return bytes(payload)
+
+
+def decode_reveal(payload):
+    """Return (move, nonce)."""
+    if len(payload) != 1 + NONCE_SIZE or payload[0] >= len(MOVES):
+        raise ProtocolError("Invalid reveal payload")
+    return MOVES[payload[0]], bytes(payload[1:])
+
+
+def decode_result(payload):
+    if len(payload) != _RESULT.size:
+        raise ProtocolError("Invalid result payload")
+    round_number, move, outcome, score, opponent_score, final = _RESULT.unpack(payload)
+    if move >= len(MOVES) or outcome >= len(OUTCOMES):
+        raise ProtocolError("Invalid result payload")
+    return RoundResult(round_number, MOVES[move], OUTCOMES[outcome], score, opponent_score, bool(final))
+
+
+def decode_auth(payload):
+    """Return (action, username, password)."""
+    if len(payload) < _AUTH.size:
+        raise ProtocolError("Invalid login payload")
+    action, length = _AUTH.unpack_from(payload)
+    end = _AUTH.size + length
+    if action not in (AUTH_LOGIN, AUTH_REGISTER) or len(payload) < end:
+        raise ProtocolError("Invalid login payload")
+    try:
+        return action, str(payload[_AUTH.size:end], "utf-8"), str(payload[end:], "utf-8")
+    except UnicodeDecodeError:
+        raise ProtocolError("Invalid login payload") from None
+
+
+def decode_matched(payload):
+    """Return (role, opponent address, opponent name)."""
+    if len(payload) < 2 or payload[0] not in (ROLE_CONNECT, ROLE_HOST) or len(payload) < 2 + payload[1]:
+        raise ProtocolError("Invalid match payload")
+    role, length = payload[0], payload[1]
+    try:
+        return role, str(payload[2:2 + length], "utf-8"), str(payload[2 + length:], "utf-8")
+    except UnicodeDecodeError:
+        raise ProtocolError("Invalid match payload") from None
+
+
+def encode_subscribe(token):
+    return encode(SUBSCRIBE, token.encode())
+
+
+def encode_invite(status, other_player):
+    return encode(INVITE, bytes((INVITE_STATUS_CODES[status],)) + other_player.encode())
+
+
+def encode_invite_accepted(recipient):
+    return encode(INVITE_ACCEPTED, recipient.encode())
+
+
+def encode_commit(commitment=b""):
+    return encode(COMMIT, commitment)
+
+
+def encode_reveal(move, nonce):
+    return encode(REVEAL, bytes((MOVE_CODES[move],)) + nonce)
+
+
+def encode_watch(player):
+    return encode(WATCH, player.encode())
+
+
+# Spectator events describe the match from player A's side, in one frame that
+# is encoded once and sent unchanged to every spectator
+def encode_spectate_start(player_a, player_b, round_number=0, score_a=0, score_b=0):
+    """Who is playing and the score so far; the first frame every spectator gets."""
+    name_a = player_a.encode()
+    return encode(SPECTATE, _SPECTATE_START.pack(SPECTATE_START, round_number, score_a, score_b, len(name_a))
+                  + name_a + player_b.encode())
+
+
+def encode_spectate_chosen(player_index):
+    """A player (0 for A, 1 for B) has locked in a move, which stays hidden until the round ends."""
+    return encode(SPECTATE, bytes((SPECTATE_CHOSEN, player_index)))
+
+
+def encode_spectate_round(round_number, move_a, move_b, outcome, score_a, score_b, final):
+    return encode(SPECTATE, _SPECTATE_ROUND.pack(SPECTATE_ROUND, round_number, MOVE_CODES[move_a], MOVE_CODES[move_b],
+                                                 OUTCOME_CODES[outcome], score_a, score_b, final))
+
+
+def encode_spectate_end(reason=""):
+    return encode(SPECTATE, bytes((SPECTATE_END,)) + reason.encode())
+
+
+def decode_spectate(payload):
+    """
+    Return (kind, event): (player A, player B, round number, score A, score B)
+    for START, the player index for CHOSEN, a SpectatorRound for ROUND and the
+    reason for END.
+    """
+    if not payload:
+        raise ProtocolError("Empty spectator event")
+    kind = payload[0]
+    if kind == SPECTATE_START:
+        _, round_number, score_a, score_b, length = _SPECTATE_START.unpack_from(payload)
+        names = payload[_SPECTATE_START.size:]
+        return kind, (str(names[:length], "utf-8"), str(names[length:], "utf-8"), round_number, score_a, score_b)
+    if kind == SPECTATE_CHOSEN:
+        return kind, payload[1]
+    if kind == SPECTATE_ROUND:
+        _, round_number, move_a, move_b, outcome, score_a, score_b, final = _SPECTATE_ROUND.unpack(payload)
+        return kind, SpectatorRound(round_number, MOVES[move_a], MOVES[move_b], OUTCOMES[outcome],
+                                    score_a, score_b, bool(final))
+    if kind == SPECTATE_END:
+        return kind, str(payload[1:], "utf-8")
+    raise ProtocolError(f"Unknown spectator event {kind}")
+
+
+def decode_invite(payload):
+    """Return (status, other player's name)."""
+    if not payload or payload[0] >= len(INVITE_STATUSES):
+        raise ProtocolError("Invalid invitation payload")
+    return INVITE_STATUSES[payload[0]], str(payload[1:], "utf-8")
+
+
+class FrameDecoder:
+    """
+    Incremental frame decoder.
+
+    Received chunks are kept as immutable bytes and frames are handed out as
+    (message type, memoryview) pairs pointing into them, so complete frames are
+    never copied. Only a frame split across two chunks is joined.
+    """
+
+    def __init__(self):
+        self._pending = b""
+        self._frames = deque()
+
+    def feed(self, data):
+        if self._pending:
+            data = self._pending + data
+        view = memoryview(data)
+        offset, end = 0, len(data)
+        while end - offset >= HEADER_SIZE:
+            version, msg_type, length = HEADER.unpack_from(view, offset)
+            if version != VERSION:
+                raise ProtocolError(f"Unsupported protocol version {version}")
+            if end - offset - HEADER_SIZE < length:
+                break
+            start = offset + HEADER_SIZE
+            self._frames.append((msg_type, view[start:start + length]))
+            offset = start + length
+        self._pending = bytes(view[offset:]) if offset < end else b""
+
+    def __len__(self):
+        return len(self._frames)
+
+    def next_frame(self):
+        """Return the next complete (type, payload) frame, or None."""
+        return self._frames.popleft() if self._frames else None
+
+
+# Transport helpers
+RECV_SIZE = 65536
+
+
+def send_frames(sock, *frames):
+    """Send any number of frames with a single sendall() call."""
+    sock.sendall(b"".join(frames))
+
+
+def recv_frame(sock, decoder):
+    """Read from a blocking socket until `decoder` holds a full frame."""
+    while not len(decoder):
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionResetError("Connection closed by peer")
+        decoder.feed(data)
+    return decoder.next_frame()
+
+
+def poll_frame(sock, decoder):
+    """Like recv_frame, but return None instead of blocking when no full frame has arrived yet."""
+    while not len(decoder):
+        if not select.select([sock], [], [], 0)[0]:
+            return None
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionResetError("Connection closed by peer")
+        decoder.feed(data)
+    return decoder.next_frame()
+
+
+def connect_handshake(sock, decoder, name, token=None):
+    """
+    Introduce ourselves on a blocking socket we connected to and return
+    (opponent name, whether the other end is the game server).
+
+    A peer sends its HELLO first and gets ours back. The game server sends
+    SERVER first and gets a LOGIN with our session token instead, so the
+    token never reaches another player.
+    """
+    msg_type, payload = recv_frame(sock, decoder)
+    via_server = msg_type == SERVER
+    if via_server:
+        if token is None:
+            raise ProtocolError("The game server needs a session token")
+        send_frames(sock, encode_login(token))
+        msg_type, payload = recv_frame(sock, decoder)
+    else:
+        send_frames(sock, encode_hello(name))
+    if msg_type != HELLO:
+        raise ProtocolError(f"Expected HELLO, received message type {msg_type}")
+    return decode_hello(payload), via_server
+
+
+async def read_frame(reader, decoder):
+    """asyncio counterpart of recv_frame for a StreamReader."""
+    while not len(decoder):
+        data = await reader.read(RECV_SIZE)
+        if not data:
+            raise ConnectionResetError("Connection closed by peer")
+        decoder.feed(data)
+    return decoder.next_frame()
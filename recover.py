@@ -1,83 +1,85 @@
-import sqlite3
-import hashlib
-from guizero import App, Text, TextBox, PushButton, Window, ListBox
+import commitments
+import credentials
+import game_results
+import migrations
+import write_behind
 import threading
 import socket
-import queue
+import asyncio
+import matchmaking
+import protocol
+import rules
+import leaderboard
+import sessions
 
 # Database setup
 def setup_database():
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password TEXT NOT NULL,
-            score INTEGER DEFAULT 0
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-# Utility function for hashing passwords
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-# Authentication functions
+    migrations.migrate()
+
+# Authentication functions; the login service checks the password and signs
+# the session token, the request runs off the GUI thread
 def register_user():
     username = username_input.value
     password = password_input.value
 
     if username and password:
-        hashed_password = hash_password(password)
-        conn = sqlite3.connect("users.db")
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
-            conn.commit()
-            auth_status.value = "Registration successful!"
-        except sqlite3.IntegrityError:
-            auth_status.value = "Username already exists."
-        conn.close()
+        auth_status.value = "Registering..."
+        threading.Thread(target=registration_thread, args=(username, password), daemon=True).start()
     else:
         auth_status.value = "Please fill in both fields."
 
+def registration_thread(username, password):
+    try:
+        credentials.request_registration(username, password)
+    except credentials.LoginRefused as refused:
+        auth_status.value = str(refused)
+        return
+    except (OSError, protocol.ProtocolError):
+        auth_status.value = "The login service is unavailable."
+        return
+    auth_status.value = "Registration successful!"
+
 def login_user():
     username = username_input.value
     password = password_input.value
 
-    hashed_password = hash_password(password)
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-    user = cursor.fetchone()
-    conn.close()
-
-    if user:
-        global current_user
-        current_user = username
-        auth_window.hide()
-        main_window.show()
-    else:
-        auth_status.value = "Invalid username or password."
+    auth_status.value = "Logging in..."
+    threading.Thread(target=login_thread, args=(username, password), daemon=True).start()
+
+def login_thread(username, password):
+    try:
+        token = credentials.request_login(username, password)
+    except credentials.LoginRefused as refused:
+        auth_status.value = str(refused)
+        return
+    except (OSError, protocol.ProtocolError):
+        auth_status.value = "The login service is unavailable."
+        return
+    global current_user
+    current_user = username
+    session_state["token"] = token
+    auth_status.value = ""
+    auth_window.hide()
+    main_window.show()
 
 # Update score after the game
 def update_score(username, delta):
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET score = score + ? WHERE username = ?", (delta, username))
-    conn.commit()
-    conn.close()
+    write_behind.submit(game_results.SCORE_SQL, (delta, username), label="update_score")
+    leaderboard.record_delta(username, delta)
+    sessions.invalidate_profile(username)
 
 # Display leaderboard
 def show_leaderboard():
     leaderboard_list.clear()
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, score FROM users ORDER BY score DESC")
-    for row in cursor.fetchall():
-        leaderboard_list.append(f"{row[0]}: {row[1]} points")
-    conn.close()
+    board = leaderboard.get_leaderboard()
+    rank = board.rank(current_user)
+    if rank:
+        leaderboard_list.append(f"Your rank: {rank}")
+    for rank, username, score in board.top(leaderboard.PAGE_SIZE):
+        leaderboard_list.append(f"{rank}. {username}: {score} points")
+
+# Signed session token of the logged-in user, see sessions.py
+session_state = {"token": None}
 
 # Host IP address and port
 HOST = "127.0.0.1"
@@ -98,16 +100,6 @@ game_choices = {
     "opponent_choice": None
 }
 
-# Winning scenarios
-WINNING_CASES = [
-    ["scissors", "paper"],
-    ["rock", "scissors"],
-    ["paper", "rock"]
-]
-
-# Matchmaking queue
-matchmaking_queue = queue.Queue()
-
 def start_server():
     if not game_state["server_running"]:
         threading.Thread(target=server_thread, daemon=True).start()
@@ -150,24 +142,41 @@ def client_thread():
     game_state["client_running"] = False
 
 def handle_connection(conn, role):
-    local_name = name_input.value or "Default"
+    # Peers are recorded under the name they say hello with, so it is the
+    # logged-in username rather than anything typed into the window
+    local_name = current_user
+    decoder = protocol.FrameDecoder()
+    # A REVEAL written right behind its COMMIT must not wait for the COMMIT's ACK
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-    if role == "server":
-        conn.sendall(local_name.encode())
-        opponent_name = conn.recv(1024).decode()
-    else:
-        conn.sendall(local_name.encode())
-        opponent_name = conn.recv(1024).decode()
-
-    connection_status_text.value = f"Connected to {opponent_name}"
-
-    game_state["choice_set"].wait()
-    game_state["choice_set"].clear()
-
-    conn.sendall(game_choices["user_choice"].encode())
-    game_choices["opponent_choice"] = conn.recv(1024).decode()
-
-    display_results()
+    try:
+        if role == "client":
+            opponent_name, via_server = protocol.connect_handshake(conn, decoder, local_name, session_state["token"])
+        else:
+            protocol.send_frames(conn, protocol.encode_hello(local_name))
+            msg_type, payload = protocol.recv_frame(conn, decoder)
+            if msg_type != protocol.HELLO:
+                connection_status_text.value = "Opponent sent an invalid handshake"
+                return
+            opponent_name, via_server = protocol.decode_hello(payload), False
+
+        connection_status_text.value = f"Connected to {opponent_name}"
+
+        game_state["choice_set"].wait()
+        game_state["choice_set"].clear()
+
+        # Commit-reveal: neither side sees the other move before locking in its own
+        exchanged = commitments.exchange_moves(conn, decoder, game_choices["user_choice"])
+    except (ConnectionError, protocol.ProtocolError) as error:
+        connection_status_text.value = f"Session ended: {error}"
+        return
+    if exchanged is None:
+        connection_status_text.value = f"{opponent_name} left the session"
+        return
+    game_choices["opponent_choice"], _ = exchanged
+
+    # The game server records its own sessions
+    display_results(record=not via_server)
 
     game_state["round_exit"].wait()
     game_state["round_exit"].clear()
@@ -179,21 +188,21 @@ def set_choice(choice):
     choice_text.value = "Waiting for opponent to make their choice..."
 
 def evaluate_winner():
-    user = game_choices["user_choice"]
-    opponent = game_choices["opponent_choice"]
-
-    if user == opponent:
+    outcome = rules.CLASSIC.outcome(rules.CLASSIC.codes[game_choices["user_choice"]],
+                                    rules.CLASSIC.codes[game_choices["opponent_choice"]])
+    if outcome == rules.TIE:
         return "The game was a tie!", 0
-    elif [user, opponent] in WINNING_CASES:
+    elif outcome == rules.WIN:
         return "You won the game!", 1
     else:
         return "You lost the game!", -1
 
-def display_results():
+def display_results(record=True):
     result_message, score_delta = evaluate_winner()
     connection_status_text.value = result_message
     choice_text.value = f"You chose {game_choices['user_choice']}, opponent chose {game_choices['opponent_choice']}"
-    update_score(current_user, score_delta)
+    if record:
+        update_score(current_user, score_delta)
     exit_button.show()
 
 def setup_game_ui(role):
@@ -210,7 +219,7 @@ def reset_game_ui():
     choice_text.value = ""
 
 def toggle_ui_elements(visible):
-    elements = [host_label, host_input, name_label, name_input, connect_button, wait_for_connection_button, matchmaking_button]
+    elements = [host_label, host_input, connect_button, wait_for_connection_button, matchmaking_button]
     for element in elements:
         if visible:
             element.show()
@@ -235,79 +244,81 @@ def join_matchmaking():
     threading.Thread(target=matchmaking_client_thread, daemon=True).start()
 
 def matchmaking_client_thread():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as mm_socket:
-        mm_socket.connect((HOST, MM_PORT))
-        mm_socket.sendall(current_user.encode())
-        opponent_ip = mm_socket.recv(1024).decode()
-
-    if opponent_ip == "host":
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as mm_socket:
+            mm_socket.connect((HOST, MM_PORT))
+            protocol.send_frames(mm_socket, protocol.encode_join(session_state["token"]))
+            msg_type, payload = protocol.recv_frame(mm_socket, protocol.FrameDecoder())
+        if msg_type != protocol.MATCHED:
+            connection_status_text.value = "No opponent found"
+            return
+        role, opponent_address, _ = protocol.decode_matched(payload)
+    except (OSError, protocol.ProtocolError):
+        connection_status_text.value = "Matchmaking is unavailable"
+        return
+
+    if role == protocol.ROLE_HOST:
         start_server()
     else:
-        host_input.value = opponent_ip
+        host_input.value = opponent_address
         start_client()
 
 # Matchmaking server thread
 def matchmaking_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as mm_server_socket:
-        mm_server_socket.bind((HOST, MM_PORT))
-        mm_server_socket.listen()
-        while True:
-            conn, addr = mm_server_socket.accept()
-            username = conn.recv(1024).decode()
-            matchmaking_queue.put((conn, username))
-
-            if matchmaking_queue.qsize() >= 2:
-                player1, player2 = matchmaking_queue.get(), matchmaking_queue.get()
-                player1[0].sendall(b"host")
-                player2[0].sendall(player1[1].encode())
-
-# Start matchmaking server thread
-threading.Thread(target=matchmaking_server, daemon=True).start()
-
-# GUI Setup
-app = App(title="Rock, Paper, Scissors", width=700, height=400, visible=False)
-
-# Authentication window
-auth_window = Window(app, title="Login", width=400, height=300)
-auth_window.when_closed = app.destroy
-
-Text(auth_window, text="Username:")
-username_input = TextBox(auth_window, width="fill")
-Text(auth_window, text="Password:")
-password_input = TextBox(auth_window, width="fill", hide_text=True)
-
-auth_status = Text(auth_window, text="")
-PushButton(auth_window, text="Login", command=login_user)
-PushButton(auth_window, text="Register", command=register_user)
-
-# Main game window (hidden until login)
-main_window = Window(app, title="Rock, Paper, Scissors", width=700, height=400, visible=False)
-
-ip_text = Text(main_window, text=f"Your IP: {HOST}", grid=[0, 0])
-connection_status_text = Text(main_window, text="Not connected right now", grid=[0, 1])
-choice_text = Text(main_window, text="", grid=[0, 2])
-
-host_label = Text(main_window, text="Host:", grid=[0, 3])
-host_input = TextBox(main_window, width="fill", grid=[1, 3])
-connect_button = PushButton(main_window, text="Connect", grid=[2, 3], command=start_client)
-wait_for_connection_button = PushButton(main_window, text="Wait for Connection", grid=[3, 3], command=start_server)
-matchmaking_button = PushButton(main_window, text="Join Matchmaking", grid=[4, 3], command=join_matchmaking)
-
-rock_button = PushButton(main_window, text="Rock", grid=[0, 5], command=lambda: set_choice("rock"), visible=False)
-paper_button = PushButton(main_window, text="Paper", grid=[1, 5], command=lambda: set_choice("paper"), visible=False)
-scissors_button = PushButton(main_window, text="Scissors", grid=[2, 5], command=lambda: set_choice("scissors"), visible=False)
-
-name_label = Text(main_window, text="Name:", grid=[0, 4])
-name_input = TextBox(main_window, width="fill", text="Default")
-
-exit_button = PushButton(main_window, text="Exit", grid=[0, 6], command=exit_round, visible=False)
-
-# Leaderboard window
-leaderboard_window = Window(app, title="Leaderboard", width=400, height=300, visible=False)
-leaderboard_list = ListBox(leaderboard_window, items=[], width="fill", height="fill")
-PushButton(leaderboard_window, text="Close", command=leaderboard_window.hide)
-PushButton(main_window, text="Leaderboard", grid=[0, 7], command=lambda: [leaderboard_window.show(), show_leaderboard()])
-
-auth_window.show()
-setup_database()
-app.display()
+    service = matchmaking.MatchmakingService(HOST, MM_PORT, waiting_queue=matchmaking.RatingQueue(),
+                                             rating_of=matchmaking.player_rating)
+    asyncio.run(service.serve_forever())
+
+if __name__ == "__main__":
+    # Importing this module only defines the helpers; the GUI and the
+    # matchmaking thread start when it is run as a script.
+    from guizero import App, Text, TextBox, PushButton, Window, ListBox
+
+    # Start matchmaking server thread
+    threading.Thread(target=matchmaking_server, daemon=True).start()
+
+    # GUI Setup
+    app = App(title="Rock, Paper, Scissors", width=700, height=400, visible=False)
+
+    # Authentication window
+    auth_window = Window(app, title="Login", width=400, height=300)
+    auth_window.when_closed = app.destroy
+
+    Text(auth_window, text="Username:")
+    username_input = TextBox(auth_window, width="fill")
+    Text(auth_window, text="Password:")
+    password_input = TextBox(auth_window, width="fill", hide_text=True)
+
+    auth_status = Text(auth_window, text="")
+    PushButton(auth_window, text="Login", command=login_user)
+    PushButton(auth_window, text="Register", command=register_user)
+
+    # Main game window (hidden until login)
+    main_window = Window(app, title="Rock, Paper, Scissors", width=700, height=400, visible=False)
+
+    ip_text = Text(main_window, text=f"Your IP: {HOST}", grid=[0, 0])
+    connection_status_text = Text(main_window, text="Not connected right now", grid=[0, 1])
+    choice_text = Text(main_window, text="", grid=[0, 2])
+
+    host_label = Text(main_window, text="Host:", grid=[0, 3])
+    host_input = TextBox(main_window, width="fill", grid=[1, 3])
+    connect_button = PushButton(main_window, text="Connect", grid=[2, 3], command=start_client)
+    wait_for_connection_button = PushButton(main_window, text="Wait for Connection", grid=[3, 3], command=start_server)
+    matchmaking_button = PushButton(main_window, text="Join Matchmaking", grid=[4, 3], command=join_matchmaking)
+
+    rock_button = PushButton(main_window, text="Rock", grid=[0, 5], command=lambda: set_choice("rock"), visible=False)
+    paper_button = PushButton(main_window, text="Paper", grid=[1, 5], command=lambda: set_choice("paper"), visible=False)
+    scissors_button = PushButton(main_window, text="Scissors", grid=[2, 5], command=lambda: set_choice("scissors"), visible=False)
+
+
+    exit_button = PushButton(main_window, text="Exit", grid=[0, 6], command=exit_round, visible=False)
+
+    # Leaderboard window
+    leaderboard_window = Window(app, title="Leaderboard", width=400, height=300, visible=False)
+    leaderboard_list = ListBox(leaderboard_window, items=[], width="fill", height="fill")
+    PushButton(leaderboard_window, text="Close", command=leaderboard_window.hide)
+    PushButton(main_window, text="Leaderboard", grid=[0, 7], command=lambda: [leaderboard_window.show(), show_leaderboard()])
+
+    auth_window.show()
+    setup_database()
+    app.display()
@@ -0,0 +1,426 @@
+"""
+Optional UDP transport for game sessions, with its own sequencing, acks and
+retransmission.
+
+Every datagram starts with
+
+    seq (2 bytes) | ack (2 bytes) | ack bits (4 bytes) | flags (1 byte)
+
+followed, for DATA packets, by ordinary protocol frames. `ack` is the next
+sequence number the sender expects and bit i of `ack bits` means ack + 1 + i
+has arrived too, so one packet acknowledges everything received so far and
+a lost ack costs nothing. Every DATA packet is acknowledged at once. Unacked
+packets are resent after a retransmission timeout computed from measured
+round trips (RFC 6298, with a 10ms floor instead of TCP's 200ms), and a peer
+that stops answering is reported as a ConnectionResetError.
+
+There is no connection setup: a client's first datagram already carries its
+HELLO, or its LOGIN, and may carry its first CHOICE. Only the game server
+listens here, so unlike over TCP nobody is greeted with SERVER first. ReliableConnection offers the same
+send()/read_frame() calls as game_server.Player, so UdpGameServer runs the
+unchanged MatchSession over it. Impairment drops and delays outgoing
+datagrams on purpose, for benchmarks.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import struct
+from collections import deque
+
+import protocol
+import rules
+import write_behind
+from game_server import HANDSHAKE_TIMEOUT, MATCHES, MatchSession, identify
+
+HOST = "127.0.0.1"
+UDP_PORT = 5559
+
+PACKET = struct.Struct("!HHIB")
+DATA, FIN = 1, 2
+SEQ_MODULO = 1 << 16
+WINDOW = 32               # sequence numbers in flight from the oldest unacked, also the width of the ack bits
+MAX_PACKET_PAYLOAD = 1200  # bytes of frames per datagram, well below common MTUs
+INITIAL_RTO = 0.1          # seconds, until a round trip has been measured
+MIN_RTO = 0.01
+MAX_RTO = 2.0
+MAX_RETRIES = 8
+CLOSE_LINGER = 2.0         # seconds close() waits for unacked data before giving up
+
+
+def _before(a, b):
+    """True if sequence number a comes before b, allowing for wraparound."""
+    return a != b and (b - a) % SEQ_MODULO < SEQ_MODULO // 2
+
+
+class Impairment:
+    """Drops each outgoing datagram with probability `loss` and delays the rest by `delay` +- `jitter` seconds."""
+
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, seed=None):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.dropped = 0
+
+    def send(self, transport, data, address):
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.delay + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, transport.sendto, data, address)
+        else:
+            transport.sendto(data, address)
+
+
+class ReliableConnection:
+    """One peer of a UdpEndpoint: an ordered, reliable stream of protocol frames."""
+
+    def __init__(self, endpoint, address):
+        self.endpoint = endpoint
+        self.address = address
+        self.decoder = protocol.FrameDecoder()
+        self.next_seq = 0
+        self.expected = 0
+        self.unacked = {}        # seq -> [payload, sent at, retries, timer], oldest first
+        self.backlog = deque()   # payloads waiting for room in the window
+        self.out_of_order = {}
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = INITIAL_RTO
+        self.error = None
+        self.closing = False
+        self._readable = asyncio.Event()
+        self.sent = 0
+        self.retransmits = 0
+        self.duplicates = 0
+
+    # Sending
+    def send_frames(self, *frames):
+        if self.error is not None:
+            raise self.error
+        data = b"".join(frames)
+        for offset in range(0, len(data), MAX_PACKET_PAYLOAD):
+            self.backlog.append(data[offset:offset + MAX_PACKET_PAYLOAD])
+        self._fill_window()
+
+    async def send(self, *frames):
+        self.send_frames(*frames)
+
+    def _in_flight(self):
+        """
+        Sequence numbers from the oldest unacknowledged packet up to the next
+        one to send. Bounding this rather than the number of unacked packets
+        keeps the sender within the receiver's reorder window while an early
+        packet is lost and later ones are acked selectively.
+        """
+        if not self.unacked:
+            return 0
+        return (self.next_seq - next(iter(self.unacked))) % SEQ_MODULO
+
+    def _fill_window(self):
+        while self.backlog and self._in_flight() < WINDOW:
+            seq, self.next_seq = self.next_seq, (self.next_seq + 1) % SEQ_MODULO
+            payload = self.backlog.popleft()
+            loop = asyncio.get_running_loop()
+            self.unacked[seq] = [payload, loop.time(), 0, loop.call_later(self.rto, self._retransmit, seq, self.rto)]
+            self._transmit(seq, DATA, payload)
+            self.sent += 1
+        if self.closing and not self.unacked and not self.backlog:
+            self._finish()
+
+    def _ack_fields(self):
+        bits = 0
+        for i in range(WINDOW):
+            if (self.expected + 1 + i) % SEQ_MODULO in self.out_of_order:
+                bits |= 1 << i
+        return self.expected, bits
+
+    def _transmit(self, seq, flags, payload=b""):
+        ack, bits = self._ack_fields()
+        self.endpoint.send(PACKET.pack(seq, ack, bits, flags) + payload, self.address)
+
+    def _retransmit(self, seq, timeout):
+        entry = self.unacked.get(seq)
+        if entry is None or self.error is not None:
+            return
+        if entry[2] >= MAX_RETRIES:
+            self._fail(ConnectionResetError(f"{self.address} stopped acknowledging"))
+            return
+        entry[2] += 1
+        self.retransmits += 1
+        # Exponential backoff for this packet only; the next RTT sample resets it
+        timeout = min(timeout * 2, MAX_RTO)
+        entry[3] = asyncio.get_running_loop().call_later(timeout, self._retransmit, seq, timeout)
+        self._transmit(seq, DATA, entry[0])
+
+    # Receiving
+    def datagram_received(self, data):
+        if len(data) < PACKET.size:
+            return
+        seq, ack, bits, flags = PACKET.unpack_from(data)
+        self._process_ack(ack, bits)
+        if flags & FIN:
+            self._fail(ConnectionResetError("Connection closed by peer"))
+            return
+        if not flags & DATA:
+            return
+        if seq == self.expected:
+            self._deliver(data[PACKET.size:])
+            while self.expected in self.out_of_order:
+                self._deliver(self.out_of_order.pop(self.expected))
+        elif _before(self.expected, seq) and (seq - self.expected) % SEQ_MODULO <= WINDOW:
+            if seq in self.out_of_order:
+                self.duplicates += 1
+            self.out_of_order[seq] = data[PACKET.size:]
+        else:
+            self.duplicates += 1
+        # Acknowledge at once; the sequence number of a pure ack is not used
+        self._transmit(self.next_seq, 0)
+
+    def _deliver(self, payload):
+        self.expected = (self.expected + 1) % SEQ_MODULO
+        try:
+            self.decoder.feed(payload)
+        except protocol.ProtocolError as error:
+            self._fail(error)
+        self._readable.set()
+
+    def _process_ack(self, ack, bits):
+        if not self.unacked:
+            return
+        now = asyncio.get_running_loop().time()
+        acked = [seq for seq in self.unacked if _before(seq, ack) or self._selectively_acked(seq, ack, bits)]
+        for seq in acked:
+            payload, sent_at, retries, timer = self.unacked.pop(seq)
+            timer.cancel()
+            if not retries:  # Karn's rule: only unambiguous samples
+                self._sample_rtt(now - sent_at)
+        if acked:
+            self._fill_window()
+
+    @staticmethod
+    def _selectively_acked(seq, ack, bits):
+        offset = (seq - ack) % SEQ_MODULO - 1
+        return 0 <= offset < WINDOW and bits >> offset & 1
+
+    def _sample_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + 4 * self.rttvar))
+
+    async def read_frame(self, timeout=None):
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return frame
+            if self.error is not None:
+                raise self.error
+            self._readable.clear()
+            await asyncio.wait_for(self._readable.wait(), timeout)
+
+    # Closing
+    def is_closing(self):
+        return self.closing or self.error is not None
+
+    def close(self):
+        """Close once everything sent so far is acknowledged, or after CLOSE_LINGER seconds."""
+        if self.closing or self.error is not None:
+            return
+        self.closing = True
+        if not self.unacked and not self.backlog:
+            self._finish()
+        else:
+            asyncio.get_running_loop().call_later(CLOSE_LINGER, self._finish)
+
+    def _finish(self):
+        if self.error is None:
+            self._transmit(self.next_seq, FIN)
+            self._fail(ConnectionResetError("Connection closed"))
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+            for entry in self.unacked.values():
+                entry[3].cancel()
+            self.unacked.clear()
+            self.backlog.clear()
+            self._readable.set()
+            self.endpoint.forget(self.address)
+
+
+class UdpEndpoint(asyncio.DatagramProtocol):
+    """A UDP socket demultiplexing datagrams into one ReliableConnection per peer address."""
+
+    def __init__(self, on_connection=None, impairment=None, close_when_idle=False):
+        self.on_connection = on_connection
+        self.impairment = impairment
+        self.close_when_idle = close_when_idle
+        self.connections = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connect(self, address):
+        connection = self.connections[address] = ReliableConnection(self, address)
+        return connection
+
+    def datagram_received(self, data, address):
+        connection = self.connections.get(address)
+        if connection is None:
+            if self.on_connection is None or len(data) < PACKET.size:
+                return
+            seq, _, _, flags = PACKET.unpack_from(data)
+            if seq != 0 or not flags & DATA:
+                return  # late retransmits, acks and FINs for connections already gone
+            connection = self.connect(address)
+            self.on_connection(connection)
+        connection.datagram_received(data)
+
+    def send(self, data, address):
+        if self.transport is None or self.transport.is_closing():
+            return
+        if self.impairment is not None:
+            self.impairment.send(self.transport, data, address)
+        else:
+            self.transport.sendto(data, address)
+
+    def forget(self, address):
+        self.connections.pop(address, None)
+        if self.close_when_idle and not self.connections:
+            self.close()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+async def open_connection(host, port, impairment=None):
+    """Client side: a ReliableConnection to a UDP server, usable at once."""
+    loop = asyncio.get_running_loop()
+    _, endpoint = await loop.create_datagram_endpoint(
+        lambda: UdpEndpoint(impairment=impairment, close_when_idle=True), remote_addr=(host, port))
+    return endpoint.connect((host, port))
+
+
+class UdpPlayer:
+    """game_server.Player over a ReliableConnection, for MatchSession."""
+
+    def __init__(self, name, connection, logged_in=False):
+        self.name = name
+        self.logged_in = logged_in
+        self.connection = connection
+
+    async def send(self, *frames):
+        self.connection.send_frames(*frames)
+
+    async def read_frame(self, timeout):
+        return await self.connection.read_frame(timeout)
+
+    def close(self):
+        self.connection.close()
+
+
+class UdpGameServer:
+    """GameServer's arrival-order pairing and MatchSession over reliable UDP."""
+
+    def __init__(self, host=HOST, port=UDP_PORT, record_results=True, best_of=1, rule_set=rules.CLASSIC,
+                 impairment=None, require_commit=False):
+        self.host = host
+        self.port = port
+        self.record_results = record_results
+        self.best_of = best_of
+        self.rule_set = rule_set
+        self.impairment = impairment
+        self.require_commit = require_commit
+        self.sessions = {}
+        self.matches_completed = 0
+        self.rounds_completed = 0
+        self._waiting = None
+        self._ids = itertools.count(1)
+        self._endpoint = None
+        self._tasks = set()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        _, self._endpoint = await loop.create_datagram_endpoint(
+            lambda: UdpEndpoint(self._accept, self.impairment), local_addr=(self.host, self.port))
+        self.port = self._endpoint.transport.get_extra_info("sockname")[1]
+        logging.info("UDP game server listening on %s:%d.", self.host, self.port)
+
+    async def serve_forever(self):
+        if self._endpoint is None:
+            await self.start()
+        await asyncio.Event().wait()
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._endpoint is not None:
+            self._endpoint.close()
+
+    def _accept(self, connection):
+        task = asyncio.ensure_future(self._handle_client(connection))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_client(self, connection):
+        try:
+            msg_type, payload = await connection.read_frame(HANDSHAKE_TIMEOUT)
+            name, logged_in = identify(msg_type, payload) or ("", False)
+        except (asyncio.TimeoutError, ConnectionError, protocol.ProtocolError, UnicodeDecodeError):
+            connection.close()
+            return
+        if not name:
+            connection.close()
+            return
+        player = UdpPlayer(name, connection, logged_in)
+
+        waiting, self._waiting = self._waiting, None
+        if waiting is None or waiting.connection.is_closing():
+            self._waiting = player
+            return
+        session_id = next(self._ids)
+        session = MatchSession(session_id, waiting, player, self.record_results, self.best_of, self.rule_set,
+                               self.require_commit)
+        self.sessions[session_id] = session
+        try:
+            outcomes = await session.run()
+            if outcomes:
+                MATCHES.inc()
+                self.matches_completed += 1
+                self.rounds_completed += len(outcomes)
+        finally:
+            del self.sessions[session_id]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Rock, Paper, Scissors game server over reliable UDP.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=UDP_PORT)
+    parser.add_argument("--best-of", type=int, default=1, help="Rounds per session, 0 for unlimited")
+    parser.add_argument("--rules", choices=sorted(rules.RULE_SETS), default=rules.CLASSIC.name)
+    parser.add_argument("--no-record", action="store_true", help="Do not write results to the database")
+    parser.add_argument("--require-commit", action="store_true", help="Reject moves sent without commit-reveal")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = UdpGameServer(args.host, args.port, record_results=not args.no_record, best_of=args.best_of or None,
+                           rule_set=rules.RULE_SETS[args.rules], require_commit=args.require_commit)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        write_behind.shutdown()
+
+
+if __name__ == "__main__":
+    main()
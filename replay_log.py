@@ -0,0 +1,489 @@
+"""
+Append-only replay log of every round played, in segment files that readers
+memory-map instead of loading.
+
+A log directory holds
+
+    players                 interned player names: u16 length + UTF-8 each, the id is the position
+    00000001-00000001.rpl   segments, named after the range of segment numbers they cover
+    00000002-00000002.rpl
+
+and every segment is a HEADER (magic, base time in ms) followed by 20 byte
+records, one per round:
+
+    ms since base (u32) | match id (u32) | player A id (u32) | player B id (u32) |
+    round number (u16) | moves (u8) | rule set (u8)
+
+The moves byte holds A's move code in its low three bits and B's in the next
+three: two bits would do for the classic moves, the five-move variant needs
+three. Match ids grow with every match and a match is appended in one write,
+so records are ordered by match id across the whole log and a match is found
+by binary search. Scans read columns straight from the mapping (see
+move_counts), or as a NumPy structured array when NumPy is installed.
+
+Policy: the writer starts a new segment once the current one reaches
+`segment_bytes` or `segment_age` seconds, which also keeps the u32 offsets in
+range. compact() deletes sealed segments past a retention age and merges runs
+of small ones, such as those left by restarts; a merged segment is renamed
+into place before its inputs are removed, and readers skip any segment whose
+range another one covers, so they never see a round twice.
+"""
+import argparse
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import protocol
+import rules
+
+try:
+    import fcntl
+except ImportError:  # no single-writer lock on this platform
+    fcntl = None
+
+try:
+    import numpy
+except ImportError:  # scans fall back to strided slices of the mapping
+    numpy = None
+
+MAGIC = b"RPSRPL1\n"
+HEADER = struct.Struct("<8sq")
+RECORD = struct.Struct("<IIIIHBB")
+MOVES_OFFSET = 18  # of the moves byte within a record
+PLAYER_NAME = struct.Struct("<H")
+
+SEGMENT_BYTES = 64 * 1024 * 1024  # about 3.3 million rounds
+SEGMENT_AGE = 24 * 3600           # seconds; must stay well below 2**32 ms
+SEGMENT_NAME = re.compile(r"^(\d{8})-(\d{8})\.rpl$")
+
+# Stored as an index, so new rule sets must be added to rules.RULE_SETS at the end
+RULE_CODES = {name: code for code, name in enumerate(rules.RULE_SETS)}
+RULE_NAMES = list(rules.RULE_SETS)
+
+ReplayRound = namedtuple("ReplayRound", "timestamp match_id player_a player_b round_number move_a move_b rule_set")
+ReplayedRound = namedtuple("ReplayedRound", "round_number move_a move_b outcome score_a score_b")
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([("offset_ms", "<u4"), ("match_id", "<u4"), ("player_a", "<u4"), ("player_b", "<u4"),
+                                ("round_number", "<u2"), ("moves", "u1"), ("rule_set", "u1")])
+
+
+def _segment_name(first, last):
+    return f"{first:08d}-{last:08d}.rpl"
+
+
+class Segment:
+    """A read-only view of one segment file, memory-mapped on open()."""
+
+    def __init__(self, path):
+        self.path = path
+        first, last = SEGMENT_NAME.match(os.path.basename(path)).groups()
+        self.first, self.last = int(first), int(last)
+        self.base_ms = 0
+        self._file = None
+        self._map = None
+        self._count = 0
+
+    def open(self):
+        self._file = open(self.path, "rb")
+        header = self._file.read(HEADER.size)
+        magic, self.base_ms = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a replay segment")
+        size = os.fstat(self._file.fileno()).st_size
+        # A record cut short by a crash is left out
+        self._count = (size - HEADER.size) // RECORD.size
+        if self._count:
+            self._map = mmap.mmap(self._file.fileno(), HEADER.size + self._count * RECORD.size, access=mmap.ACCESS_READ)
+        return self
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, index):
+        return RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+
+    def data(self):
+        """The records as one memoryview into the mapping."""
+        return memoryview(self._map)[HEADER.size:] if self._count else memoryview(b"")
+
+    def records(self, start=0):
+        """Raw record tuples from `start` on, unpacked one at a time."""
+        yield from RECORD.iter_unpack(self.data()[start * RECORD.size:])
+
+    def column(self, offset):
+        """The byte at `offset` of every record, as one bytes object."""
+        if not self._count:
+            return b""
+        return self._map[HEADER.size + offset:HEADER.size + self._count * RECORD.size:RECORD.size]
+
+    def array(self):
+        """The records as a NumPy structured array sharing the mapping; needs NumPy."""
+        if numpy is None:
+            raise RuntimeError("NumPy is not installed")
+        if not self._count:
+            return numpy.empty(0, dtype=RECORD_DTYPE)
+        return numpy.frombuffer(self._map, dtype=RECORD_DTYPE, count=self._count, offset=HEADER.size)
+
+    def find_match(self, match_id):
+        """Index of the first record of `match_id`, or of the first later match."""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[1] < match_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+def segments(directory):
+    """Segment paths in log order, leaving out any whose range another segment covers."""
+    found = []
+    for name in os.listdir(directory):
+        match = SEGMENT_NAME.match(name)
+        if match:
+            found.append((int(match.group(1)), -int(match.group(2)), name))
+    found.sort()
+    paths, covered = [], 0
+    for first, last, name in found:
+        if -last > covered:
+            paths.append(os.path.join(directory, name))
+            covered = -last
+    return paths
+
+
+_player_cache = {}  # directory -> (bytes parsed, names)
+
+
+def load_players(directory):
+    """Interned player names, indexed by id. Names already read are kept, so later calls parse only new ones."""
+    path = os.path.join(directory, "players")
+    if not os.path.exists(path):
+        return []
+    parsed, names = _player_cache.get(directory, (0, []))
+    if os.path.getsize(path) < parsed:  # a different log now lives here
+        parsed, names = 0, []
+    with open(path, "rb") as players_file:
+        players_file.seek(parsed)
+        data = players_file.read()
+    names, offset = list(names), 0
+    while offset + PLAYER_NAME.size <= len(data):
+        (length,) = PLAYER_NAME.unpack_from(data, offset)
+        if offset + PLAYER_NAME.size + length > len(data):
+            break  # cut short by a crash, or still being written
+        names.append(data[offset + PLAYER_NAME.size:offset + PLAYER_NAME.size + length].decode())
+        offset += PLAYER_NAME.size + length
+    _player_cache[directory] = (parsed + offset, names)
+    return names
+
+
+class ReplayWriter:
+    """
+    Appends whole matches to a log directory; one writer per directory,
+    enforced with a lock file where fcntl exists.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, segment_age=SEGMENT_AGE):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(directory, "lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise RuntimeError(f"Another process is writing the replay log in {directory}")
+        self._names = list(load_players(directory))
+        self._players = {name: player_id for player_id, name in enumerate(self._names)}
+        players_path = os.path.join(directory, "players")
+        self._truncate(players_path, sum(PLAYER_NAME.size + len(name.encode()) for name in self._names))
+        self._players_file = open(players_path, "ab", buffering=0)
+        self._file = None
+        self._number = 0
+        self._base_ms = 0
+        self._size = 0
+        self._next_match = 1
+        self._resume()
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    def _resume(self):
+        paths = segments(self.directory)
+        for path in reversed(paths):
+            with Segment(path) as segment:
+                if len(segment):
+                    self._next_match = segment.record(len(segment) - 1)[1] + 1
+                    break
+        if paths:
+            segment = Segment(paths[-1])
+            self._number = segment.last
+            with segment:
+                base_ms, count = segment.base_ms, len(segment)
+            size = HEADER.size + count * RECORD.size
+            if size < self.segment_bytes and time.time() * 1000 - base_ms < self.segment_age * 1000:
+                self._truncate(paths[-1], size)
+                self._file = open(paths[-1], "ab", buffering=0)
+                self._base_ms, self._size = base_ms, size
+
+    def _rotate(self, now_ms):
+        if self._file is not None:
+            self._file.close()
+        self._number += 1
+        path = os.path.join(self.directory, _segment_name(self._number, self._number))
+        self._file = open(path, "ab", buffering=0)
+        self._base_ms = now_ms
+        self._size = self._file.write(HEADER.pack(MAGIC, now_ms))
+
+    def _player_id(self, name):
+        player_id = self._players.get(name)
+        if player_id is None:
+            encoded = name.encode()
+            # Written before any record that refers to it
+            self._players_file.write(PLAYER_NAME.pack(len(encoded)) + encoded)
+            player_id = self._players[name] = len(self._names)
+            self._names.append(name)
+        return player_id
+
+    def append_match(self, player_a, player_b, moves, rule_set=None, times=None):
+        """Append the (move A, move B) names of every round of one match; returns its match id."""
+        if not moves:
+            return None
+        rule_code = RULE_CODES[(rule_set or rules.CLASSIC).name]
+        codes = protocol.MOVE_CODES
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            data = bytearray(len(moves) * RECORD.size)
+            if (self._file is None or self._size + len(data) > self.segment_bytes
+                    or now_ms - self._base_ms >= self.segment_age * 1000):
+                self._rotate(now_ms)
+            match_id = self._next_match
+            self._next_match += 1
+            id_a, id_b = self._player_id(player_a), self._player_id(player_b)
+            base_ms = self._base_ms
+            for index, (move_a, move_b) in enumerate(moves):
+                offset_ms = int(times[index] * 1000) - base_ms if times else now_ms - base_ms
+                RECORD.pack_into(data, index * RECORD.size, max(0, offset_ms), match_id, id_a, id_b, index + 1,
+                                 codes[move_a] | codes[move_b] << 3, rule_code)
+            self._size += self._file.write(data)
+        return match_id
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._players_file.close()
+            self._lock_file.close()
+
+
+# Readers
+def _decode(segment, record, names):
+    offset_ms, match_id, id_a, id_b, round_number, moves, rule_code = record
+    return ReplayRound((segment.base_ms + offset_ms) / 1000, match_id, names[id_a], names[id_b], round_number,
+                       protocol.MOVES[moves & 7], protocol.MOVES[moves >> 3 & 7], RULE_NAMES[rule_code])
+
+
+def scan(directory):
+    """Every round in the log, decoded one at a time."""
+    names = load_players(directory)
+    for path in segments(directory):
+        with Segment(path) as segment:
+            for record in segment.records():
+                yield _decode(segment, record, names)
+
+
+def find_match(directory, match_id):
+    """The ReplayRounds of one match, located by binary search; empty if it is not in the log."""
+    names = load_players(directory)
+    paths = segments(directory)
+    for path in paths:
+        with Segment(path) as segment:
+            if not len(segment) or segment.record(len(segment) - 1)[1] < match_id:
+                continue
+            rounds = []
+            for record in segment.records(segment.find_match(match_id)):
+                if record[1] != match_id:
+                    break
+                rounds.append(_decode(segment, record, names))
+            return rounds
+    return []
+
+
+def replay(directory, match_id):
+    """Re-score a match round by round from its recorded moves."""
+    rounds = find_match(directory, match_id)
+    replayed, score_a, score_b = [], 0, 0
+    for played in rounds:
+        outcome = rules.RULE_SETS[played.rule_set].evaluate(played.move_a, played.move_b)
+        if outcome == "win":
+            score_a += 1
+        elif outcome == "loss":
+            score_b += 1
+        replayed.append(ReplayedRound(played.round_number, played.move_a, played.move_b, outcome, score_a, score_b))
+    return replayed
+
+
+def move_counts(directory):
+    """
+    Return {(move A, move B): rounds} over the whole log. Only the moves
+    column is read, as one strided slice of each mapping, and counted in C.
+    """
+    counts = {}
+    pairs = [(a | b << 3, (protocol.MOVES[a], protocol.MOVES[b]))
+             for a in range(len(protocol.MOVES)) for b in range(len(protocol.MOVES))]
+    for path in segments(directory):
+        with Segment(path) as segment:
+            column = segment.column(MOVES_OFFSET)
+            for code, pair in pairs:
+                found = column.count(code)
+                if found:
+                    counts[pair] = counts.get(pair, 0) + found
+    return counts
+
+
+# Compaction
+def compact(directory, target_bytes=SEGMENT_BYTES, max_age=None, now=None):
+    """
+    Delete sealed segments whose newest round is older than `max_age`
+    seconds, then merge runs of consecutive sealed segments into segments of
+    up to `target_bytes`. The newest segment is left alone, since a writer
+    may be appending to it. Returns (segments removed, segments written).
+    """
+    now_ms = int((now if now is not None else time.time()) * 1000)
+    sealed = segments(directory)[:-1]
+    removed = written = 0
+    kept = []
+    for path in sealed:
+        with Segment(path) as segment:
+            newest_ms = segment.base_ms + (segment.record(len(segment) - 1)[0] if len(segment) else 0)
+            size = HEADER.size + len(segment) * RECORD.size
+            base_ms = segment.base_ms
+        if max_age is not None and now_ms - newest_ms > max_age * 1000:
+            os.remove(path)
+            removed += 1
+        else:
+            kept.append((path, base_ms, newest_ms, size))
+
+    run = []
+    for entry in kept + [None]:
+        if entry is not None and run:
+            path, base_ms, newest_ms, size = entry
+            total = sum(item[3] - HEADER.size for item in run) + size
+            if total <= target_bytes and newest_ms - run[0][1] < SEGMENT_AGE * 1000:
+                run.append(entry)
+                continue
+        if len(run) > 1:
+            _merge(directory, run)
+            removed += len(run)
+            written += 1
+        run = [entry] if entry is not None else []
+    return removed, written
+
+
+def _merge(directory, run):
+    first = Segment(run[0][0]).first
+    last = Segment(run[-1][0]).last
+    path = os.path.join(directory, _segment_name(first, last))
+    base_ms = run[0][1]
+    with open(path + ".tmp", "wb") as out:
+        out.write(HEADER.pack(MAGIC, base_ms))
+        for source, segment_base_ms, _, _ in run:
+            with Segment(source) as segment:
+                shift = segment_base_ms - base_ms
+                if not shift:
+                    out.write(segment.data())
+                    continue
+                data = bytearray(len(segment) * RECORD.size)
+                for index, record in enumerate(segment.records()):
+                    RECORD.pack_into(data, index * RECORD.size, record[0] + shift, *record[1:])
+                out.write(data)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(path + ".tmp", path)
+    for source, _, _, _ in run:
+        if source != path:
+            os.remove(source)
+
+
+# Hooks for game_results; nothing is logged until configure() is called
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure(directory, **options):
+    """Start logging rounds to `directory`, closing any previous writer."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+        _writer = ReplayWriter(directory, **options) if directory else None
+    return _writer
+
+
+def record_match(player_a, player_b, moves, rule_set=None, times=None):
+    if _writer is not None:
+        return _writer.append_match(player_a, player_b, moves, rule_set, times)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain a replay log.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats = commands.add_parser("stats", help="Rounds, matches and move frequencies")
+    stats.add_argument("directory")
+    show = commands.add_parser("replay", help="Replay one match round by round")
+    show.add_argument("directory")
+    show.add_argument("match_id", type=int)
+    maintain = commands.add_parser("compact", help="Apply the retention and merge policy")
+    maintain.add_argument("directory")
+    maintain.add_argument("--max-age-days", type=float, help="Delete rounds older than this")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        paths = segments(args.directory)
+        rounds = matches = 0
+        for path in paths:
+            with Segment(path) as segment:
+                rounds += len(segment)
+                if len(segment):
+                    matches = segment.record(len(segment) - 1)[1]
+        print(f"{len(paths)} segments, {rounds} rounds, {matches} matches, {len(load_players(args.directory))} players")
+        for (move_a, move_b), count in sorted(move_counts(args.directory).items(), key=lambda item: -item[1]):
+            print(f"  {move_a:>8} vs {move_b:<8} {count}")
+    elif args.command == "replay":
+        for played in replay(args.directory, args.match_id):
+            print(f"round {played.round_number}: {played.move_a} vs {played.move_b}, {played.outcome}, "
+                  f"{played.score_a}-{played.score_b}")
+    else:
+        max_age = args.max_age_days * 86400 if args.max_age_days is not None else None
+        removed, written = compact(args.directory, max_age=max_age)
+        print(f"Removed {removed} segments, wrote {written}.")
+
+
+if __name__ == "__main__":
+    main()
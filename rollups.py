@@ -0,0 +1,163 @@
+"""
+Time-windowed player statistics from the hourly and daily rollup tables.
+
+The games_rollup trigger (migration 5) adds every recorded round to both
+players' stats_hourly and stats_daily rows, so a window is answered by
+summing whole days from stats_daily plus the partial days at either end
+from stats_hourly: at most 46 hourly rows plus one row per day, however
+many games were played. Windows have hour resolution and periods are UTC.
+
+backfill() rebuilds both tables from the games table in chunks, for
+databases that predate the rollups or to repair them.
+"""
+import argparse
+import logging
+import time
+from collections import namedtuple
+
+import database
+import migrations
+import write_behind
+
+HOUR = 3600
+DAY = 24 * HOUR
+BACKFILL_CHUNK = 20000
+
+WindowStats = namedtuple("WindowStats", "games wins losses ties")
+
+WINDOW_SQL = """
+    SELECT COALESCE(SUM(games), 0), COALESCE(SUM(wins), 0), COALESCE(SUM(losses), 0), COALESCE(SUM(ties), 0)
+    FROM (
+        SELECT games, wins, losses, ties FROM stats_daily WHERE username = ? AND day >= ? AND day < ?
+        UNION ALL
+        SELECT games, wins, losses, ties FROM stats_hourly WHERE username = ? AND hour >= ? AND hour < ?
+        UNION ALL
+        SELECT games, wins, losses, ties FROM stats_hourly WHERE username = ? AND hour >= ? AND hour < ?
+    )
+"""
+
+# Folded into the 24 hours of the day in Python, which saves SQLite a
+# temporary B-tree for the GROUP BY
+HOURLY_SQL = """
+    SELECT hour, games, wins, losses, ties FROM stats_hourly
+    WHERE username = ? AND hour >= ? AND hour < ?
+"""
+
+BACKFILL_CHUNK_SQL = """
+    SELECT id, player1, player2, winner, CAST(strftime('%s', timestamp) AS INTEGER) / 3600
+    FROM games WHERE id > ? AND id <= ? ORDER BY id LIMIT ?
+"""
+
+UPSERT_SQL = """
+    INSERT INTO {table} (username, {period}, games, wins, losses, ties) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (username, {period}) DO UPDATE SET games = games + excluded.games, wins = wins + excluded.wins,
+        losses = losses + excluded.losses, ties = ties + excluded.ties
+"""
+UPSERT_HOURLY_SQL = UPSERT_SQL.format(table="stats_hourly", period="hour")
+UPSERT_DAILY_SQL = UPSERT_SQL.format(table="stats_daily", period="day")
+
+
+def window(username, start, end=None):
+    """WindowStats for `username` over [start, end), in Unix seconds rounded out to whole hours."""
+    if end is None:
+        end = time.time()
+    first_hour, end_hour = int(start) // HOUR, -(-int(end) // HOUR)
+    first_day, end_day = -(-first_hour // 24), end_hour // 24
+    if first_day >= end_day:
+        # No whole day inside the window: hours only
+        params = (username, 0, 0, username, first_hour, end_hour, username, 0, 0)
+    else:
+        params = (username, first_day, end_day,
+                  username, first_hour, first_day * 24,
+                  username, end_day * 24, end_hour)
+    write_behind.flush()
+    return WindowStats(*database.fetch_one(WINDOW_SQL, params, label="window"))
+
+
+def last_days(username, days=7):
+    return window(username, time.time() - days * DAY)
+
+
+def by_hour_of_day(username, start=0, end=None):
+    """{UTC hour of day: WindowStats} over [start, end), for hours with games."""
+    if end is None:
+        end = time.time()
+    write_behind.flush()
+    totals = {}
+    for hour, *counts in database.fetch_all(HOURLY_SQL, (username, int(start) // HOUR, -(-int(end) // HOUR)),
+                                           label="by_hour_of_day"):
+        total = totals.setdefault(hour % 24, [0, 0, 0, 0])
+        for i, count in enumerate(counts):
+            total[i] += count
+    return {hour: WindowStats(*total) for hour, total in sorted(totals.items())}
+
+
+def _add(totals, key, wins, losses, ties):
+    counts = totals.get(key)
+    if counts is None:
+        totals[key] = [1, wins, losses, ties]
+    else:
+        counts[0] += 1
+        counts[1] += wins
+        counts[2] += losses
+        counts[3] += ties
+
+
+def backfill(chunk_size=BACKFILL_CHUNK):
+    """
+    Rebuild stats_hourly and stats_daily from games and return the number of
+    rounds rolled up.
+
+    The tables are emptied and the last game id noted in one transaction;
+    games recorded after that are rolled up by the trigger as usual, while
+    everything up to that id is read back in chunks of `chunk_size` rows,
+    aggregated in memory and upserted in one transaction per chunk. Windows
+    read during a backfill undercount until it is done.
+    """
+    write_behind.flush()
+    with database.transaction(label="backfill") as conn:
+        # Deleting first takes the write lock, so no game can slip in between
+        conn.execute("DELETE FROM stats_hourly")
+        conn.execute("DELETE FROM stats_daily")
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM games").fetchone()[0]
+
+    position, rolled_up = 0, 0
+    while position < last_id:
+        with database.transaction(label="backfill") as conn:
+            rows = conn.execute(BACKFILL_CHUNK_SQL, (position, last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            hourly = {}
+            for _, player1, player2, winner, hour in rows:
+                tie = winner is None
+                _add(hourly, (player1, hour), winner == player1, winner == player2, tie)
+                _add(hourly, (player2, hour), winner == player2, winner == player1, tie)
+            daily = {}
+            for (username, hour), (games, wins, losses, ties) in hourly.items():
+                counts = daily.setdefault((username, hour // 24), [0, 0, 0, 0])
+                counts[0] += games
+                counts[1] += wins
+                counts[2] += losses
+                counts[3] += ties
+            conn.executemany(UPSERT_HOURLY_SQL, [key + tuple(counts) for key, counts in hourly.items()])
+            conn.executemany(UPSERT_DAILY_SQL, [key + tuple(counts) for key, counts in daily.items()])
+        position = rows[-1][0]
+        rolled_up += len(rows)
+        logging.info("Rolled up games up to id %d of %d.", position, last_id)
+    return rolled_up
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the per-user stats rollups.")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    migrations.migrate()
+    rounds = backfill(args.chunk_size)
+    logging.info("Backfill finished: %d rounds rolled up.", rounds)
+
+
+if __name__ == "__main__":
+    main()
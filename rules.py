@@ -0,0 +1,90 @@
+"""
+Table-driven outcome engine.
+
+Moves are small integers and every rule set precomputes an n x n payoff
+matrix, so deciding a round is one table lookup. A new game variant is just
+another RuleSet with its own list of moves and who beats whom.
+"""
+try:
+    import numpy
+except ImportError:  # the batch API falls back to plain Python
+    numpy = None
+
+# Outcome codes from the point of view of the first player
+LOSS, TIE, WIN = -1, 0, 1
+OUTCOME_NAMES = {WIN: "win", LOSS: "loss", TIE: "tie"}
+
+
+class RuleSet:
+    def __init__(self, name, moves, beats):
+        """
+        `moves` lists move names in code order and `beats` maps each move to
+        the moves it defeats. Any pair not mentioned either way is a tie.
+        """
+        self.name = name
+        self.moves = tuple(moves)
+        self.codes = {move: code for code, move in enumerate(self.moves)}
+        size = len(self.moves)
+        self.payoff = [[TIE] * size for _ in range(size)]
+        for winner, losers in beats.items():
+            for loser in losers:
+                self.payoff[self.codes[winner]][self.codes[loser]] = WIN
+                self.payoff[self.codes[loser]][self.codes[winner]] = LOSS
+        self._flat = [outcome for row in self.payoff for outcome in row]
+        self._matrix = numpy.array(self.payoff, dtype=numpy.int8) if numpy is not None else None
+
+    def __len__(self):
+        return len(self.moves)
+
+    def outcome(self, move_a, move_b):
+        """Outcome code for two integer moves."""
+        return self.payoff[move_a][move_b]
+
+    def evaluate(self, move_a, move_b):
+        """'win', 'loss' or 'tie' for player A, given move names."""
+        return OUTCOME_NAMES[self.payoff[self.codes[move_a]][self.codes[move_b]]]
+
+    def counter_to(self, move):
+        """Return a move code that beats `move`."""
+        for code in range(len(self.moves)):
+            if self.payoff[code][move] == WIN:
+                return code
+        return move
+
+    def outcome_batch(self, moves_a, moves_b):
+        """
+        Score many rounds at once. With NumPy the inputs may be any integer
+        arrays and the result is an int8 array computed in a single fancy
+        index into the payoff matrix; without it, lists in and lists out.
+        """
+        if self._matrix is not None:
+            return self._matrix[numpy.asarray(moves_a), numpy.asarray(moves_b)]
+        size, flat = len(self.moves), self._flat
+        return [flat[a * size + b] for a, b in zip(moves_a, moves_b)]
+
+    def tally(self, moves_a, moves_b):
+        """Return (wins, losses, ties) for player A over a batch of rounds."""
+        outcomes = self.outcome_batch(moves_a, moves_b)
+        if self._matrix is not None:
+            counts = numpy.bincount(outcomes.astype(numpy.int64) + 1, minlength=3)
+            return int(counts[2]), int(counts[0]), int(counts[1])
+        return outcomes.count(WIN), outcomes.count(LOSS), outcomes.count(TIE)
+
+
+CLASSIC = RuleSet("classic", ("rock", "paper", "scissors"), {
+    "rock": ("scissors",),
+    "paper": ("rock",),
+    "scissors": ("paper",),
+})
+
+# Extends the classic moves without renumbering them, so classic clients and
+# the wire protocol keep the same move codes.
+LIZARD_SPOCK = RuleSet("lizard-spock", ("rock", "paper", "scissors", "lizard", "spock"), {
+    "rock": ("scissors", "lizard"),
+    "paper": ("rock", "spock"),
+    "scissors": ("paper", "lizard"),
+    "lizard": ("paper", "spock"),
+    "spock": ("rock", "scissors"),
+})
+
+RULE_SETS = {rule_set.name: rule_set for rule_set in (CLASSIC, LIZARD_SPOCK)}
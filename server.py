@@ -0,0 +1,139 @@
+"""
+Command line entry point for dedicated, headless deployments.
+
+    python server.py all            # game server, matchmaking, notifications and logins
+    python server.py game --best-of 5
+    python server.py game --workers 4   # matches spread over 4 processes (cluster.py)
+    python server.py udp            # the game server over reliable UDP (reliable_udp.py)
+    python server.py matchmaking --fifo
+    python server.py login          # checks passwords and issues session tokens (credentials.py)
+    python server.py gui            # the guizero client, imported only here
+
+Every command except gui also serves Prometheus metrics and profiles on
+--metrics-port (see metrics_server.py); pass --metrics-port 0 to turn that off.
+
+Nothing in this module imports guizero unless the gui command is used.
+"""
+import argparse
+import asyncio
+import logging
+import runpy
+
+import database
+import migrations
+import replay_log
+import rules
+import write_behind
+
+
+def build_game_server(args):
+    if args.workers != 1:
+        from cluster import ClusterFront
+        return ClusterFront(args.host, args.game_port, workers=args.workers or None, record_results=not args.no_record,
+                            best_of=args.best_of or None, rule_set=rules.RULE_SETS[args.rules],
+                            db_path=args.db, durability=args.durability, replay_dir=args.replay_dir,
+                            require_commit=args.require_commit)
+    from game_server import GameServer
+    return GameServer(args.host, args.game_port, record_results=not args.no_record,
+                      best_of=args.best_of or None, rule_set=rules.RULE_SETS[args.rules],
+                      require_commit=args.require_commit)
+
+
+def build_udp_game_server(args):
+    from reliable_udp import UdpGameServer
+    return UdpGameServer(args.host, args.udp_port, record_results=not args.no_record,
+                         best_of=args.best_of or None, rule_set=rules.RULE_SETS[args.rules],
+                         require_commit=args.require_commit)
+
+
+def build_matchmaking(args):
+    import matchmaking
+    if args.fifo:
+        return matchmaking.MatchmakingService(args.host, args.matchmaking_port)
+    return matchmaking.MatchmakingService(args.host, args.matchmaking_port,
+                                          waiting_queue=matchmaking.RatingQueue(),
+                                          rating_of=matchmaking.player_rating)
+
+
+def build_notifications(args):
+    from notifications import NotificationService
+    return NotificationService(args.host, args.notify_port)
+
+
+def build_login(args):
+    from credentials import LoginService
+    return LoginService(args.host, args.login_port)
+
+
+SERVICES = {
+    "game": [build_game_server],
+    "udp": [build_udp_game_server],
+    "matchmaking": [build_matchmaking],
+    "notifications": [build_notifications],
+    "login": [build_login],
+    "all": [build_game_server, build_matchmaking, build_notifications, build_login],
+}
+
+
+async def run_services(services):
+    await asyncio.gather(*(service.serve_forever() for service in services))
+
+
+def parse_args(argv=None):
+    from credentials import LOGIN_PORT
+    from game_server import PORT
+    from matchmaking import MM_PORT
+    from metrics_server import METRICS_PORT
+    from notifications import NOTIFY_PORT
+    from reliable_udp import UDP_PORT
+
+    parser = argparse.ArgumentParser(description="Run Rock, Paper, Scissors servers without a GUI.")
+    parser.add_argument("command", choices=sorted(SERVICES) + ["gui"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--game-port", type=int, default=PORT)
+    parser.add_argument("--udp-port", type=int, default=UDP_PORT)
+    parser.add_argument("--matchmaking-port", type=int, default=MM_PORT)
+    parser.add_argument("--notify-port", type=int, default=NOTIFY_PORT)
+    parser.add_argument("--login-port", type=int, default=LOGIN_PORT)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="0 disables the endpoint")
+    parser.add_argument("--db", default=database.DB_PATH, help="SQLite database file")
+    parser.add_argument("--replay-dir", help="Append every round to a replay log here (see replay_log.py)")
+    parser.add_argument("--durability", choices=sorted(write_behind.DURABILITY_LEVELS), default="normal")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Game server processes (see cluster.py), 0 for one per core")
+    parser.add_argument("--best-of", type=int, default=1, help="Rounds per session, 0 for unlimited")
+    parser.add_argument("--rules", choices=sorted(rules.RULE_SETS), default=rules.CLASSIC.name)
+    parser.add_argument("--require-commit", action="store_true",
+                        help="Reject moves sent without commit-reveal (see commitments.py)")
+    parser.add_argument("--fifo", action="store_true", help="Pair in arrival order instead of by rating")
+    parser.add_argument("--no-record", action="store_true", help="Do not write results to the database")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "gui":
+        runpy.run_module("main", run_name="__main__")
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    database.configure(args.db)
+    write_behind.configure(path=args.db, durability=args.durability)
+    migrations.migrate()
+    if args.replay_dir and args.workers == 1:
+        replay_log.configure(args.replay_dir)
+
+    services = [build(args) for build in SERVICES[args.command]]
+    if args.metrics_port:
+        from metrics_server import MetricsServer
+        services.append(MetricsServer(args.host, args.metrics_port))
+    try:
+        asyncio.run(run_services(services))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        write_behind.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Session tokens and a cache of logged-in players' profiles.
+
+After a successful password check the login service (credentials.py)
+issues the client a token
+
+    <base64 username>.<expiry as unix time>.<base64 HMAC-SHA256 signature>
+
+which the matchmaking and notification services accept instead of a bare
+username. Checking a token is an HMAC and a clock comparison, with no
+database read and no KDF. Every server process that issues or checks
+tokens must share the signing key, which clients never load:
+RPS_SESSION_SECRET (hex) if set, otherwise a random key kept in SECRET_PATH
+next to the database.
+
+Profiles (the users row without the password) are served from an LRU cache
+that the score-changing helpers invalidate through invalidate_profile().
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import database
+import write_behind
+
+SESSION_TTL = 12 * 3600  # seconds
+SECRET_PATH = "session.key"
+SECRET_BYTES = 32
+PROFILE_CACHE_SIZE = 1024
+
+PROFILE_SQL = "SELECT username, games_played, wins, losses, ties, score FROM users WHERE username = ?"
+
+Profile = namedtuple("Profile", "username games_played wins losses ties score")
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def load_secret(path=SECRET_PATH):
+    secret = os.environ.get("RPS_SESSION_SECRET")
+    if secret:
+        return bytes.fromhex(secret)
+    try:
+        with open(path, "rb") as key_file:
+            return key_file.read()
+    except FileNotFoundError:
+        pass
+    secret = os.urandom(SECRET_BYTES)
+    try:
+        # O_EXCL: if another process created the key first, use theirs
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as key_file:
+            return key_file.read()
+    with os.fdopen(fd, "wb") as key_file:
+        key_file.write(secret)
+    return secret
+
+
+class TokenSigner:
+    def __init__(self, secret, ttl=SESSION_TTL):
+        self.secret = secret
+        self.ttl = ttl
+
+    def _sign(self, message):
+        return hmac.new(self.secret, message.encode(), hashlib.sha256).digest()
+
+    def issue(self, username, now=None):
+        expires = int((now or time.time()) + self.ttl)
+        message = f"{_b64(username.encode())}.{expires}"
+        return f"{message}.{_b64(self._sign(message))}"
+
+    def validate(self, token, now=None):
+        """Return the token's username, or None if it is forged, malformed or expired."""
+        try:
+            encoded_name, expires, signature = token.split(".")
+            if not hmac.compare_digest(self._sign(f"{encoded_name}.{expires}"), _unb64(signature)):
+                return None
+            if int(expires) < (now or time.time()):
+                return None
+            return _unb64(encoded_name).decode()
+        except ValueError:  # also covers binascii and Unicode errors
+            return None
+
+
+class ProfileCache:
+    """LRU cache of Profile rows, at most `max_size` of them."""
+
+    def __init__(self, max_size=PROFILE_CACHE_SIZE):
+        self.max_size = max_size
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, username):
+        """The player's Profile, or None for an unknown player."""
+        with self._lock:
+            profile = self._profiles.get(username)
+            if profile is not None:
+                self._profiles.move_to_end(username)
+                self.hits += 1
+                return profile
+            self.misses += 1
+            invalidations = self._invalidations
+        # Queued stat updates must land before the row is read
+        write_behind.flush()
+        row = database.fetch_one(PROFILE_SQL, (username,), label="profile")
+        if row is None:
+            return None
+        profile = Profile(*row)
+        with self._lock:
+            if invalidations != self._invalidations:
+                # Stats changed while we were reading; don't cache what may be stale
+                return profile
+            self._profiles[username] = profile
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate(self, username):
+        with self._lock:
+            self._invalidations += 1
+            self._profiles.pop(username, None)
+
+
+_signer = None
+_profiles = None
+_lock = threading.Lock()
+
+
+def configure(secret=None, ttl=SESSION_TTL, profile_cache_size=PROFILE_CACHE_SIZE):
+    """Replace the shared signer and profile cache; `secret` defaults to load_secret()."""
+    global _signer, _profiles
+    with _lock:
+        _signer = TokenSigner(secret if secret is not None else load_secret(), ttl)
+        _profiles = ProfileCache(profile_cache_size)
+
+
+def get_signer():
+    global _signer
+    if _signer is None:
+        with _lock:
+            if _signer is None:
+                _signer = TokenSigner(load_secret())
+    return _signer
+
+
+def get_profiles():
+    global _profiles
+    if _profiles is None:
+        with _lock:
+            if _profiles is None:
+                _profiles = ProfileCache()
+    return _profiles
+
+
+def issue(username):
+    return get_signer().issue(username)
+
+
+def validate(token):
+    return get_signer().validate(token)
+
+
+def profile(username):
+    return get_profiles().get(username)
+
+
+# Hook for the score-changing helpers, like leaderboard.record_delta
+def invalidate_profile(username):
+    if _profiles is not None:
+        _profiles.invalidate(username)
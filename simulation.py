@@ -0,0 +1,97 @@
+"""
+Bot-vs-bot simulation on a process pool.
+
+Every matchup is cut into chunks of rounds, each played by a fresh pair of
+bots in a worker process. A chunk writes its (wins, losses, ties) into its
+own slot of a shared-memory array, so workers never contend for a lock and
+nothing but the slot number travels back through the pool's pipes. The
+parent sums the slots per matchup once the pool is done.
+"""
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import time
+from multiprocessing.sharedctypes import RawArray
+
+import bots
+import rules
+
+CHUNK_ROUNDS = 50000
+
+_counts = None
+
+
+def _init_worker(counts):
+    global _counts
+    _counts = counts
+
+
+def _run_chunk(slot, strategy_a, strategy_b, rule_set_name, rounds, seed):
+    rule_set = rules.RULE_SETS[rule_set_name]
+    bot_a = bots.STRATEGIES[strategy_a](rule_set, random.Random(f"{seed}:a"))
+    bot_b = bots.STRATEGIES[strategy_b](rule_set, random.Random(f"{seed}:b"))
+    _counts[slot * 3:slot * 3 + 3] = bots.play_rounds(bot_a, bot_b, rounds)
+    return slot
+
+
+def simulate(matchups, rounds, workers=None, rule_set=rules.CLASSIC, chunk_rounds=CHUNK_ROUNDS, seed=0):
+    """
+    Play `rounds` rounds of every (strategy_a, strategy_b) matchup and return
+    {matchup: (wins, losses, ties)} from strategy_a's point of view.
+    """
+    matchups = list(matchups)
+    tasks = []
+    for index, (strategy_a, strategy_b) in enumerate(matchups):
+        for start in range(0, rounds, chunk_rounds):
+            tasks.append((len(tasks), strategy_a, strategy_b, rule_set.name,
+                          min(chunk_rounds, rounds - start), f"{seed}:{index}:{start}"))
+
+    counts = RawArray("q", len(tasks) * 3)
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        _init_worker(counts)
+        for task in tasks:
+            _run_chunk(*task)
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(counts,)) as pool:
+            pool.starmap(_run_chunk, tasks, chunksize=1)
+
+    totals = {matchup: [0, 0, 0] for matchup in matchups}
+    for slot, strategy_a, strategy_b, *_ in tasks:
+        total = totals[strategy_a, strategy_b]
+        for i in range(3):
+            total[i] += counts[slot * 3 + i]
+    return {matchup: tuple(total) for matchup, total in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate Rock, Paper, Scissors bot strategies against each other.")
+    parser.add_argument("strategies", nargs="*", metavar="strategy",
+                        help=f"Strategies to play against each other: {', '.join(sorted(bots.STRATEGIES))} (default: all)")
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="Rounds per matchup")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--rules", choices=sorted(rules.RULE_SETS), default=rules.CLASSIC.name)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    strategies = args.strategies or sorted(bots.STRATEGIES)
+    unknown = sorted(set(strategies) - set(bots.STRATEGIES))
+    if unknown:
+        parser.error(f"unknown strategies: {', '.join(unknown)} (choose from {', '.join(sorted(bots.STRATEGIES))})")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    matchups = list(itertools.combinations(strategies, 2))
+    start = time.perf_counter()
+    results = simulate(matchups, args.rounds, args.workers, rules.RULE_SETS[args.rules], seed=args.seed)
+    elapsed = time.perf_counter() - start
+    for (strategy_a, strategy_b), (wins, losses, ties) in results.items():
+        print(f"{strategy_a:>10} vs {strategy_b:<10} {wins / args.rounds:6.1%} won  {losses / args.rounds:6.1%} lost"
+              f"  {ties / args.rounds:6.1%} tied")
+    logging.info("%d rounds in %.2fs on %d worker(s): %.0f rounds/sec.", len(matchups) * args.rounds, elapsed,
+                 args.workers, len(matchups) * args.rounds / elapsed)
+
+
+if __name__ == "__main__":
+    main()
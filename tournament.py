@@ -0,0 +1,474 @@
+"""
+Tournament engine: round-robin, single elimination, double elimination and
+Swiss.
+
+A tournament is played round by round. Each round's pairings are cut into
+chunks and played on a worker pool, and every chunk's results are folded
+into the in-memory standings as soon as it completes, so standings are never
+re-queried from the database. Once a round is done its games and the
+players' statistics are handed to the write-behind queue as one bulk entry
+per statement.
+"""
+import argparse
+import logging
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import database
+import game_results
+import leaderboard
+import migrations
+import rules
+import sessions
+import write_behind
+
+CHUNK_SIZE = 256
+MAX_MATCH_ROUNDS = 100  # a match still undecided after this many rounds is a draw
+SWISS_LOOKAHEAD = 8  # how far down the table Swiss pairing looks to avoid a rematch
+
+POINTS = {"win": 1.0, "tie": 0.5, "loss": 0.0}
+
+INSERT_TOURNAMENT_SQL = "INSERT INTO tournaments (name, format, players) VALUES (?, ?, ?)"
+FINISH_TOURNAMENT_SQL = "UPDATE tournaments SET winner = ?, finished = CURRENT_TIMESTAMP WHERE id = ?"
+INSERT_TOURNAMENT_GAME_SQL = "INSERT INTO games (player1, player2, winner, tournament_id) VALUES (?, ?, ?, ?)"
+
+
+# Matches
+
+def play_random_match(player_a, player_b, rule_set, best_of, rng):
+    """
+    Play one match between two players who pick moves at random and return
+    the round outcomes ('win', 'loss' or 'tie') for player_a. Like a
+    MatchSession, ties do not count towards the best_of target.
+    """
+    size = len(rule_set)
+    payoff = rule_set.payoff
+    needed = best_of // 2 + 1
+    outcomes = []
+    wins = losses = 0
+    while wins < needed and losses < needed and len(outcomes) < MAX_MATCH_ROUNDS:
+        outcome = payoff[rng.randrange(size)][rng.randrange(size)]
+        if outcome == rules.WIN:
+            wins += 1
+        elif outcome == rules.LOSS:
+            losses += 1
+        outcomes.append(rules.OUTCOME_NAMES[outcome])
+    return outcomes
+
+
+def _play_chunk(match_function, rule_set_name, best_of, seed, pairs):
+    # Runs in a worker process: everything it needs arrives as plain arguments
+    rule_set = rules.RULE_SETS[rule_set_name]
+    rng = random.Random(seed)
+    return [match_function(a, b, rule_set, best_of, rng) for a, b in pairs]
+
+
+def match_winner(player_a, player_b, outcomes):
+    wins, losses = outcomes.count("win"), outcomes.count("loss")
+    if wins == losses:
+        return None
+    return player_a if wins > losses else player_b
+
+
+# Standings
+
+class Standings:
+    """
+    Points and records for every player, updated one result at a time.
+
+    A win or a bye is worth one point and a drawn match half a point each.
+    Players are also grouped by points so Swiss pairing can walk the table
+    without sorting everyone.
+    """
+
+    def __init__(self, players):
+        self.seeds = {player: seed for seed, player in enumerate(players)}
+        self.points = dict.fromkeys(players, 0.0)
+        self.wins = dict.fromkeys(players, 0)
+        self.losses = dict.fromkeys(players, 0)
+        self.draws = dict.fromkeys(players, 0)
+        self.opponents = {player: [] for player in players}
+        self.byes = set()
+        self.groups = {0.0: set(players)}
+
+    def __len__(self):
+        return len(self.points)
+
+    def _award(self, player, points):
+        if not points:
+            return
+        old = self.points[player]
+        group = self.groups[old]
+        group.discard(player)
+        if not group:
+            del self.groups[old]
+        self.points[player] = old + points
+        self.groups.setdefault(old + points, set()).add(player)
+
+    def record(self, player_a, player_b, winner):
+        self.opponents[player_a].append(player_b)
+        self.opponents[player_b].append(player_a)
+        if winner is None:
+            self.draws[player_a] += 1
+            self.draws[player_b] += 1
+            self._award(player_a, POINTS["tie"])
+            self._award(player_b, POINTS["tie"])
+        else:
+            loser = player_b if winner == player_a else player_a
+            self.wins[winner] += 1
+            self.losses[loser] += 1
+            self._award(winner, POINTS["win"])
+
+    def record_bye(self, player):
+        self.byes.add(player)
+        self._award(player, POINTS["win"])
+
+    def ordered(self):
+        """Players by points, then seed. No tie-breaks, cheap enough to pair with."""
+        order = []
+        for points in sorted(self.groups, reverse=True):
+            order.extend(sorted(self.groups[points], key=self.seeds.__getitem__))
+        return order
+
+    def buchholz(self, player):
+        """Sum of the opponents' points, the usual first tie-break."""
+        return sum(self.points[opponent] for opponent in self.opponents[player])
+
+    def table(self, count=None):
+        """Return [(rank, player, points, wins, losses, draws)] with tie-breaks applied."""
+        order = sorted(self.points, key=lambda p: (-self.points[p], -self.buchholz(p), self.seeds[p]))
+        return [(rank, player, self.points[player], self.wins[player], self.losses[player], self.draws[player])
+                for rank, player in enumerate(order[:count], 1)]
+
+
+# Formats
+#
+# A format hands out one round of pairings at a time from next_round(), as
+# ([(player_a, player_b)], [player with a bye]), or None once the event is
+# over, and hears back about every decided match through round_complete().
+
+class RoundRobin:
+    name = "round-robin"
+    allows_draws = True
+
+    def __init__(self, players, standings, rounds=None):
+        # Circle method: the first player stays put while the others rotate
+        self.lineup = list(players) + ([None] if len(players) % 2 else [])
+        full = len(self.lineup) - 1 if len(players) > 1 else 0
+        self.rounds = full if rounds is None else min(rounds, full)
+        self.played = 0
+
+    def next_round(self, standings):
+        if self.played >= self.rounds:
+            return None
+        fixed, others = self.lineup[0], self.lineup[1:]
+        shift = self.played % len(others)
+        lineup = [fixed] + others[len(others) - shift:] + others[:len(others) - shift]
+        half = len(lineup) // 2
+        pairs, byes = [], []
+        for a, b in zip(lineup[:half], reversed(lineup[half:])):
+            if a is None or b is None:
+                byes.append(b if a is None else a)
+            else:
+                pairs.append((a, b))
+        self.played += 1
+        return pairs, byes
+
+    def round_complete(self, results):
+        pass
+
+    def winner(self, standings):
+        return standings.table(1)[0][1]
+
+
+def _bracket_order(size):
+    """Slot order that keeps the top seeds apart until the late rounds."""
+    order = [0]
+    while len(order) < size:
+        mirror = len(order) * 2 - 1
+        order = [slot for seed in order for slot in (seed, mirror - seed)]
+    return order
+
+
+class SingleElimination:
+    name = "single-elimination"
+    allows_draws = False
+
+    def __init__(self, players, standings, rounds=None):
+        size = 1 << max(0, len(players) - 1).bit_length()
+        # Empty slots become first round byes for the top seeds
+        self.bracket = [players[seed] if seed < len(players) else None for seed in _bracket_order(size)]
+
+    def next_round(self, standings):
+        if len(self.bracket) <= 1:
+            return None
+        pairs, byes = [], []
+        advancing = []
+        for a, b in zip(self.bracket[::2], self.bracket[1::2]):
+            if a is None or b is None:
+                bye = b if a is None else a
+                if bye is not None:
+                    byes.append(bye)
+                advancing.append(bye)
+            else:
+                pairs.append((a, b))
+                advancing.append((a, b))
+        self.bracket = advancing
+        return pairs, byes
+
+    def round_complete(self, results):
+        winners = {(a, b): winner for a, b, winner in results}
+        self.bracket = [winners[slot] if isinstance(slot, tuple) else slot for slot in self.bracket]
+
+    def winner(self, standings):
+        return self.bracket[0] if self.bracket else None
+
+
+class DoubleElimination:
+    """
+    Players are out after their second loss. Each round pairs the unbeaten
+    players with each other and the once-beaten players with each other;
+    the grand final is the last unbeaten player against the last one-loss
+    player, replayed once if the one-loss player wins it.
+    """
+
+    name = "double-elimination"
+    allows_draws = False
+
+    def __init__(self, players, standings, rounds=None):
+        self.winners = list(players)
+        self.losers = []
+        self.byes = set()
+
+    def _pair(self, bracket):
+        pairs = [(a, b) for a, b in zip(bracket[::2], bracket[1::2])]
+        byes = []
+        if len(bracket) % 2:
+            # Give the bye to the lowest placed player who has not had one yet
+            for index in range(len(bracket) - 1, -1, -1):
+                if bracket[index] not in self.byes:
+                    break
+            else:
+                index = len(bracket) - 1
+            bye = bracket[index]
+            rest = bracket[:index] + bracket[index + 1:]
+            pairs = [(a, b) for a, b in zip(rest[::2], rest[1::2])]
+            byes.append(bye)
+            self.byes.add(bye)
+        return pairs, byes
+
+    def next_round(self, standings):
+        if len(self.winners) + len(self.losers) <= 1:
+            return None
+        if len(self.winners) == 1 and len(self.losers) == 1:
+            return [(self.winners[0], self.losers[0])], []
+        pairs, byes = self._pair(self.winners)
+        loser_pairs, loser_byes = self._pair(self.losers)
+        return pairs + loser_pairs, byes + loser_byes
+
+    def round_complete(self, results):
+        unbeaten = set(self.winners)
+        dropped, eliminated = [], set()
+        for a, b, winner in results:
+            loser = b if winner == a else a
+            # Losing the grand final as the unbeaten player also just drops
+            # them into the losers bracket, which sets up the replay
+            if loser in unbeaten:
+                dropped.append(loser)
+            else:
+                eliminated.add(loser)
+        dropped_set = set(dropped)
+        self.winners = [p for p in self.winners if p not in dropped_set]
+        self.losers = [p for p in self.losers if p not in eliminated] + dropped
+
+    def winner(self, standings):
+        remaining = self.winners + self.losers
+        return remaining[0] if len(remaining) == 1 else None
+
+
+class Swiss:
+    """
+    A fixed number of rounds, by default enough to single out a winner
+    (ceil(log2(players))). Each round pairs players down the table by points,
+    looking a few places ahead to avoid rematches, and gives an odd player
+    out a bye worth a win.
+    """
+
+    name = "swiss"
+    allows_draws = True
+
+    def __init__(self, players, standings, rounds=None):
+        self.rounds = rounds or (math.ceil(math.log2(len(players))) if len(players) > 1 else 0)
+        self.played = 0
+
+    def next_round(self, standings):
+        if self.played >= self.rounds:
+            return None
+        self.played += 1
+        order = standings.ordered()
+        byes = []
+        if len(order) % 2:
+            for index in range(len(order) - 1, -1, -1):
+                if order[index] not in standings.byes:
+                    break
+            byes.append(order.pop(index))
+
+        pairs = []
+        stack = order[::-1]
+        while stack:
+            a = stack.pop()
+            played = standings.opponents[a]
+            partner = len(stack) - 1
+            for index in range(len(stack) - 1, max(-1, len(stack) - 1 - SWISS_LOOKAHEAD), -1):
+                if stack[index] not in played:
+                    partner = index
+                    break
+            pairs.append((a, stack.pop(partner)))
+        return pairs, byes
+
+    def round_complete(self, results):
+        pass
+
+    def winner(self, standings):
+        return standings.table(1)[0][1]
+
+
+FORMATS = {cls.name: cls for cls in (RoundRobin, SingleElimination, DoubleElimination, Swiss)}
+
+
+# Runner
+
+class Tournament:
+    """
+    Runs one event to completion. `match_function(player_a, player_b,
+    rule_set, best_of, rng)` plays a match and returns the round outcomes for
+    player_a; it must be a module level function so it can be sent to worker
+    processes. Chunks get their own deterministic random seed, so a given
+    `seed` replays the same event whatever the number of workers.
+    """
+
+    def __init__(self, players, format="swiss", name=None, rule_set=rules.CLASSIC, best_of=3,
+                 match_function=play_random_match, rounds=None, workers=None, chunk_size=CHUNK_SIZE,
+                 seed=None, record_results=True):
+        if len(set(players)) != len(players):
+            raise ValueError("Tournament players must be unique")
+        if format not in FORMATS:
+            raise ValueError(f"Unknown tournament format: {format}")
+        self.players = list(players)
+        self.name = name or f"{format} tournament"
+        self.rule_set = rule_set
+        self.best_of = best_of
+        self.match_function = match_function
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.seed = random.randrange(1 << 32) if seed is None else seed
+        self.record_results = record_results
+        self.standings = Standings(self.players)
+        self.format = FORMATS[format](self.players, self.standings, rounds)
+        self.tournament_id = None
+        self.rounds_played = 0
+        self.matches_played = 0
+        self.games_played = 0
+
+    def run(self, executor=None):
+        """Play every round and return the winner. Uses `executor` if given."""
+        if self.record_results:
+            with database.transaction(label="start_tournament") as conn:
+                self.tournament_id = conn.execute(
+                    INSERT_TOURNAMENT_SQL, (self.name, self.format.name, len(self.players))).lastrowid
+        own_executor = executor is None and self.workers > 1
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            while True:
+                round_ = self.format.next_round(self.standings)
+                if round_ is None:
+                    break
+                self.play_round(*round_, executor=executor)
+        finally:
+            if own_executor:
+                executor.shutdown()
+        winner = self.format.winner(self.standings)
+        if self.record_results:
+            write_behind.submit(FINISH_TOURNAMENT_SQL, (winner, self.tournament_id), label="finish_tournament")
+        logging.info("%s finished after %d rounds, %d matches: %s won.",
+                     self.name, self.rounds_played, self.matches_played, winner)
+        return winner
+
+    def play_round(self, pairs, byes=(), executor=None):
+        self.rounds_played += 1
+        for player in byes:
+            self.standings.record_bye(player)
+
+        chunks = [pairs[i:i + self.chunk_size] for i in range(0, len(pairs), self.chunk_size)]
+        seeds = [f"{self.seed}:{self.rounds_played}:{index}" for index in range(len(chunks))]
+        args = (self.match_function, self.rule_set.name, self.best_of)
+        if executor is None:
+            completed = ((chunk, _play_chunk(*args, seed, chunk)) for chunk, seed in zip(chunks, seeds))
+        else:
+            futures = {executor.submit(_play_chunk, *args, seed, chunk): chunk for chunk, seed in zip(chunks, seeds)}
+            completed = ((futures[future], future.result()) for future in as_completed(futures))
+
+        results, played = [], []
+        for chunk, outcomes_list in completed:
+            for (a, b), outcomes in zip(chunk, outcomes_list):
+                winner = match_winner(a, b, outcomes)
+                if winner is None and not self.format.allows_draws:
+                    # Still level after MAX_MATCH_ROUNDS: the better seed goes through
+                    winner = a if self.standings.seeds[a] < self.standings.seeds[b] else b
+                self.standings.record(a, b, winner)
+                results.append((a, b, winner))
+                played.append((a, b, outcomes))
+        self.format.round_complete(results)
+        self.matches_played += len(pairs)
+        self.games_played += sum(len(outcomes) for _, _, outcomes in played)
+        if self.record_results:
+            self._record_round(played)
+
+    def _record_round(self, played):
+        games, stats = [], {}
+        for a, b, outcomes in played:
+            for outcome in outcomes:
+                winner = a if outcome == "win" else (b if outcome == "loss" else None)
+                games.append((a, b, winner, self.tournament_id))
+            stats.setdefault(a, []).extend(outcomes)
+            stats.setdefault(b, []).extend(game_results.INVERTED[o] for o in outcomes)
+        write_behind.submit_many(INSERT_TOURNAMENT_GAME_SQL, games, label="record_round")
+        params = [game_results.session_stats_params(player, outcomes) for player, outcomes in stats.items()]
+        write_behind.submit_many(game_results.SESSION_STATS_SQL, params, label="record_round")
+        for row in params:
+            leaderboard.record_delta(row[5], row[4])
+            sessions.invalidate_profile(row[5])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a Rock, Paper, Scissors tournament between registered players.")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="swiss")
+    parser.add_argument("--name")
+    parser.add_argument("--best-of", type=int, default=3)
+    parser.add_argument("--rules", choices=sorted(rules.RULE_SETS), default=rules.CLASSIC.name)
+    parser.add_argument("--rounds", type=int, help="Rounds to play (Swiss and round-robin)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--no-record", action="store_true", help="Do not write results to the database")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    migrations.migrate()
+    # Seeded by current score, best first
+    players = [row[0] for row in leaderboard.fetch_page(0, -1)]
+    if len(players) < 2:
+        parser.error("At least two registered players are needed")
+    tournament = Tournament(players, args.format, name=args.name, rule_set=rules.RULE_SETS[args.rules],
+                            best_of=args.best_of, rounds=args.rounds, workers=args.workers, seed=args.seed,
+                            record_results=not args.no_record)
+    tournament.run()
+    for rank, player, points, wins, losses, draws in tournament.standings.table(10):
+        print(f"{rank:>3}. {player:<20} {points:>5.1f}  {wins}-{losses}-{draws}")
+    write_behind.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+import database
+import metrics
+
+# Durability levels map to the synchronous PRAGMA of the writer connection.
+#   "full":   fsync on every batch commit, survives power loss
+#   "normal": WAL default, survives process crashes, may lose the last batch on power loss
+#   "off":    leave flushing to the OS, fastest
+DURABILITY_LEVELS = {
+    "full": "FULL",
+    "normal": "NORMAL",
+    "off": "OFF",
+}
+
+MAX_PENDING = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.05  # seconds
+
+BATCH_SECONDS = metrics.histogram("rps_write_behind_batch_seconds", "Time to write and commit one write-behind batch.")
+BATCH_ENTRIES = metrics.counter("rps_write_behind_entries_total", "Entries committed by the write-behind queue.")
+PENDING = metrics.gauge("rps_write_behind_pending", "Entries queued but not yet written.")
+
+
+class _Marker:
+    """Queued behind pending writes; set once everything before it is committed."""
+
+    def __init__(self, stop=False):
+        self.done = threading.Event()
+        self.stop = stop
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-memory queue of write statements drained by one writer thread.
+
+    Callers hand over (sql, params) pairs, labelled with the helper that
+    queued them, and return immediately. The writer
+    groups whatever has accumulated, up to `batch_size` statements or
+    `flush_interval` seconds, into a single transaction so many results share
+    one commit. When the queue is full `submit` blocks, which pushes back on
+    producers instead of growing memory without bound.
+    """
+
+    def __init__(self, path=None, max_pending=MAX_PENDING, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, durability="normal"):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+
+    def submit(self, sql, params=(), timeout=None, label="write_behind"):
+        self._ensure_started()
+        self._queue.put((sql, [params], label), timeout=timeout)
+
+    def submit_many(self, sql, rows, timeout=None, label="write_behind"):
+        """Queue many parameter rows for one statement as a single entry."""
+        rows = list(rows)
+        if rows:
+            self._ensure_started()
+            self._queue.put((sql, rows, label), timeout=timeout)
+
+    def flush(self, timeout=None):
+        """Block until every statement submitted so far is committed."""
+        if self._thread is None:
+            return True
+        marker = _Marker()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=None):
+        if self._thread is None:
+            return
+        marker = _Marker(stop=True)
+        self._queue.put(marker)
+        marker.done.wait(timeout)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        pool = database.ConnectionPool(
+            self.path or database.get_pool().path,
+            size=1,
+            pragmas={"synchronous": DURABILITY_LEVELS[self.durability]},
+        )
+        conn = pool.acquire()
+        try:
+            stopping = False
+            while not stopping:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size and not isinstance(batch[-1], _Marker):
+                    remaining = deadline - time.monotonic()
+                    try:
+                        batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                statements = [item for item in batch if not isinstance(item, _Marker)]
+                if statements:
+                    self._write(conn, statements)
+                for item in batch:
+                    if isinstance(item, _Marker):
+                        stopping = stopping or item.stop
+                        item.done.set()
+        finally:
+            pool.release(conn)
+            pool.close()
+
+    def _write(self, conn, statements):
+        start = time.perf_counter()
+        try:
+            conn.execute("BEGIN")
+            self._execute_grouped(conn, statements)
+            conn.commit()
+            BATCH_SECONDS.observe(time.perf_counter() - start)
+            BATCH_ENTRIES.inc(len(statements))
+            logging.debug("Write-behind committed %d entries.", len(statements))
+        except Exception:
+            conn.rollback()
+            logging.exception("Write-behind batch failed, retrying %d entries one by one.", len(statements))
+            for sql, rows, _ in statements:
+                for params in rows:
+                    try:
+                        conn.execute(sql, params)
+                    except Exception:
+                        logging.exception("Dropping failed write: %s %r", sql.strip(), params)
+
+    @staticmethod
+    def _execute_grouped(conn, statements):
+        # Consecutive statements with the same SQL text go through executemany,
+        # which binds each row against a single prepared statement. Each run is
+        # timed under the label of the helper that queued it.
+        run_sql, run_label, run_params = None, None, []
+        for sql, rows, label in statements:
+            if sql != run_sql and run_params:
+                _execute_run(conn, run_sql, run_params, run_label)
+                run_params = []
+            run_sql, run_label = sql, label
+            run_params.extend(rows)
+        if run_params:
+            _execute_run(conn, run_sql, run_params, run_label)
+
+
+def _execute_run(conn, sql, rows, label):
+    start = time.perf_counter()
+    conn.executemany(sql, rows)
+    database.STATEMENT_SECONDS.labels(label).observe(time.perf_counter() - start)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure(**options):
+    """Replace the shared writer, flushing the previous one first."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+        _writer = WriteBehindQueue(**options)
+    return _writer
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehindQueue()
+    return _writer
+
+
+def submit(sql, params=(), label="write_behind"):
+    get_writer().submit(sql, params, label=label)
+
+
+def submit_many(sql, rows, label="write_behind"):
+    get_writer().submit_many(sql, rows, label=label)
+
+
+def flush(timeout=None):
+    if _writer is not None:
+        return _writer.flush(timeout)
+    return True
+
+
+def shutdown():
+    if _writer is not None:
+        _writer.close()
+
+
+PENDING.set_function(lambda: _writer.pending() if _writer is not None else 0)
+
+# Make sure queued results reach the database when the process exits normally
+atexit.register(shutdown)